@@ -4,25 +4,24 @@ import hashlib
 import json
 import os
 import sys
-import threading
 import time
 import traceback
 from json.decoder import JSONDecodeError
 from pathlib import Path
 
 import openai
-from jsonschema import Draft7Validator
 from rich.console import Console, Text
-from rich.live import Live
-from rich.markdown import Markdown
 
-from aider import models, prompts, utils
+from aider import httpclient, models, prompts, utils
 from aider.commands import Commands
 from aider.history import ChatSummary
 from aider.io import InputOutput
 from aider.repo import GitRepo
 from aider.repomap import RepoMap
-from aider.sendchat import send_with_retries
+from aider.sendchat import send_with_retries, take_retry_count
+from aider.stats import RequestStats
+from aider.tokens import TokenLedger
+from aider.watch import FileWatcher
 import aider.vscode as vscode
 import functools
 
@@ -52,6 +51,9 @@ class Coder:
     total_cost = 0.0
     num_exhausted_context_windows = 0
     last_keyboard_interrupt = None
+    dirty_files = None
+    prompt_layouts = ("default", "cache")
+    last_prompt_bytes = None
 
     @classmethod
     def create(
@@ -96,8 +98,15 @@ class Coder:
         show_diffs=False,
         auto_commits=True,
         dirty_commits=True,
+        async_commit_messages=False,
         dry_run=False,
         map_tokens=1024,
+        map_processes=None,
+        map_cache_dir=None,
+        map_rank_backend="networkx",
+        map_precompute=True,
+        watch_files=False,
+        prompt_layout="default",
         verbose=False,
         assistant_output_color="blue",
         code_theme="default",
@@ -115,9 +124,17 @@ class Coder:
 
         self.chat_completion_call_hashes = []
         self.chat_completion_response_hashes = []
+        self.request_stats = []
         self.need_commit_before_edits = set()
 
         self.verbose = verbose
+        self.map_precompute = map_precompute
+
+        if prompt_layout not in self.prompt_layouts:
+            raise ValueError(f"Unknown prompt layout {prompt_layout}")
+        self.prompt_layout = prompt_layout
+        self.prompt_prefix_stats = []
+
         self.abs_fnames = set()
         self.additional_context = {}
         self.cur_messages = []
@@ -143,6 +160,7 @@ class Coder:
             self.console = Console(force_terminal=False, no_color=True)
 
         self.main_model = main_model
+        self.token_ledger = TokenLedger(main_model)
 
         self.io.tool_output(f"Model: {main_model.name}")
 
@@ -164,7 +182,13 @@ class Coder:
 
         if use_git:
             try:
-                self.repo = GitRepo(self.io, fnames, git_dname, aider_ignore_file)
+                self.repo = GitRepo(
+                    self.io,
+                    fnames,
+                    git_dname,
+                    aider_ignore_file,
+                    async_commit_messages=async_commit_messages,
+                )
                 self.root = self.repo.root
             except FileNotFoundError:
                 self.repo = None
@@ -176,6 +200,11 @@ class Coder:
             self.io.tool_output("Git repo: none")
             self.find_common_root()
 
+        ignored_dirs = None
+        if watch_files and self.repo:
+            ignored_dirs = self.repo.get_ignored_dirs()
+        self.file_watcher = FileWatcher(self.root, watch=watch_files, ignored_dirs=ignored_dirs)
+
         if main_model.use_repo_map and self.repo and self.gpt_prompts.repo_content_prefix:
             self.repo_map = RepoMap(
                 map_tokens,
@@ -184,6 +213,11 @@ class Coder:
                 io,
                 self.gpt_prompts.repo_content_prefix,
                 self.verbose,
+                map_processes,
+                self.repo,
+                map_cache_dir,
+                map_rank_backend,
+                file_watcher=self.file_watcher,
             )
 
         if map_tokens > 0:
@@ -199,11 +233,13 @@ class Coder:
             self.main_model.max_chat_history_tokens,
         )
 
-        self.summarizer_thread = None
+        self.summarizer_future = None
         self.summarized_done_messages = []
 
         # validate the functions jsonschema
         if self.functions:
+            from jsonschema import Draft7Validator
+
             for function in self.functions:
                 Draft7Validator.check_schema(function)
 
@@ -328,6 +364,13 @@ class Coder:
         other_files = set(self.get_all_abs_files()) - set(self.abs_fnames)
         repo_content = self.repo_map.get_repo_map(self.abs_fnames, other_files)
         return repo_content
+
+    def precompute_repo_map(self):
+        if not self.repo_map or not self.map_precompute:
+            return
+
+        other_files = set(self.get_all_abs_files()) - set(self.abs_fnames)
+        self.repo_map.precompute(self.abs_fnames, other_files)
     
     def get_additional_context_messages(self):
         content = self.get_additional_context_content()
@@ -345,7 +388,7 @@ class Coder:
 
         return messages        
 
-    def get_files_messages(self):
+    def get_files_messages(self, include_repo_map=True):
         all_content = ""
         if self.abs_fnames:
             files_content = self.gpt_prompts.files_content_prefix
@@ -355,7 +398,7 @@ class Coder:
 
         all_content += files_content
 
-        repo_content = self.get_repo_map()
+        repo_content = self.get_repo_map() if include_repo_map else None
         if repo_content:
             if all_content:
                 all_content += "\n"
@@ -368,6 +411,43 @@ class Coder:
 
         return files_messages
 
+    def get_repo_map_messages(self):
+        repo_content = self.get_repo_map()
+        if not repo_content:
+            return []
+
+        return [
+            dict(role="user", content=repo_content),
+            dict(role="assistant", content="Ok."),
+        ]
+
+    def update_prompt_prefix_stats(self, messages):
+        """Note how many leading bytes of the prompt are the same as in the last request.
+
+        Providers that cache prompts can only reuse that prefix.
+        """
+        prompt_bytes = [json.dumps(msg).encode() for msg in messages]
+        prompt_len = sum(len(msg_bytes) for msg_bytes in prompt_bytes)
+
+        stable_len = 0
+        if self.last_prompt_bytes:
+            for msg_bytes, last_msg_bytes in zip(prompt_bytes, self.last_prompt_bytes):
+                if msg_bytes != last_msg_bytes:
+                    stable_len += len(os.path.commonprefix([msg_bytes, last_msg_bytes]))
+                    break
+                stable_len += len(msg_bytes)
+
+        self.last_prompt_bytes = prompt_bytes
+        self.prompt_prefix_stats.append((stable_len, prompt_len))
+
+        if self.verbose:
+            pct = 100 * stable_len / prompt_len if prompt_len else 0
+            self.io.tool_output(
+                f"Prompt: {stable_len} of {prompt_len} bytes same as the last request ({pct:.0f}%)"
+            )
+
+        return stable_len, prompt_len
+
     def run(self, with_message=None):
         while True:
             try:
@@ -409,26 +489,32 @@ class Coder:
         if self.verbose:
             self.io.tool_output("Starting to summarize chat history.")
 
-        self.summarizer_thread = threading.Thread(target=self.summarize_worker)
-        self.summarizer_thread.start()
+        self.summarizer_future = httpclient.submit(self.summarize_worker())
 
-    def summarize_worker(self):
+    async def summarize_worker(self):
+        self.summarized_done_messages = None
         try:
-            self.summarized_done_messages = self.summarizer.summarize(self.done_messages)
+            self.summarized_done_messages = await self.summarizer.summarize_async(
+                self.done_messages
+            )
         except ValueError as err:
             self.io.tool_error(err.args[0])
+        except Exception as err:
+            # eg: the api kept failing, so carry on with the whole history
+            self.io.tool_error(f"Unable to summarize chat history: {err}")
 
         if self.verbose:
             self.io.tool_output("Finished summarizing chat history.")
 
     def summarize_end(self):
-        if self.summarizer_thread is None:
+        if self.summarizer_future is None:
             return
 
-        self.summarizer_thread.join()
-        self.summarizer_thread = None
+        self.summarizer_future.result()
+        self.summarizer_future = None
 
-        self.done_messages = self.summarized_done_messages
+        if self.summarized_done_messages is not None:
+            self.done_messages = self.summarized_done_messages
         self.summarized_done_messages = []
 
     def move_back_cur_messages(self, message):
@@ -443,11 +529,18 @@ class Coder:
         self.cur_messages = []
 
     def run_loop(self):
+        self.finish_commit_message(wait=False)
+        self.show_git_stats()
+
+        # get the repo map ready while the user types
+        self.precompute_repo_map()
+
         inp = self.io.get_input(
             self.root,
             self.get_inchat_relative_files() + list(self.additional_context.keys()),
             self.get_addable_relative_files(),
             self.commands,
+            file_watcher=self.file_watcher,
         )
 
         if not inp:
@@ -473,18 +566,26 @@ class Coder:
             dict(role="system", content=main_sys),
         ]
 
-        messages += self.get_additional_context_messages()
-        self.summarize_end()
-        messages += self.done_messages
-        messages += self.get_files_messages()
+        if self.prompt_layout == "cache":
+            # most to least stable, so each request shares a long prefix with the last one
+            messages += self.get_repo_map_messages()
+            messages += self.get_additional_context_messages()
+            messages += self.get_files_messages(include_repo_map=False)
+            self.summarize_end()
+            messages += self.done_messages
+        else:
+            messages += self.get_additional_context_messages()
+            self.summarize_end()
+            messages += self.done_messages
+            messages += self.get_files_messages()
 
         reminder_message = [
             dict(role="system", content=self.fmt_system_prompt(self.gpt_prompts.system_reminder)),
         ]
 
-        messages_tokens = self.main_model.token_count(messages)
-        reminder_tokens = self.main_model.token_count(reminder_message)
-        cur_tokens = self.main_model.token_count(self.cur_messages)
+        messages_tokens = self.token_ledger.token_count(messages)
+        reminder_tokens = self.token_ledger.token_count(reminder_message)
+        cur_tokens = self.token_ledger.token_count(self.cur_messages)
 
         if None not in (messages_tokens, reminder_tokens, cur_tokens):
             total_tokens = messages_tokens + reminder_tokens + cur_tokens
@@ -506,6 +607,7 @@ class Coder:
         ]
 
         messages = self.format_messages()
+        self.update_prompt_prefix_stats(messages)
 
         if self.verbose:
             utils.show_messages(messages, functions=self.functions)
@@ -631,18 +733,24 @@ class Coder:
         self.partial_response_content = ""
         self.partial_response_function_call = dict()
 
+        request_stats = RequestStats(model, self.stream)
+        take_retry_count()
+
         interrupted = False
         try:
             hash_object, completion = send_with_retries(model, messages, functions, self.stream)
             self.chat_completion_call_hashes.append(hash_object.hexdigest())
+            request_stats.response(take_retry_count())
 
             if self.stream:
-                self.show_send_output_stream(completion)
+                self.show_send_output_stream(completion, request_stats)
             else:
-                self.show_send_output(completion)
+                self.show_send_output(completion, request_stats)
         except KeyboardInterrupt:
             self.keyboard_interrupt()
             interrupted = True
+        finally:
+            self.finish_request_stats(request_stats, interrupted)
 
         if self.partial_response_content:
             self.io.ai_output(self.partial_response_content)
@@ -654,7 +762,26 @@ class Coder:
 
         return interrupted
 
-    def show_send_output(self, completion):
+    def finish_request_stats(self, request_stats, interrupted):
+        if request_stats.response_time is None:
+            # the request never got a reply
+            request_stats.retries = take_retry_count()
+
+        completion_tokens = request_stats.completion_tokens
+        if completion_tokens is None and request_stats.bytes_received:
+            # streamed replies don't report their usage
+            text = self.partial_response_content
+            if self.partial_response_function_call:
+                text += json.dumps(self.partial_response_function_call)
+            completion_tokens = self.main_model.token_count(text)
+
+        request_stats.finish(completion_tokens, interrupted)
+        self.request_stats.append(request_stats.to_dict())
+
+        if self.verbose:
+            dump(self.request_stats[-1])
+
+    def show_send_output(self, completion, request_stats=None):
         if self.verbose:
             print(completion)
 
@@ -674,9 +801,13 @@ class Coder:
             function_call=self.partial_response_function_call,
             content=self.partial_response_content,
         )
-        resp_hash = hashlib.sha1(json.dumps(resp_hash, sort_keys=True).encode())
+        resp_json = json.dumps(resp_hash, sort_keys=True)
+        resp_hash = hashlib.sha1(resp_json.encode())
         self.chat_completion_response_hashes.append(resp_hash.hexdigest())
 
+        if request_stats:
+            request_stats.received(resp_json)
+
         if show_func_err and show_content_err:
             self.io.tool_error(show_func_err)
             self.io.tool_error(show_content_err)
@@ -686,6 +817,8 @@ class Coder:
         if hasattr(completion, "usage"):
             prompt_tokens = completion.usage.prompt_tokens
             completion_tokens = completion.usage.completion_tokens
+            if request_stats:
+                request_stats.completion_tokens = completion_tokens
 
             tokens = f"{prompt_tokens} prompt tokens, {completion_tokens} completion tokens"
             if self.main_model.prompt_price:
@@ -696,6 +829,8 @@ class Coder:
 
         show_resp = self.render_incremental_response(True)
         if self.show_pretty():
+            from rich.markdown import Markdown
+
             show_resp = Markdown(
                 show_resp, style=self.assistant_output_color, code_theme=self.code_theme
             )
@@ -707,9 +842,12 @@ class Coder:
         if tokens is not None:
             self.io.tool_output(tokens)
 
-    def show_send_output_stream(self, completion):
+    def show_send_output_stream(self, completion, request_stats=None):
         live = None
         if self.show_pretty():
+            # rich.live and rich.markdown are slow to import, so only load them to show replies
+            from rich.live import Live
+
             live = Live(vertical_overflow="scroll")
 
         try:
@@ -734,6 +872,8 @@ class Coder:
                             self.partial_response_function_call[k] += v
                         else:
                             self.partial_response_function_call[k] = v
+                        if request_stats:
+                            request_stats.received(v)
                 except AttributeError:
                     pass
 
@@ -744,6 +884,9 @@ class Coder:
                 except AttributeError:
                     text = None
 
+                if request_stats:
+                    request_stats.received(text)
+
                 if self.show_pretty():
                     self.live_incremental_response(live, False)
                 elif text:
@@ -759,6 +902,8 @@ class Coder:
         if not show_resp:
             return
 
+        from rich.markdown import Markdown
+
         md = Markdown(show_resp, style=self.assistant_output_color, code_theme=self.code_theme)
         live.update(md)
 
@@ -778,7 +923,7 @@ class Coder:
         else:
             files = self.get_inchat_relative_files()
 
-        files = [fname for fname in files if Path(self.abs_root_path(fname)).is_file()]
+        files = [fname for fname in files if self.file_watcher.is_file(self.abs_root_path(fname))]
         return sorted(set(files))
 
     def get_all_abs_files(self):
@@ -787,10 +932,11 @@ class Coder:
         return files
 
     def get_last_modified(self):
-        files = [Path(fn) for fn in self.get_all_abs_files() if Path(fn).exists()]
-        if not files:
+        mtimes = [self.file_watcher.get_mtime(fname) for fname in self.get_all_abs_files()]
+        mtimes = [mtime for mtime in mtimes if mtime is not None]
+        if not mtimes:
             return 0
-        return max(path.stat().st_mtime for path in files)
+        return max(mtimes)
 
     def get_addable_relative_files(self):
         return set(self.get_all_relative_files()) - set(self.get_inchat_relative_files())
@@ -800,7 +946,12 @@ class Coder:
             return
         if not self.dirty_commits:
             return
-        if not self.repo.is_dirty(path):
+
+        if self.dirty_files is not None:
+            is_dirty = path in self.dirty_files
+        else:
+            is_dirty = self.repo.is_dirty(path)
+        if not is_dirty:
             return
 
         fullp = Path(self.abs_root_path(path))
@@ -861,16 +1012,23 @@ class Coder:
 
         self.need_commit_before_edits = set()
 
-        for edit in edits:
-            path = edit[0]
-            if path in seen:
-                allowed = seen[path]
-            else:
-                allowed = self.allowed_to_edit(path)
-                seen[path] = allowed
+        # ask git about all the edited paths at once, rather than one by one
+        if self.repo and self.dirty_commits:
+            self.dirty_files = self.repo.get_dirty_files(set(edit[0] for edit in edits))
+
+        try:
+            for edit in edits:
+                path = edit[0]
+                if path in seen:
+                    allowed = seen[path]
+                else:
+                    allowed = self.allowed_to_edit(path)
+                    seen[path] = allowed
 
-            if allowed:
-                res.append(edit)
+                if allowed:
+                    res.append(edit)
+        finally:
+            self.dirty_files = None
 
         self.dirty_commit()
         self.need_commit_before_edits = set()
@@ -913,6 +1071,10 @@ class Coder:
 
         self.apply_update_errors = 0
 
+        # don't wait for the watcher to notice our own edits
+        for path in edited:
+            self.file_watcher.invalidate(self.abs_root_path(path))
+
         for path in edited:
             if self.dry_run:
                 self.io.tool_output(f"Did not apply edit to {path} (--dry-run)")
@@ -964,6 +1126,10 @@ class Coder:
             commit_hash, commit_message = res
             self.last_aider_commit_hash = commit_hash
 
+            # the hash and message are provisional until the commit is amended
+            if self.repo.pending_commit:
+                return self.gpt_prompts.files_content_gpt_edits_pending
+
             return self.gpt_prompts.files_content_gpt_edits.format(
                 hash=commit_hash,
                 message=commit_message,
@@ -972,6 +1138,27 @@ class Coder:
         self.io.tool_output("No changes made to git tracked files.")
         return self.gpt_prompts.files_content_gpt_no_edits
 
+    def finish_commit_message(self, wait=True):
+        if not self.repo:
+            return
+
+        self.repo.finish_commit_message(wait=wait)
+
+        # repo.commit() may have amended it already, eg: for a dirty commit
+        old_hash = self.last_aider_commit_hash
+        self.last_aider_commit_hash = self.repo.amended_commits.get(old_hash, old_hash)
+
+    def show_git_stats(self):
+        if not self.repo:
+            return
+
+        if self.verbose:
+            num_commands, elapsed = self.repo.get_git_stats()
+            if num_commands:
+                self.io.tool_output(f"Git: ran {num_commands} commands in {elapsed:.2f}s")
+
+        self.repo.reset_git_stats()
+
     def dirty_commit(self):
         if not self.need_commit_before_edits:
             return
@@ -988,8 +1175,12 @@ class Coder:
 
 
 def check_model_availability(io, main_model):
-    available_models = openai.Model.list()
-    model_ids = sorted(model.id for model in available_models["data"])
+    model_ids = sorted(details["id"] for details in models.list_models())
+    if main_model.name in model_ids:
+        return True
+
+    # the cached list may be older than the api key's access to the model
+    model_ids = sorted(details["id"] for details in models.list_models(refresh=True))
     if main_model.name in model_ids:
         return True
 
@@ -1,6 +1,8 @@
 class CoderPrompts:
     files_content_gpt_edits = "I committed the changes with git hash {hash} & commit msg: {message}"
 
+    files_content_gpt_edits_pending = "I committed the changes."
+
     files_content_gpt_edits_no_repo = "I updated the files."
 
     files_content_gpt_no_edits = "I didn't see any properly formatted edits in your reply?!"
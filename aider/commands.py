@@ -6,12 +6,12 @@ import os
 import shutil
 from tempfile import NamedTemporaryFile
 
-import git
 from prompt_toolkit.completion import Completion
 
-from aider import prompts, voice
+from aider import prompts, ratelimit, sendchat, voice
 from aider import vscode
 from aider.logs import get_logger
+from aider.stats import summarize
 from aider.utils import scrape
 
 from .dump import dump  # noqa: F401
@@ -107,9 +107,11 @@ class Commands:
     def cmd_tokens(self, args):
         "Report on the number of tokens used by the current chat context"
 
-        res = []
+        # (texts, label, tip) for each row, so they can all be counted in one batch
+        blocks = []
 
         self.coder.choose_fence()
+        ledger = self.coder.token_ledger
 
         # system messages
         main_sys = self.coder.fmt_system_prompt(self.coder.gpt_prompts.main_system)
@@ -122,23 +124,21 @@ class Commands:
             ),
         ]
 
-        tokens = self.coder.main_model.token_count(msgs)
-        res.append((tokens, "system messages", ""))
+        blocks.append(([ledger.message_text(msg) for msg in msgs], "system messages", ""))
 
         # chat history
         msgs = self.coder.done_messages + self.coder.cur_messages
         if msgs:
-            msgs = [dict(role="dummy", content=msg) for msg in msgs]
-            tokens = self.coder.main_model.token_count(msgs)
-            res.append((tokens, "chat history", "use /clear to clear"))
+            # the same blocks as in the prompt, so their counts are reused
+            texts = [ledger.message_text(msg) for msg in msgs]
+            blocks.append((texts, "chat history", "use /clear to clear"))
 
         # repo map
         other_files = set(self.coder.get_all_abs_files()) - set(self.coder.abs_fnames)
         if self.coder.repo_map:
             repo_content = self.coder.repo_map.get_repo_map(self.coder.abs_fnames, other_files)
             if repo_content:
-                tokens = self.coder.main_model.token_count(repo_content)
-                res.append((tokens, "repository map", "use --map-tokens to resize"))
+                blocks.append(([repo_content], "repository map", "use --map-tokens to resize"))
 
         # files
         for fname in self.coder.abs_fnames:
@@ -146,15 +146,16 @@ class Commands:
             content = self.io.read_text(fname)
             # approximate
             content = f"{relative_fname}\n```\n" + content + "```\n"
-            tokens = self.coder.main_model.token_count(content)
-            res.append((tokens, f"{relative_fname}", "use /drop to drop from chat"))
-        
+            blocks.append(([content], f"{relative_fname}", "use /drop to drop from chat"))
+
         # additional context
         for key, item in self.coder.additional_context.items():
             # approximate
             content = f"Context item: {key}\n" + item + "END of context item: {key}\n"
-            tokens = self.coder.main_model.token_count(content)
-            res.append((tokens, f"{key}", "use /drop to drop from chat"))
+            blocks.append(([content], f"{key}", "use /drop to drop from chat"))
+
+        counts = iter(ledger.count_texts(text for texts, _, _ in blocks for text in texts))
+        res = [(sum(next(counts) for _ in texts), label, tip) for texts, label, tip in blocks]
 
         self.io.tool_output("Approximate context window usage, in tokens:")
         self.io.tool_output()
@@ -193,12 +194,68 @@ class Commands:
             self.io.tool_error(f"{cost_pad}{fmt(remaining)} tokens remaining, window exhausted!")
         self.io.tool_output(f"{cost_pad}{fmt(limit)} tokens max context window size")
 
+    def cmd_stats(self, args):
+        "Report where the time went in this session's requests to the LLM"
+        request_stats = self.coder.request_stats
+        if not request_stats:
+            self.io.tool_output("No requests sent yet.")
+        else:
+            self.show_request_stats(request_stats)
+
+        self.io.tool_output()
+
+        limits = ratelimit.get_limiter().get_stats()
+        self.io.tool_output(
+            f"Rate limits: {limits['num_rate_limited']} errors, waited"
+            f" {limits['wait_time']:.1f}s over {limits['num_waits']} waits"
+        )
+
+        if sendchat.CACHE is not None:
+            for model, (hits, misses) in sendchat.CACHE.get_stats().items():
+                self.io.tool_output(f"Response cache: {hits} hits, {misses} misses for {model}")
+
+        ledger = self.coder.token_ledger
+        self.io.tool_output(f"Token counts: {ledger.hits} reused, {ledger.misses} tokenized")
+
+    def show_request_stats(self, request_stats, max_rows=10):
+        def fmt(val, spec):
+            if val is None:
+                return "-"
+            return format(val, spec)
+
+        self.io.tool_output(
+            f"{'latency':>8} {'ttft':>7} {'tok/s':>7} {'tokens':>7} {'bytes':>8} {'retries':>7}"
+        )
+        for stats in request_stats[-max_rows:]:
+            note = stats["model"]
+            if stats["interrupted"]:
+                note += " (interrupted)"
+            self.io.tool_output(
+                f"{fmt(stats['latency'], '7.2f')}s"
+                f" {fmt(stats['time_to_first_token'], '6.2f')}s"
+                f" {fmt(stats['tokens_per_sec'], '7.1f')}"
+                f" {fmt(stats['completion_tokens'], '7,')}"
+                f" {fmt(stats['bytes_received'], '8,')}"
+                f" {stats['retries']:7} {note}"
+            )
+
+        summary = summarize(request_stats)
+        self.io.tool_output(
+            f"{summary['num_requests']} requests, {summary['total_latency']:.1f}s in total,"
+            f" median time to first token {fmt(summary['median_time_to_first_token'], '.2f')}s,"
+            f" median {fmt(summary['median_tokens_per_sec'], '.1f')} tokens/s,"
+            f" {summary['retries']} retries"
+        )
+
     def cmd_undo(self, args):
         "Undo the last git commit if it was done by aider"
         if not self.coder.repo:
             self.io.tool_error("No git repository found.")
             return
 
+        # the last commit may still be waiting on its message
+        self.coder.finish_commit_message()
+
         if self.coder.repo.is_dirty():
             self.io.tool_error(
                 "The repository has uncommitted changes. Please commit or stash them before"
@@ -206,15 +263,11 @@ class Commands:
             )
             return
 
-        local_head = self.coder.repo.repo.git.rev_parse("HEAD")
+        local_head = self.coder.repo.rev_parse("HEAD")
         current_branch = self.coder.repo.repo.active_branch.name
-        try:
-            remote_head = self.coder.repo.repo.git.rev_parse(f"origin/{current_branch}")
-            has_origin = True
-        except git.exc.GitCommandError:
-            has_origin = False
+        remote_head = self.coder.repo.rev_parse(f"origin/{current_branch}")
 
-        if has_origin:
+        if remote_head:
             if local_head == remote_head:
                 self.io.tool_error(
                     "The last commit has already been pushed to the origin. Undoing is not"
@@ -249,6 +302,9 @@ class Commands:
             self.io.tool_error("No git repository found.")
             return
 
+        # the last commit may still be waiting on its message
+        self.coder.finish_commit_message()
+
         if not self.coder.last_aider_commit_hash:
             self.io.tool_error("No previous aider commit found.")
             self.io.tool_error("You could try `/git diff` or `/git diff HEAD^`.")
@@ -445,6 +501,9 @@ class Commands:
 
     def cmd_git(self, args):
         "Run a git command"
+        # eg: a push must not be followed by amending the pushed commit
+        self.coder.finish_commit_message()
+
         combined_output = None
         try:
             args = "git " + args
@@ -461,6 +520,9 @@ class Commands:
         except Exception as e:
             self.io.tool_error(f"Error running git command: {e}")
 
+        # it may have changed any file, faster than the watcher can tell
+        self.coder.file_watcher.invalidate()
+
         if combined_output is None:
             return
 
@@ -477,6 +539,8 @@ class Commands:
         except Exception as e:
             self.io.tool_error(f"Error running command: {e}")
 
+        self.coder.file_watcher.invalidate()
+
         if combined_output is None:
             return
 
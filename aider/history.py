@@ -1,9 +1,10 @@
 import argparse
 import json
 
-from aider import models, prompts
+from aider import httpclient, models, prompts
 from aider.dump import dump  # noqa: F401
-from aider.sendchat import simple_send_with_retries
+from aider.sendchat import simple_send_with_retries_async
+from aider.tokens import count_tokens_batch
 
 
 class ChatSummary:
@@ -18,13 +19,16 @@ class ChatSummary:
         return total > self.max_tokens
 
     def tokenize(self, messages):
-        sized = []
-        for msg in messages:
-            tokens = len(self.tokenizer.encode(json.dumps(msg)))
-            sized.append((tokens, msg))
-        return sized
+        counts = count_tokens_batch(self.tokenizer, [json.dumps(msg) for msg in messages])
+        return list(zip(counts, messages))
 
     def summarize(self, messages, depth=0):
+        return httpclient.submit(self.summarize_async(messages, depth)).result()
+
+    def summarize_all(self, messages):
+        return httpclient.submit(self.summarize_all_async(messages)).result()
+
+    async def summarize_async(self, messages, depth=0):
         sized = self.tokenize(messages)
         total = sum(tokens for tokens, _msg in sized)
         if total <= self.max_tokens and depth == 0:
@@ -32,7 +36,7 @@ class ChatSummary:
 
         min_split = 4
         if len(messages) <= min_split or depth > 3:
-            return self.summarize_all(messages)
+            return await self.summarize_all_async(messages)
 
         tail_tokens = 0
         split_index = len(messages)
@@ -52,12 +56,12 @@ class ChatSummary:
             split_index -= 1
 
         if split_index <= min_split:
-            return self.summarize_all(messages)
+            return await self.summarize_all_async(messages)
 
         head = messages[:split_index]
         tail = messages[split_index:]
 
-        summary = self.summarize_all(head)
+        summary = await self.summarize_all_async(head)
 
         tail_tokens = sum(tokens for tokens, msg in sized[split_index:])
         summary_tokens = len(self.tokenizer.encode(json.dumps(summary)))
@@ -66,9 +70,9 @@ class ChatSummary:
         if summary_tokens + tail_tokens < self.max_tokens:
             return result
 
-        return self.summarize(result, depth + 1)
+        return await self.summarize_async(result, depth + 1)
 
-    def summarize_all(self, messages):
+    async def summarize_all_async(self, messages):
         content = ""
         for msg in messages:
             role = msg["role"].upper()
@@ -84,7 +88,7 @@ class ChatSummary:
             dict(role="user", content=content),
         ]
 
-        summary = simple_send_with_retries(self.model.name, messages)
+        summary = await simple_send_with_retries_async(self.model.name, messages)
         if summary is None:
             raise ValueError(f"summarizer unexpectedly failed for {self.model.name}")
         summary = prompts.summary_prefix + summary
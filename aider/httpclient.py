@@ -0,0 +1,155 @@
+import asyncio
+import socket
+import threading
+
+import aiohttp
+import openai
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection
+
+from aider.dump import dump  # noqa: F401
+
+# connections kept open per host, enough for the main thread plus the
+# summarizer and commit message threads
+DEFAULT_POOL_SIZE = 10
+
+# like openai's own session
+MAX_CONNECTION_RETRIES = 2
+
+pool_size = DEFAULT_POOL_SIZE
+session = None
+session_lock = threading.Lock()
+
+# runs the asyncio requests made from sync code, all on one thread
+background_loop = None
+background_session = None
+
+
+class SharedSession(requests.Session):
+    """A Session which outlives its users closing it.
+
+    openai closes the session of each thread every few minutes, which would
+    drop the pooled connections of every other thread too.
+    """
+
+    def close(self):
+        pass
+
+    def shutdown(self):
+        super().close()
+
+
+class KeepAliveAdapter(HTTPAdapter):
+    """An HTTPAdapter whose connections ask the OS for TCP keep-alives.
+
+    The LLM apis can go minutes between requests while the user types, which
+    is long enough for a NAT or load balancer to silently drop an idle pooled
+    connection.
+    """
+
+    def init_poolmanager(self, *args, **kwargs):
+        socket_options = list(HTTPConnection.default_socket_options)
+        socket_options.append((socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1))
+        for name, value in (("TCP_KEEPIDLE", 60), ("TCP_KEEPINTVL", 30), ("TCP_KEEPCNT", 4)):
+            if hasattr(socket, name):
+                socket_options.append((socket.IPPROTO_TCP, getattr(socket, name), value))
+
+        kwargs["socket_options"] = socket_options
+        super().init_poolmanager(*args, **kwargs)
+
+
+def get_session():
+    """The requests.Session that every thread shares, so connections get reused.
+
+    It is made on first use, after main() has configured openai.
+    """
+    global session
+
+    if session is not None:
+        return session
+
+    with session_lock:
+        if session is None:
+            session = make_session()
+        return session
+
+
+def make_session():
+    new_session = SharedSession()
+
+    if openai.proxy:
+        if isinstance(openai.proxy, str):
+            new_session.proxies = {"http": openai.proxy, "https": openai.proxy}
+        else:
+            new_session.proxies = dict(openai.proxy)
+
+    adapter = KeepAliveAdapter(
+        pool_connections=pool_size,
+        pool_maxsize=pool_size,
+        max_retries=MAX_CONNECTION_RETRIES,
+    )
+    new_session.mount("https://", adapter)
+    new_session.mount("http://", adapter)
+
+    return new_session
+
+
+def configure(new_pool_size=None):
+    """Set the pool size, and start using the shared session for the openai api calls."""
+    global pool_size, session
+
+    with session_lock:
+        if new_pool_size is not None and new_pool_size != pool_size:
+            pool_size = new_pool_size
+            if session is not None:
+                session.shutdown()
+                session = None
+
+    use_for_openai()
+
+
+def use_for_openai():
+    # openai calls this for every request, instead of keeping a session per thread
+    if openai.requestssession is None:
+        openai.requestssession = get_session
+
+
+def get_background_loop():
+    """The event loop for background requests, running forever on a daemon thread."""
+    global background_loop
+
+    with session_lock:
+        if background_loop is None:
+            loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=loop.run_forever, name="aider-requests", daemon=True)
+            thread.start()
+            background_loop = loop
+        return background_loop
+
+
+def submit(coro):
+    """Run the coroutine on the background loop, and return a concurrent.futures.Future.
+
+    Requests from the summarizer, commit message generation and so on all
+    share that one thread and its connection pool, rather than a thread each.
+    """
+    return asyncio.run_coroutine_threadsafe(coro, get_background_loop())
+
+
+def use_for_openai_async():
+    """Make openai's async calls in the current task share the background loop's connections.
+
+    On any other loop openai opens a session per request, since a shared one
+    couldn't be closed before that loop ends.
+    """
+    global background_session
+
+    if asyncio.get_running_loop() is not background_loop:
+        return
+
+    if background_session is None:
+        connector = aiohttp.TCPConnector(limit_per_host=pool_size, keepalive_timeout=60)
+        background_session = aiohttp.ClientSession(connector=connector)
+
+    openai.aiosession.set(background_session)
@@ -21,7 +21,16 @@ from .dump import dump  # noqa: F401
 
 
 class AutoCompleter(Completer):
-    def __init__(self, root, rel_fnames, addable_rel_fnames, commands, encoding):
+    def __init__(
+        self,
+        root,
+        rel_fnames,
+        addable_rel_fnames,
+        commands,
+        encoding,
+        file_watcher=None,
+        words_cache=None,
+    ):
         self.commands = commands
         self.addable_rel_fnames = addable_rel_fnames
         self.rel_fnames = rel_fnames
@@ -39,21 +48,47 @@ class AutoCompleter(Completer):
         for rel_fname in addable_rel_fnames:
             self.words.add(rel_fname)
 
+        if words_cache is None:
+            words_cache = dict()
+
         for rel_fname in rel_fnames:
             self.words.add(rel_fname)
 
             fname = Path(root) / rel_fname
-            try:
-                with open(fname, "r", encoding=self.encoding) as f:
-                    content = f.read()
-            except (FileNotFoundError, UnicodeDecodeError):
+
+            # only re-read and re-lex the files which changed since last time
+            if file_watcher:
+                mtime = file_watcher.get_mtime(fname)
+            else:
+                try:
+                    mtime = os.path.getmtime(fname)
+                except OSError:
+                    mtime = None
+
+            cached = words_cache.get(fname)
+            if mtime is not None and cached and cached[0] == mtime:
+                self.words.update(cached[1])
                 continue
-            try:
-                lexer = guess_lexer_for_filename(fname, content)
-            except ClassNotFound:
+
+            words = self.get_file_words(fname)
+            if words is None:
                 continue
-            tokens = list(lexer.get_tokens(content))
-            self.words.update(token[1] for token in tokens if token[0] in Token.Name)
+
+            words_cache[fname] = (mtime, words)
+            self.words.update(words)
+
+    def get_file_words(self, fname):
+        try:
+            with open(fname, "r", encoding=self.encoding) as f:
+                content = f.read()
+        except (FileNotFoundError, UnicodeDecodeError):
+            return
+        try:
+            lexer = guess_lexer_for_filename(fname, content)
+        except ClassNotFound:
+            return
+        tokens = list(lexer.get_tokens(content))
+        return set(token[1] for token in tokens if token[0] in Token.Name)
 
     def get_completions(self, document, complete_event):
         text = document.text_before_cursor
@@ -133,6 +168,9 @@ class InputOutput:
         self.encoding = encoding
         self.dry_run = dry_run
 
+        # the autocomplete words from each file in the chat, with its mtime
+        self.completion_words = dict()
+
         if pretty:
             self.console = Console()
         else:
@@ -162,7 +200,7 @@ class InputOutput:
         with open(str(filename), "w", encoding=self.encoding) as f:
             f.write(content)
 
-    def get_input(self, root, rel_fnames, addable_rel_fnames, commands):
+    def get_input(self, root, rel_fnames, addable_rel_fnames, commands, file_watcher=None):
         if self.pretty:
             style = dict(style=self.user_input_color) if self.user_input_color else dict()
             self.console.rule(**style)
@@ -190,7 +228,13 @@ class InputOutput:
 
         while True:
             completer_instance = AutoCompleter(
-                root, rel_fnames, addable_rel_fnames, commands, self.encoding
+                root,
+                rel_fnames,
+                addable_rel_fnames,
+                commands,
+                self.encoding,
+                file_watcher,
+                self.completion_words,
             )
             if multiline_input:
                 show = ". "
@@ -342,3 +386,28 @@ class InputOutput:
         if self.chat_history_file is not None:
             with self.chat_history_file.open("a", encoding=self.encoding) as f:
                 f.write(text)
+
+
+class DeferredIO:
+    """Wraps an InputOutput, holding back its messages until flush() is called."""
+
+    def __init__(self, io):
+        self.io = io
+        self.messages = []
+
+    def __getattr__(self, name):
+        return getattr(self.io, name)
+
+    def tool_output(self, *args, **kwargs):
+        self.messages.append((self.io.tool_output, args, kwargs))
+
+    def tool_error(self, *args, **kwargs):
+        self.messages.append((self.io.tool_error, args, kwargs))
+
+    # so that its errors are deferred too
+    read_text = InputOutput.read_text
+
+    def flush(self):
+        for method, args, kwargs in self.messages:
+            method(*args, **kwargs)
+        self.messages = []
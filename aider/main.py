@@ -7,7 +7,7 @@ import configargparse
 import git
 import openai
 
-from aider import __version__, models
+from aider import __version__, httpclient, models, ratelimit, sendchat
 from aider.coders import Coder
 from aider.io import InputOutput
 from aider.repo import GitRepo
@@ -203,6 +203,37 @@ def main(argv=None, input=None, output=None, force_git_root=None):
         metavar="OPENAI_API_ENGINE",
         help="Specify the engine arg to be passed to openai.ChatCompletion.create()",
     )
+    model_group.add_argument(
+        "--cache-responses",
+        action=argparse.BooleanOptionalAction,
+        default=False,
+        help=(
+            "Enable/disable reusing the replies to identical commit message and chat summary"
+            f" requests from {sendchat.CACHE_PATH} (default: False)"
+        ),
+    )
+    model_group.add_argument(
+        "--http-pool-size",
+        type=int,
+        default=httpclient.DEFAULT_POOL_SIZE,
+        metavar="HTTP_POOL_SIZE",
+        help=(
+            "Specify how many connections to keep open to each api host"
+            f" (default: {httpclient.DEFAULT_POOL_SIZE})"
+        ),
+    )
+    model_group.add_argument(
+        "--requests-per-minute",
+        type=int,
+        metavar="REQUESTS_PER_MINUTE",
+        help="Specify the api request budget to pace all requests within (default: learned)",
+    )
+    model_group.add_argument(
+        "--tokens-per-minute",
+        type=int,
+        metavar="TOKENS_PER_MINUTE",
+        help="Specify the api token budget to pace all requests within (default: learned)",
+    )
     model_group.add_argument(
         "--edit-format",
         metavar="EDIT_FORMAT",
@@ -215,6 +246,52 @@ def main(argv=None, input=None, output=None, force_git_root=None):
         default=1024,
         help="Max number of tokens to use for repo map, use 0 to disable (default: 1024)",
     )
+    model_group.add_argument(
+        "--map-processes",
+        type=int,
+        default=None,
+        help="Max number of processes used to parse files for the repo map (default: all cores)",
+    )
+    model_group.add_argument(
+        "--map-cache-dir",
+        metavar="MAP_CACHE_DIR",
+        default=None,
+        help=(
+            "Specify a directory for the repo map's content addressed tags cache, which can be"
+            " shared between clones and users (default: in the git root)"
+        ),
+    )
+    model_group.add_argument(
+        "--map-rank-backend",
+        choices=["networkx", "sparse"],
+        default="networkx",
+        help="Specify how to rank the repo map, sparse is faster on big repos (default: networkx)",
+    )
+    model_group.add_argument(
+        "--map-precompute",
+        action=argparse.BooleanOptionalAction,
+        default=True,
+        help="Enable/disable precomputing the repo map while you type (default: True)",
+    )
+    model_group.add_argument(
+        "--prompt-layout",
+        choices=["default", "cache"],
+        default="default",
+        help=(
+            "Specify how to order the prompt, cache puts the repo map and files before the chat"
+            " history so providers can cache more of it (default: default)"
+        ),
+    )
+    model_group.add_argument(
+        "--watch-files",
+        action=argparse.BooleanOptionalAction,
+        default=False,
+        help=(
+            "Enable/disable watching for changed files, if watchdog is installed, instead of"
+            " checking them every turn. Changes made outside aider right before a message may be"
+            " missed (default: False)"
+        ),
+    )
 
     ##########
     history_group = parser.add_argument_group("History Files")
@@ -333,6 +410,15 @@ def main(argv=None, input=None, output=None, force_git_root=None):
         default=True,
         help="Enable/disable commits when repo is found dirty (default: True)",
     )
+    git_group.add_argument(
+        "--async-commit-messages",
+        action=argparse.BooleanOptionalAction,
+        default=False,
+        help=(
+            "Enable/disable committing with a provisional message, and rewording the commit once"
+            " its message is generated (default: False)"
+        ),
+    )
     git_group.add_argument(
         "--dry-run",
         action=argparse.BooleanOptionalAction,
@@ -523,6 +609,11 @@ def main(argv=None, input=None, output=None, force_git_root=None):
             setattr(openai, mod_key, val)
             io.tool_output(f"Setting openai.{mod_key}={val}")
 
+    httpclient.configure(args.http_pool_size)
+    ratelimit.configure(args.requests_per_minute, args.tokens_per_minute)
+    if args.cache_responses:
+        sendchat.CACHE = sendchat.ResponseCache()
+
     main_model = models.Model.create(args.model)
     
     if args.port:
@@ -547,8 +638,15 @@ def main(argv=None, input=None, output=None, force_git_root=None):
             show_diffs=args.show_diffs,
             auto_commits=args.auto_commits,
             dirty_commits=args.dirty_commits,
+            async_commit_messages=args.async_commit_messages,
             dry_run=args.dry_run,
             map_tokens=args.map_tokens,
+            map_processes=args.map_processes,
+            map_cache_dir=args.map_cache_dir,
+            map_rank_backend=args.map_rank_backend,
+            map_precompute=args.map_precompute,
+            watch_files=args.watch_files,
+            prompt_layout=args.prompt_layout,
             verbose=args.verbose,
             assistant_output_color=args.assistant_output_color,
             code_theme=args.code_theme,
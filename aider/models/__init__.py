@@ -1,4 +1,4 @@
-from .model import Model
+from .model import Model, list_models
 from .openai import OpenAIModel
 from .openrouter import OpenRouterModel
 
@@ -12,4 +12,5 @@ __all__ = [
     GPT4,
     GPT35,
     GPT35_16k,
+    list_models,
 ]
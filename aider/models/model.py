@@ -1,15 +1,33 @@
+import hashlib
 import json
+import sqlite3
+import threading
+from pathlib import Path
 
 import openai
+from diskcache import Cache
+
+from aider.tokens import get_tokenizer
+
+# model details change rarely, so only ask for them once a day
+MODELS_CACHE_PATH = "~/.aider.models.cache.v1"
+MODELS_CACHE_TTL = 24 * 60 * 60
+
+model_instances = dict()
+model_details = dict()
+models_cache = None
+models_lock = threading.Lock()
 
 
 class Model:
     name = None
     edit_format = None
     max_context_tokens = 0
-    tokenizer = None
     max_chat_history_tokens = 1024
 
+    # the get_tokenizer() args, the tokenizer is only loaded when it is first used
+    tokenizer_args = None
+
     always_available = False
     use_repo_map = False
     send_undo_reply = False
@@ -19,16 +37,36 @@ class Model:
 
     @classmethod
     def create(cls, name):
+        """The model called name, made once per api base and then shared."""
         from .openai import OpenAIModel
         from .openrouter import OpenRouterModel
 
+        key = (openai.api_base, name)
+        model = model_instances.get(key)
+        if model is not None:
+            return model
+
         if "openrouter.ai" in openai.api_base:
-            return OpenRouterModel(name)
-        return OpenAIModel(name)
+            model = OpenRouterModel(name)
+        else:
+            model = OpenAIModel(name)
+
+        with models_lock:
+            return model_instances.setdefault(key, model)
 
     def __str__(self):
         return self.name
 
+    @property
+    def tokenizer(self):
+        if "_tokenizer" not in self.__dict__:
+            self._tokenizer = get_tokenizer(**self.tokenizer_args) if self.tokenizer_args else None
+        return self._tokenizer
+
+    @tokenizer.setter
+    def tokenizer(self, tokenizer):
+        self._tokenizer = tokenizer
+
     @staticmethod
     def strong_model():
         return Model.create("gpt-4")
@@ -51,3 +89,51 @@ class Model:
             msgs = json.dumps(messages)
 
         return len(self.tokenizer.encode(msgs))
+
+
+def list_models(refresh=False):
+    """The details of the models the api key can use, as plain dicts.
+
+    They are kept in memory, and on disk for MODELS_CACHE_TTL seconds, so
+    startup doesn't wait on a model list request every time. refresh=True
+    asks the api again and replaces the cached list, eg: when a model isn't
+    in it because it is newer than the list.
+    """
+    key = hashlib.sha1(f"{openai.api_base}\n{openai.api_key}".encode()).hexdigest()
+    if not refresh:
+        details = model_details.get(key)
+        if details is not None:
+            return details
+
+    cache = get_models_cache()
+    details = None
+    if cache is not None and not refresh:
+        details = cache.get(key)
+
+    if details is None:
+        details = json.loads(json.dumps(openai.Model.list().data))
+        if cache is not None:
+            cache.set(key, details, expire=MODELS_CACHE_TTL)
+
+    with models_lock:
+        if refresh:
+            model_details[key] = details
+            return details
+        return model_details.setdefault(key, details)
+
+
+def get_models_cache():
+    global models_cache
+
+    if not MODELS_CACHE_PATH:
+        return
+
+    with models_lock:
+        if models_cache is None:
+            try:
+                models_cache = Cache(Path(MODELS_CACHE_PATH).expanduser())
+            except (OSError, sqlite3.Error):
+                # eg: an unwritable home dir, just ask for the list every run
+                models_cache = False
+        if models_cache is not False:
+            return models_cache
@@ -1,7 +1,5 @@
 import re
 
-import tiktoken
-
 from .model import Model
 
 known_tokens = {
@@ -30,7 +28,7 @@ class OpenAIModel(Model):
             raise ValueError(f"Unknown context window size for model: {name}")
 
         self.max_context_tokens = tokens * 1024
-        self.tokenizer = tiktoken.encoding_for_model(name)
+        self.tokenizer_args = dict(model_name=name)
 
         if self.is_gpt4():
             self.edit_format = "diff"
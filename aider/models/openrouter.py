@@ -1,9 +1,4 @@
-import openai
-import tiktoken
-
-from .model import Model
-
-cached_model_details = None
+from .model import Model, list_models
 
 
 class OpenRouterModel(Model):
@@ -20,14 +15,12 @@ class OpenRouterModel(Model):
         self.use_repo_map = self.edit_format == "diff"
 
         # TODO: figure out proper encodings for non openai models
-        self.tokenizer = tiktoken.get_encoding("cl100k_base")
+        self.tokenizer_args = dict(encoding_name="cl100k_base")
 
-        global cached_model_details
-        if cached_model_details is None:
-            cached_model_details = openai.Model.list().data
-        found = next(
-            (details for details in cached_model_details if details.get("id") == name), None
-        )
+        found = find_model(list_models(), name)
+        if not found:
+            # the cached list may be older than the model
+            found = find_model(list_models(refresh=True), name)
 
         if found:
             self.max_context_tokens = int(found.get("context_length"))
@@ -38,6 +31,10 @@ class OpenRouterModel(Model):
             raise ValueError(f"invalid openrouter model: {name}")
 
 
+def find_model(models, name):
+    return next((details for details in models if details.get("id") == name), None)
+
+
 # TODO run benchmarks and figure out which models support which edit-formats
 def edit_format_for_model(name):
     if any(str in name for str in ["gpt-4", "claude-2"]):
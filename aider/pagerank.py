@@ -0,0 +1,93 @@
+import numpy as np
+
+from .dump import dump  # noqa: F401
+
+
+def pagerank(
+    num_nodes,
+    src,
+    dst,
+    weight,
+    personalization=None,
+    dangling=None,
+    nstart=None,
+    alpha=0.85,
+    max_iter=100,
+    tol=1.0e-6,
+):
+    """PageRank of a weighted graph given as parallel arrays of edges.
+
+    This is the same power iteration as networkx.pagerank(), but it works
+    straight from the edge arrays instead of a networkx graph. Parallel edges
+    are summed, like networkx does for a MultiDiGraph. The personalization,
+    dangling and nstart args are arrays indexed by node id, or None.
+    """
+    import scipy as sp
+
+    N = num_nodes
+    if N == 0:
+        return np.zeros(0)
+
+    A = sp.sparse.csr_array((weight, (src, dst)), shape=(N, N), dtype=float)
+    S = A.sum(axis=1)
+    S[S != 0] = 1.0 / S[S != 0]
+    Q = sp.sparse.csr_array(sp.sparse.spdiags(S.T, 0, *A.shape))
+    A = Q @ A
+
+    # initial vector
+    if nstart is None:
+        x = np.repeat(1.0 / N, N)
+    else:
+        x = np.array(nstart, dtype=float)
+        x /= x.sum()
+
+    # Personalization vector
+    if personalization is None:
+        p = np.repeat(1.0 / N, N)
+    else:
+        p = np.array(personalization, dtype=float)
+        if p.sum() == 0:
+            raise ZeroDivisionError
+        p /= p.sum()
+
+    # Dangling nodes
+    if dangling is None:
+        dangling_weights = p
+    else:
+        dangling_weights = np.array(dangling, dtype=float)
+        dangling_weights /= dangling_weights.sum()
+    is_dangling = np.where(S == 0)[0]
+
+    # power iteration: make up to max_iter iterations
+    for _ in range(max_iter):
+        xlast = x
+        x = alpha * (x @ A + sum(x[is_dangling]) * dangling_weights) + (1 - alpha) * p
+        # check convergence, l1 norm
+        err = np.absolute(x - xlast).sum()
+        if err < N * tol:
+            return x
+
+    import networkx as nx
+
+    raise nx.PowerIterationFailedConvergence(max_iter)
+
+
+def distribute_rank(ranks, src, dst, weight, ident):
+    """Split each node's rank across its out edges, in proportion to their weight.
+
+    Returns parallel arrays of (dst, ident, rank), summed over all the edges
+    which share the same dst and ident.
+    """
+
+    if not len(src):
+        return src, ident, np.zeros(0)
+
+    total_weight = np.bincount(src, weights=weight, minlength=len(ranks))
+    edge_rank = ranks[src] * weight / total_weight[src]
+
+    num_idents = int(ident.max()) + 1
+    keys = dst.astype(np.int64) * num_idents + ident
+    keys, inverse = np.unique(keys, return_inverse=True)
+    key_rank = np.bincount(inverse, weights=edge_rank)
+
+    return keys // num_idents, keys % num_idents, key_rank
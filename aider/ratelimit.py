@@ -0,0 +1,235 @@
+import asyncio
+import random
+import re
+import threading
+import time
+
+from aider.dump import dump  # noqa: F401
+
+# how long to pause everyone after the first of a run of rate limit errors,
+# doubling with each one after that
+BASE_PAUSE = 1.0
+MAX_PAUSE = 60.0
+
+# spreads out the callers that were waiting for a pause to end
+MAX_JITTER = 1.0
+
+limiter = None
+limiter_lock = threading.Lock()
+
+
+def parse_reset(value):
+    """Seconds from an x-ratelimit-reset-* header, like "1s", "6m0s" or "120ms"."""
+    if not value:
+        return
+
+    units = dict(h=3600, m=60, s=1, ms=0.001)
+    parts = re.findall(r"(\d+(?:\.\d+)?)(ms|h|m|s)", str(value))
+    if not parts:
+        try:
+            return float(value)
+        except ValueError:
+            return
+
+    return sum(float(num) * units[unit] for num, unit in parts)
+
+
+def get_header(headers, name):
+    if not headers:
+        return
+
+    for key, value in headers.items():
+        if key.lower() == name:
+            return value
+
+
+class Bucket:
+    """A token bucket holding up to `capacity`, refilled over a minute.
+
+    Takes may overdraw it, and then have to wait until it refills to zero, so
+    callers get staggered slots instead of all retrying at the same moment.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.level = capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        rate = self.capacity / 60
+        self.level = min(self.capacity, self.level + (now - self.updated) * rate)
+        self.updated = now
+
+    def take(self, amount, now):
+        """Take amount from the bucket, and return the seconds until that is paid for."""
+        self.refill(now)
+        self.level -= min(amount, self.capacity)
+        if self.level >= 0:
+            return 0
+        return -self.level / (self.capacity / 60)
+
+    def give(self, amount, now):
+        self.refill(now)
+        self.level = min(self.capacity, self.level + amount)
+
+
+class RateLimiter:
+    """Paces the api calls of every thread against shared requests/min and tokens/min budgets.
+
+    The budgets can be given up front, or learned from the x-ratelimit-*
+    headers of rate limit errors. After a rate limit error every caller waits
+    out one shared, growing pause, rather than each retrying on its own
+    schedule.
+    """
+
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None):
+        self.lock = threading.Lock()
+
+        self.requests = Bucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = Bucket(tokens_per_minute) if tokens_per_minute else None
+
+        self.paused_until = 0
+        self.num_rate_limited = 0
+        self.consecutive_rate_limited = 0
+
+        self.num_waits = 0
+        self.wait_time = 0.0
+
+    def reserve(self, num_tokens):
+        """Claim a slot for a request of about num_tokens, and return the seconds to wait for it."""
+        with self.lock:
+            now = time.monotonic()
+            wait = 0
+
+            if self.paused_until > now:
+                wait = self.paused_until - now + random.uniform(0, MAX_JITTER)
+
+            if self.requests:
+                wait = max(wait, self.requests.take(1, now))
+            if self.tokens and num_tokens:
+                wait = max(wait, self.tokens.take(num_tokens, now))
+
+            if wait > 0:
+                self.num_waits += 1
+                self.wait_time += wait
+
+            return wait
+
+    def acquire(self, num_tokens=0):
+        wait = self.reserve(num_tokens)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    async def acquire_async(self, num_tokens=0):
+        wait = self.reserve(num_tokens)
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return wait
+
+    def record_usage(self, estimated_tokens, usage):
+        """Settle the difference between a request's estimated and actual token usage."""
+        self.consecutive_rate_limited = 0
+
+        if not self.tokens or not usage:
+            return
+
+        total_tokens = usage.get("total_tokens")
+        if total_tokens is None:
+            return
+
+        with self.lock:
+            self.tokens.give(estimated_tokens - total_tokens, time.monotonic())
+
+    def rate_limited(self, headers=None):
+        """Pause every caller after a rate limit error.
+
+        The headers of the error update the budgets and say when to resume,
+        when the api sends them. Otherwise the pause doubles with each rate
+        limit error in a row that comes after the last pause ended.
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.num_rate_limited += 1
+
+            # the other callers that were already in flight don't make it worse
+            if now >= self.paused_until:
+                self.consecutive_rate_limited += 1
+
+            pause = self.update_from_headers(headers, now)
+
+            try:
+                pause = float(get_header(headers, "retry-after"))
+            except (TypeError, ValueError):
+                pass
+
+            if not pause:
+                pause = BASE_PAUSE * 2 ** (self.consecutive_rate_limited - 1)
+                pause = min(pause, MAX_PAUSE)
+
+            self.paused_until = max(self.paused_until, now + pause)
+
+    def retry_delay(self):
+        """Seconds for a rate limited caller to wait until the pause ends, plus some jitter."""
+        with self.lock:
+            wait = max(self.paused_until - time.monotonic(), 0) + random.uniform(0, MAX_JITTER)
+            self.num_waits += 1
+            self.wait_time += wait
+            return wait
+
+    def update_from_headers(self, headers, now):
+        """Update the budgets from x-ratelimit-* headers, and return the seconds until a reset."""
+        pause = None
+        for name in ("requests", "tokens"):
+            try:
+                limit = int(get_header(headers, f"x-ratelimit-limit-{name}"))
+            except (TypeError, ValueError):
+                continue
+
+            bucket = getattr(self, name)
+            if bucket is None or bucket.capacity != limit:
+                bucket = Bucket(limit)
+                setattr(self, name, bucket)
+
+            try:
+                remaining = int(get_header(headers, f"x-ratelimit-remaining-{name}"))
+            except (TypeError, ValueError):
+                continue
+
+            bucket.refill(now)
+            bucket.level = min(bucket.level, remaining)
+
+            reset = parse_reset(get_header(headers, f"x-ratelimit-reset-{name}"))
+            if remaining <= 0 and reset:
+                pause = max(pause or 0, reset)
+
+        return pause
+
+    def get_stats(self):
+        """How often and how long callers waited for the limiter, and how many rate limit errors."""
+        with self.lock:
+            return dict(
+                num_waits=self.num_waits,
+                wait_time=self.wait_time,
+                num_rate_limited=self.num_rate_limited,
+            )
+
+
+def get_limiter():
+    """The RateLimiter that every api call in this process goes through."""
+    global limiter
+
+    if limiter is not None:
+        return limiter
+
+    with limiter_lock:
+        if limiter is None:
+            limiter = RateLimiter()
+        return limiter
+
+
+def configure(requests_per_minute=None, tokens_per_minute=None):
+    global limiter
+
+    with limiter_lock:
+        limiter = RateLimiter(requests_per_minute, tokens_per_minute)
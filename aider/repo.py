@@ -1,23 +1,61 @@
+import atexit
 import os
+import threading
+import time
 from pathlib import Path, PurePosixPath
 
 import git
 import pathspec
 
-from aider import models, prompts, utils
-from aider.sendchat import simple_send_with_retries
+from aider import httpclient, models, prompts, utils
+from aider.io import DeferredIO
+from aider.sendchat import simple_send_with_retries, simple_send_with_retries_async
 
 from .dump import dump  # noqa: F401
 
 
+class TimedGit(git.Git):
+    """Keeps count of the git commands run, and the time spent running them."""
+
+    num_commands = 0
+    elapsed = 0.0
+
+    def execute(self, *args, **kwargs):
+        start = time.time()
+        try:
+            return super().execute(*args, **kwargs)
+        finally:
+            self.num_commands += 1
+            self.elapsed += time.time() - start
+
+
+class TimedRepo(git.Repo):
+    GitCommandWrapperType = TimedGit
+
+
 class GitRepo:
     repo = None
     aider_ignore_file = None
     aider_ignore_spec = None
     aider_ignore_ts = 0
-
-    def __init__(self, io, fnames, git_dname, aider_ignore_file=None):
+    index_shas = None
+    index_shas_ts = None
+    head_files = None
+    head_files_sha = None
+    git_files = None
+    git_files_key = None
+    tracked_files = None
+    tracked_files_key = None
+    pending_commit = None
+    provisional_commit_message = "(commit message pending)"
+
+    def __init__(self, io, fnames, git_dname, aider_ignore_file=None, async_commit_messages=False):
         self.io = io
+        self.async_commit_messages = async_commit_messages
+        self.amended_commits = dict()
+        if async_commit_messages:
+            # so the last commit still gets its message
+            atexit.register(self.finish_commit_message)
 
         if git_dname:
             check_fnames = [git_dname]
@@ -50,13 +88,18 @@ class GitRepo:
             raise FileNotFoundError
 
         # https://github.com/gitpython-developers/GitPython/issues/427
-        self.repo = git.Repo(repo_paths.pop(), odbt=git.GitDB)
+        self.repo = TimedRepo(repo_paths.pop(), odbt=git.GitDB)
         self.root = utils.safe_abs_path(self.repo.working_tree_dir)
 
         if aider_ignore_file:
             self.aider_ignore_file = Path(aider_ignore_file)
 
+        # the long lived cat-file processes can only serve one request at a time
+        self.cat_file_lock = threading.Lock()
+
     def commit(self, fnames=None, context=None, prefix=None, message=None):
+        self.finish_commit_message()
+
         if not fnames and not self.repo.is_dirty():
             return
 
@@ -64,8 +107,12 @@ class GitRepo:
         if not diffs:
             return
 
+        pending = not message and self.async_commit_messages
+
         if message:
             commit_message = message
+        elif pending:
+            commit_message = self.provisional_commit_message
         else:
             commit_message = self.get_commit_message(diffs, context)
 
@@ -75,34 +122,145 @@ class GitRepo:
         if prefix:
             commit_message = prefix + commit_message
 
-        full_commit_message = commit_message
-        if context:
-            full_commit_message += "\n\n# Aider chat conversation:\n\n" + context
-
-        cmd = ["-m", full_commit_message, "--no-verify"]
+        cmd = ["-m", self.get_full_commit_message(commit_message, context), "--no-verify"]
         if fnames:
             fnames = [str(self.abs_root_path(fn)) for fn in fnames]
-            for fname in fnames:
-                self.repo.git.add(fname)
+            self.repo.git.add(*fnames)
             cmd += ["--"] + fnames
         else:
             cmd += ["-a"]
 
         self.repo.git.commit(cmd)
+        commit_hexsha = self.repo.head.commit.hexsha
+        commit_hash = commit_hexsha[:7]
+        self.io.tool_output(f"Commit {commit_hash} {commit_message}")
+
+        if pending:
+            self.start_commit_message(commit_hexsha, diffs, context, prefix)
+
+        return commit_hash, commit_message
+
+    def get_full_commit_message(self, commit_message, context):
+        if context:
+            commit_message += "\n\n# Aider chat conversation:\n\n" + context
+        return commit_message
+
+    def start_commit_message(self, hexsha, diffs, context, prefix):
+        """Ask for the message of the commit that was just made, in the background."""
+        pending = dict(
+            hexsha=hexsha,
+            context=context,
+            prefix=prefix,
+            io=DeferredIO(self.io),
+            message=None,
+        )
+
+        async def worker():
+            pending["message"] = await self.get_commit_message_async(
+                diffs, context, io=pending["io"]
+            )
+
+        self.pending_commit = pending
+        pending["future"] = httpclient.submit(worker())
+
+    def finish_commit_message(self, wait=True):
+        """Reword the last commit with its generated message, once it is ready.
+
+        The commit is left alone if HEAD moved on since it was made, or if it
+        was pushed. Returns the
+        (commit_hash, commit_message) of the reworded commit.
+        """
+        pending = self.pending_commit
+        if not pending:
+            return
+
+        if not pending["future"].done() and not wait:
+            return
+
+        self.pending_commit = None
+        try:
+            pending["future"].result()
+        except Exception as err:
+            # eg: the api kept failing, so keep the provisional message
+            pending["io"].tool_error(f"Failed to generate commit message: {err}")
+
+        pending["io"].flush()
+
+        commit_message = pending["message"]
+        if not commit_message:
+            return
+
+        old_hexsha = pending["hexsha"]
+        if self.rev_parse("HEAD") != old_hexsha:
+            return
+
+        # rewriting a pushed commit would make the remote diverge
+        if self.repo.git.branch("-r", "--contains", old_hexsha).strip():
+            self.io.tool_error(
+                f"Commit {old_hexsha[:7]} was already pushed, keeping its provisional message."
+            )
+            return
+
+        if pending["prefix"]:
+            commit_message = pending["prefix"] + commit_message
+
+        # --only without paths leaves out whatever has been staged since
+        full_commit_message = self.get_full_commit_message(commit_message, pending["context"])
+        self.repo.git.commit("--amend", "--only", "--no-verify", "-m", full_commit_message)
+
         commit_hash = self.repo.head.commit.hexsha[:7]
+        self.amended_commits[old_hexsha[:7]] = commit_hash
         self.io.tool_output(f"Commit {commit_hash} {commit_message}")
 
         return commit_hash, commit_message
 
+    def get_git_stats(self):
+        """How many git commands have been run, and how long they took, since the last reset."""
+        return self.repo.git.num_commands, self.repo.git.elapsed
+
+    def reset_git_stats(self):
+        self.repo.git.num_commands = 0
+        self.repo.git.elapsed = 0.0
+
     def get_rel_repo_dir(self):
         try:
             return os.path.relpath(self.repo.git_dir, os.getcwd())
         except ValueError:
             return self.repo.git_dir
 
-    def get_commit_message(self, diffs, context):
+    def get_commit_message(self, diffs, context, io=None):
+        if io is None:
+            io = self.io
+
+        messages = self.get_commit_message_prompt(diffs, context, io)
+        if not messages:
+            return
+
+        for model in models.Model.commit_message_models():
+            commit_message = simple_send_with_retries(model.name, messages)
+            if commit_message:
+                break
+
+        return self.clean_commit_message(commit_message, io)
+
+    async def get_commit_message_async(self, diffs, context, io=None):
+        if io is None:
+            io = self.io
+
+        messages = self.get_commit_message_prompt(diffs, context, io)
+        if not messages:
+            return
+
+        for model in models.Model.commit_message_models():
+            commit_message = await simple_send_with_retries_async(model.name, messages)
+            if commit_message:
+                break
+
+        return self.clean_commit_message(commit_message, io)
+
+    def get_commit_message_prompt(self, diffs, context, io):
         if len(diffs) >= 4 * 1024 * 4:
-            self.io.tool_error(
+            io.tool_error(
                 f"Diff is too large for {models.GPT35.name} to generate a commit message."
             )
             return
@@ -118,14 +276,11 @@ class GitRepo:
             dict(role="system", content=prompts.commit_system),
             dict(role="user", content=content),
         ]
+        return messages
 
-        for model in models.Model.commit_message_models():
-            commit_message = simple_send_with_retries(model.name, messages)
-            if commit_message:
-                break
-
+    def clean_commit_message(self, commit_message, io):
         if not commit_message:
-            self.io.tool_error("Failed to generate commit message!")
+            io.tool_error("Failed to generate commit message!")
             return
 
         commit_message = commit_message.strip()
@@ -136,11 +291,7 @@ class GitRepo:
 
     def get_diffs(self, fnames=None):
         # We always want diffs of index and working dir
-        try:
-            commits = self.repo.iter_commits(self.repo.active_branch)
-            current_branch_has_commits = any(commits)
-        except git.exc.GitCommandError:
-            current_branch_has_commits = False
+        current_branch_has_commits = self.repo.head.is_valid()
 
         if not fnames:
             fnames = []
@@ -173,34 +324,116 @@ class GitRepo:
 
         return diffs
 
+    def rev_parse(self, rev):
+        """The sha of the object that rev names, or None if there isn't one.
+
+        Asks a long lived git cat-file --batch-check process, rather than
+        starting a git rev-parse for every lookup.
+        """
+        if "\n" in rev:
+            return
+
+        with self.cat_file_lock:
+            try:
+                hexsha, _obj_type, _size = self.repo.git.get_object_header(rev)
+            except ValueError:
+                return
+
+        return hexsha.decode()
+
     def get_tracked_files(self):
+        """The files in HEAD, plus any staged files.
+
+        The listing is cached as a frozenset until HEAD, the index or the
+        .aiderignore file changes, so membership tests are cheap.
+        """
         if not self.repo:
             return []
 
         try:
-            commit = self.repo.head.commit
+            head_sha = self.repo.head.commit.hexsha
         except ValueError:
-            commit = None
+            head_sha = None
+
+        git_files_key = (head_sha, self.get_index_key())
+        if git_files_key != self.git_files_key:
+            files = set(self.get_head_files(head_sha))
 
-        files = []
-        if commit:
-            for blob in commit.tree.traverse():
-                if blob.type == "blob":  # blob is a file
-                    files.append(blob.path)
+            # Add staged files
+            files.update(self.run_git_z("ls-files"))
 
-        # Add staged files
-        index = self.repo.index
-        staged_files = [path for path, _ in index.entries.keys()]
+            # convert to appropriate os.sep, since git always normalizes to /
+            if os.sep != "/":
+                files = set(path.replace("/", os.sep) for path in files)
 
-        files.extend(staged_files)
+            self.git_files = frozenset(files)
+            self.git_files_key = git_files_key
 
-        # convert to appropriate os.sep, since git always normalizes to /
-        res = set(
-            str(Path(PurePosixPath((Path(self.root) / path).relative_to(self.root))))
-            for path in files
+        tracked_files_key = (git_files_key, self.get_aider_ignore_ts())
+        if tracked_files_key != self.tracked_files_key:
+            self.tracked_files = frozenset(self.filter_ignored_files(self.git_files))
+            self.tracked_files_key = tracked_files_key
+
+        return self.tracked_files
+
+    def get_ignored_dirs(self):
+        """The untracked dirs that git ignores, relative to the root, like node_modules."""
+        if not self.repo:
+            return []
+
+        entries = self.run_git_z(
+            "ls-files", "--others", "--ignored", "--exclude-standard", "--directory"
         )
+        dnames = [entry.rstrip("/") for entry in entries if entry.endswith("/")]
+
+        if os.sep != "/":
+            dnames = [dname.replace("/", os.sep) for dname in dnames]
+        return dnames
+
+    def get_head_files(self, head_sha):
+        if not head_sha:
+            return []
+
+        if head_sha != self.head_files_sha:
+            files = []
+            for line in self.run_git_z("ls-tree", "-r", "--full-tree", head_sha):
+                info, path = line.split("\t", 1)
+                if info.split()[1] == "blob":  # blob is a file
+                    files.append(path)
+
+            self.head_files = files
+            self.head_files_sha = head_sha
+
+        return self.head_files
 
-        return self.filter_ignored_files(res)
+    def run_git_z(self, cmd, *args):
+        """Run a git command with -z, and return the NUL separated entries of its output."""
+        # don't let status and friends rewrite the index, it would invalidate our caches
+        output = self.repo.git.execute(["git", "--no-optional-locks", cmd, "-z", *args])
+        return [entry for entry in output.split("\0") if entry]
+
+    def get_index_key(self):
+        """Changes whenever git writes a new index.
+
+        git replaces the index by renaming a new file over it, so the inode
+        and size catch rewrites within the same mtime tick.
+        """
+        index_fname = Path(self.repo.git_dir) / "index"
+        try:
+            stat = index_fname.stat()
+        except FileNotFoundError:
+            return
+
+        return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+    def get_aider_ignore_ts(self):
+        if not self.aider_ignore_file:
+            return
+
+        try:
+            return self.aider_ignore_file.stat().st_mtime
+        except OSError:
+            return
 
     def filter_ignored_files(self, fnames):
         if not self.aider_ignore_file or not self.aider_ignore_file.is_file():
@@ -221,8 +454,63 @@ class GitRepo:
         if not self.repo:
             return
 
-        tracked_files = set(self.get_tracked_files())
-        return path in tracked_files
+        return path in self.get_tracked_files()
+
+    def get_index_shas(self):
+        """Map each path in the index to its (blob sha, mtime_ns, size).
+
+        Re-read only when the index file itself changes.
+        """
+        index_key = self.get_index_key()
+        if not index_key:
+            return dict()
+
+        if index_key == self.index_shas_ts:
+            return self.index_shas
+
+        shas = dict()
+        for (path, stage), entry in self.repo.index.entries.items():
+            if stage:
+                continue
+            sec, nsec = entry.mtime
+            shas[path] = (entry.hexsha, sec * 10**9 + nsec, entry.size)
+
+        self.index_shas = shas
+        self.index_shas_ts = index_key
+        return shas
+
+    def get_blob_sha(self, fname):
+        """The git blob sha of a working tree file.
+
+        Taken from the index without reading the file if it is clean, the
+        same way git decides by comparing the stat info.
+        """
+        fname = Path(fname)
+        try:
+            stat = fname.stat()
+        except OSError:
+            return
+
+        rel_fname = PurePosixPath(Path(os.path.relpath(fname, self.root))).as_posix()
+        entry = self.get_index_shas().get(rel_fname)
+        if entry:
+            sha, mtime_ns, size = entry
+
+            file_mtime_ns = stat.st_mtime_ns
+            if mtime_ns % 10**9 == 0:
+                # git was built without nanosecond timestamps
+                file_mtime_ns -= file_mtime_ns % 10**9
+
+            # "racily clean" entries can't be trusted, just like in git
+            index_mtime_ns = self.index_shas_ts[0]
+            if file_mtime_ns == mtime_ns and stat.st_size == size and mtime_ns < index_mtime_ns:
+                return sha
+
+        try:
+            data = fname.read_bytes()
+        except OSError:
+            return
+        return utils.git_blob_sha(data)
 
     def abs_root_path(self, path):
         res = Path(self.root) / path
@@ -233,3 +521,29 @@ class GitRepo:
             return True
 
         return self.repo.is_dirty(path=path)
+
+    def get_dirty_files(self, paths):
+        """Which of the paths is_dirty() would say are dirty, with one git status call."""
+        tracked_files = self.get_tracked_files()
+
+        dirty = set(path for path in paths if path not in tracked_files)
+        check = [path for path in paths if path in tracked_files]
+        if not check:
+            return dirty
+
+        changed = set()
+        entries = iter(
+            self.run_git_z("status", "--porcelain", "--untracked-files=no", "--", *check)
+        )
+        for entry in entries:
+            status, path = entry[:2], entry[3:]
+            changed.add(path)
+            if "R" in status or "C" in status:
+                # followed by the path it was renamed or copied from
+                changed.add(next(entries, ""))
+
+        if os.sep != "/":
+            changed = set(path.replace("/", os.sep) for path in changed)
+
+        dirty.update(path for path in check if os.path.normpath(path) in changed)
+        return dirty
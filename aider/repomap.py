@@ -1,21 +1,27 @@
 import colorsys
+import multiprocessing
 import os
 import random
 import sys
-from collections import Counter, defaultdict, namedtuple
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import Counter, OrderedDict, defaultdict, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
 from pathlib import Path
 
-import networkx as nx
-import pkg_resources
+import numpy as np
 from diskcache import Cache
-from grep_ast import TreeContext, filename_to_lang
 from pygments.lexers import guess_lexer_for_filename
 from pygments.token import Token
 from pygments.util import ClassNotFound
-from tqdm import tqdm
-from tree_sitter_languages import get_language, get_parser
 
-from aider import models
+from aider import models, utils
+from aider.io import DeferredIO
+from aider.pagerank import distribute_rank, pagerank
+from aider.tokens import count_tokens_batch
+from aider.watch import FileWatcher
 
 from .dump import dump  # noqa: F402
 
@@ -25,11 +31,21 @@ Tag = namedtuple("Tag", "rel_fname fname line name kind".split())
 class RepoMap:
     CACHE_VERSION = 3
     TAGS_CACHE_DIR = f".aider.tags.cache.v{CACHE_VERSION}"
+    TAGS_BLOB_CACHE_DIR = f".aider.tags.blobs.v{CACHE_VERSION}"
 
     cache_missing = False
 
     warned_files = set()
 
+    # don't bother starting worker processes for just a handful of files
+    min_parallel_files = 32
+
+    # how many files' worth of parsed tags to write to the cache per transaction
+    prefetch_batch_size = 256
+
+    # parsed TreeContexts are kept for files up to this much source code, in total
+    tree_cache_bytes = 8 * 1024 * 1024
+
     def __init__(
         self,
         map_tokens=1024,
@@ -38,15 +54,44 @@ class RepoMap:
         io=None,
         repo_content_prefix=None,
         verbose=False,
+        max_processes=None,
+        repo=None,
+        cache_dir=None,
+        rank_backend="networkx",
+        tree_cache_bytes=None,
+        file_watcher=None,
     ):
         self.io = io
         self.verbose = verbose
+        self.repo = repo
+        self.cache_dir = cache_dir
+
+        if not max_processes:
+            max_processes = os.cpu_count() or 1
+        self.max_processes = max_processes
 
         if not root:
             root = os.getcwd()
         self.root = root
 
+        if file_watcher is None:
+            file_watcher = FileWatcher(root, watch=False)
+        self.file_watcher = file_watcher
+
         self.load_tags_cache()
+        self.tag_graph = TagGraph(rank_backend)
+        self.tree_sections = dict()
+
+        if tree_cache_bytes is not None:
+            self.tree_cache_bytes = tree_cache_bytes
+        self.tree_cache = OrderedDict()
+        self.tree_cache_size = 0
+
+        # only one map is computed at a time, possibly in the precompute thread
+        self.map_lock = threading.Lock()
+        self.precompute_thread = None
+        self.precomputed = None
+        self.deferred_io = None
 
         self.max_map_tokens = map_tokens
 
@@ -60,6 +105,66 @@ class RepoMap:
         if not other_files:
             return
 
+        with self.map_lock:
+            self.flush_deferred_io()
+
+            key = self.get_map_key(chat_files, other_files)
+            if self.precomputed and self.precomputed[0] == key:
+                return self.precomputed[1]
+
+            return self.compute_repo_map(chat_files, other_files)
+
+    def precompute(self, chat_files, other_files):
+        """Start computing the repo map in a background thread.
+
+        A later get_repo_map() with the same files, none of which have changed
+        since, will return it instead of waiting to compute the map again.
+        """
+        if self.max_map_tokens <= 0 or not other_files:
+            return
+
+        if self.precompute_thread and self.precompute_thread.is_alive():
+            return
+
+        self.precompute_thread = threading.Thread(
+            target=self.precompute_worker,
+            args=(list(chat_files), list(other_files)),
+            daemon=True,
+        )
+        self.precompute_thread.start()
+
+    def precompute_worker(self, chat_files, other_files):
+        with self.map_lock:
+            key = self.get_map_key(chat_files, other_files)
+            if self.precomputed and self.precomputed[0] == key:
+                return
+
+            # don't print over the user's input prompt
+            io = self.io
+            self.io = DeferredIO(io)
+            try:
+                repo_content = self.compute_repo_map(chat_files, other_files)
+            except Exception:
+                # get_repo_map() will just compute it again, and report any errors
+                return
+            finally:
+                self.deferred_io = self.io
+                self.io = io
+
+            self.precomputed = (key, repo_content)
+
+    def flush_deferred_io(self):
+        if self.deferred_io:
+            self.deferred_io.flush()
+            self.deferred_io = None
+
+    def get_map_key(self, chat_files, other_files):
+        fnames = sorted(set(chat_files).union(set(other_files)))
+        mtimes = tuple(self.file_watcher.get_mtime(fname) for fname in fnames)
+
+        return (frozenset(chat_files), tuple(fnames), mtimes, self.max_map_tokens)
+
+    def compute_repo_map(self, chat_files, other_files):
         files_listing = self.get_ranked_tags_map(chat_files, other_files)
         if not files_listing:
             return
@@ -98,14 +203,55 @@ class RepoMap:
             self.cache_missing = True
         self.TAGS_CACHE = Cache(path)
 
+        # content addressed, so it can be shared across branches, clones and users
+        if self.cache_dir:
+            path = Path(self.cache_dir).expanduser()
+        else:
+            path = Path(self.root) / self.TAGS_BLOB_CACHE_DIR
+        self.TAGS_BLOB_CACHE = Cache(path)
+
     def save_tags_cache(self):
         pass
 
     def get_mtime(self, fname):
-        try:
-            return os.path.getmtime(fname)
-        except FileNotFoundError:
+        mtime = self.file_watcher.get_mtime(fname)
+        if mtime is None:
             self.io.tool_error(f"File not found error: {fname}")
+        return mtime
+
+    def get_blob_key(self, fname):
+        lang = filename_to_lang(fname)
+        if not lang:
+            return
+
+        if self.repo:
+            sha = self.repo.get_blob_sha(fname)
+        else:
+            try:
+                sha = utils.git_blob_sha(Path(fname).read_bytes())
+            except OSError:
+                sha = None
+
+        if not sha:
+            return
+
+        # a shared --map-cache-dir can be used by other aider versions too
+        return f"v{self.CACHE_VERSION}:{lang}:{sha}"
+
+    def get_blob_tags(self, blob_key, fname, rel_fname):
+        if not blob_key or blob_key not in self.TAGS_BLOB_CACHE:
+            return
+
+        return [
+            Tag(rel_fname=rel_fname, fname=fname, line=line, name=name, kind=kind)
+            for line, name, kind in self.TAGS_BLOB_CACHE[blob_key]
+        ]
+
+    def set_blob_tags(self, blob_key, tags):
+        if not blob_key:
+            return
+
+        self.TAGS_BLOB_CACHE[blob_key] = [(tag.line, tag.name, tag.kind) for tag in tags]
 
     def get_tags(self, fname, rel_fname):
         # Check if the file is in the cache and if the modification time has not changed
@@ -117,9 +263,13 @@ class RepoMap:
         if cache_key in self.TAGS_CACHE and self.TAGS_CACHE[cache_key]["mtime"] == file_mtime:
             return self.TAGS_CACHE[cache_key]["data"]
 
-        # miss!
+        # miss! maybe we've seen the same contents under another path or branch
 
-        data = list(self.get_tags_raw(fname, rel_fname))
+        blob_key = self.get_blob_key(fname)
+        data = self.get_blob_tags(blob_key, fname, rel_fname)
+        if data is None:
+            data = list(self.get_tags_raw(fname, rel_fname))
+            self.set_blob_tags(blob_key, data)
 
         # Update the cache
         self.TAGS_CACHE[cache_key] = {"mtime": file_mtime, "data": data}
@@ -128,84 +278,91 @@ class RepoMap:
 
     def get_tags_raw(self, fname, rel_fname):
         lang = filename_to_lang(fname)
-        if not lang:
-            return
-
-        language = get_language(lang)
-        parser = get_parser(lang)
-
-        # Load the tags queries
-        scm_fname = pkg_resources.resource_filename(
-            __name__, os.path.join("queries", f"tree-sitter-{lang}-tags.scm")
-        )
-        query_scm = Path(scm_fname)
-        if not query_scm.exists():
-            return
-        query_scm = query_scm.read_text()
+        if not lang or not get_tags_query(lang):
+            return []
 
         code = self.io.read_text(fname)
         if not code:
-            return
-        tree = parser.parse(bytes(code, "utf-8"))
+            return []
 
-        # Run the tags queries
-        query = language.query(query_scm)
-        captures = query.captures(tree.root_node)
+        return list(get_tags_from_code(fname, rel_fname, code))
 
-        captures = list(captures)
+    def prefetch_tags(self, fnames):
+        """Parse the files which are missing from the tags cache in parallel.
 
-        saw = set()
-        for node, tag in captures:
-            if tag.startswith("name.definition."):
-                kind = "def"
-            elif tag.startswith("name.reference."):
-                kind = "ref"
-            else:
-                continue
+        The resulting tags are written back to the cache in batched transactions,
+        so the following get_tags() calls are all cache hits.
+        """
+        if self.max_processes <= 1:
+            return
 
-            saw.add(kind)
+        misses = []
+        for fname in fnames:
+            file_mtime = self.file_watcher.get_mtime(fname)
+            if file_mtime is None:
+                continue
 
-            result = Tag(
-                rel_fname=rel_fname,
-                fname=fname,
-                name=node.text.decode("utf-8"),
-                kind=kind,
-                line=node.start_point[0],
-            )
+            cache_key = fname
+            if cache_key in self.TAGS_CACHE and self.TAGS_CACHE[cache_key]["mtime"] == file_mtime:
+                continue
 
-            yield result
+            misses.append((fname, file_mtime))
 
-        if "ref" in saw:
-            return
-        if "def" not in saw:
+        if len(misses) < self.min_parallel_files:
             return
 
-        # We saw defs, without any refs
-        # Some tags files only provide defs (cpp, for example)
-        # Use pygments to backfill refs
+        jobs = []
+        with self.TAGS_CACHE.transact():
+            for fname, file_mtime in misses:
+                rel_fname = self.get_rel_fname(fname)
+                blob_key = self.get_blob_key(fname)
 
-        try:
-            lexer = guess_lexer_for_filename(fname, code)
-        except ClassNotFound:
+                data = self.get_blob_tags(blob_key, fname, rel_fname)
+                if data is not None:
+                    self.TAGS_CACHE[fname] = {"mtime": file_mtime, "data": data}
+                    continue
+
+                jobs.append((fname, rel_fname, file_mtime, blob_key))
+
+        if len(jobs) < self.min_parallel_files:
             return
 
-        tokens = list(lexer.get_tokens(code))
-        tokens = [token[1] for token in tokens if token[0] in Token.Name]
+        worker_jobs = [(fname, rel_fname, self.io.encoding) for fname, rel_fname, _, _ in jobs]
 
-        for token in tokens:
-            yield Tag(
-                rel_fname=rel_fname,
-                fname=fname,
-                name=token,
-                kind="ref",
-                line=-1,
-            )
+        num_processes = min(self.max_processes, len(jobs))
+        chunksize = max(1, len(jobs) // (num_processes * 4))
 
-    def get_ranked_tags(self, chat_fnames, other_fnames):
-        defines = defaultdict(set)
-        references = defaultdict(list)
-        definitions = defaultdict(set)
+        # forking a process with other threads running, like the precompute thread and
+        # prompt_toolkit's, can deadlock the children
+        if "forkserver" in multiprocessing.get_all_start_methods():
+            mp_context = multiprocessing.get_context("forkserver")
+        else:
+            mp_context = multiprocessing.get_context("spawn")
+
+        with ProcessPoolExecutor(max_workers=num_processes, mp_context=mp_context) as executor:
+            results = executor.map(get_tags_worker, worker_jobs, chunksize=chunksize)
+            if self.cache_missing:
+                if not isinstance(self.io, DeferredIO):
+                    from tqdm import tqdm
+
+                    results = tqdm(results, total=len(jobs))
+                self.cache_missing = False
+
+            # write the tags as they arrive, rather than holding them all in memory
+            results = zip(jobs, results)
+            while batch := list(islice(results, self.prefetch_batch_size)):
+                self.save_prefetched_tags(batch)
+
+    def save_prefetched_tags(self, batch):
+        with self.TAGS_CACHE.transact(), self.TAGS_BLOB_CACHE.transact():
+            for (fname, _rel_fname, file_mtime, blob_key), data in batch:
+                # leave unreadable files for get_tags(), so it can report the error
+                if data is None:
+                    continue
+                self.TAGS_CACHE[fname] = {"mtime": file_mtime, "data": data}
+                self.set_blob_tags(blob_key, data)
 
+    def get_ranked_tags(self, chat_fnames, other_fnames):
         personalization = dict()
 
         fnames = set(chat_fnames).union(set(other_fnames))
@@ -213,12 +370,11 @@ class RepoMap:
 
         fnames = sorted(fnames)
 
-        if self.cache_missing:
-            fnames = tqdm(fnames)
-        self.cache_missing = False
-
+        # only (re)parse the files which changed since the graph was last updated
+        changed = []
+        seen = set()
         for fname in fnames:
-            if not Path(fname).is_file():
+            if not self.file_watcher.is_file(fname):
                 if fname not in self.warned_files:
                     if Path(fname).exists():
                         self.io.tool_error(
@@ -232,69 +388,39 @@ class RepoMap:
 
             # dump(fname)
             rel_fname = self.get_rel_fname(fname)
+            seen.add(rel_fname)
 
             if fname in chat_fnames:
                 personalization[rel_fname] = 1.0
                 chat_rel_fnames.add(rel_fname)
 
-            tags = list(self.get_tags(fname, rel_fname))
-            if tags is None:
+            file_mtime = self.get_mtime(fname)
+            if file_mtime is None or self.tag_graph.get_mtime(rel_fname) == file_mtime:
                 continue
 
-            for tag in tags:
-                if tag.kind == "def":
-                    defines[tag.name].add(rel_fname)
-                    key = (rel_fname, tag.name)
-                    definitions[key].add(tag)
-
-                if tag.kind == "ref":
-                    references[tag.name].append(rel_fname)
-
-        ##
-        # dump(defines)
-        # dump(references)
+            changed.append((fname, rel_fname, file_mtime))
 
-        if not references:
-            references = dict((k, list(v)) for k, v in defines.items())
+        for rel_fname in set(self.tag_graph.files) - seen:
+            self.tag_graph.remove_file(rel_fname)
 
-        idents = set(defines.keys()).intersection(set(references.keys()))
+        self.prefetch_tags([fname for fname, _, _ in changed])
 
-        G = nx.MultiDiGraph()
+        if self.cache_missing and not isinstance(self.io, DeferredIO):
+            from tqdm import tqdm
 
-        for ident in idents:
-            definers = defines[ident]
-            for referencer, num_refs in Counter(references[ident]).items():
-                for definer in definers:
-                    # if referencer == definer:
-                    #    continue
-                    G.add_edge(referencer, definer, weight=num_refs, ident=ident)
+            changed = tqdm(changed)
+        self.cache_missing = False
 
-        if not references:
-            pass
-
-        if personalization:
-            pers_args = dict(personalization=personalization, dangling=personalization)
-        else:
-            pers_args = dict()
+        for fname, rel_fname, file_mtime in changed:
+            tags = self.get_tags(fname, rel_fname)
+            self.tag_graph.update_file(rel_fname, file_mtime, tags)
 
         try:
-            ranked = nx.pagerank(G, weight="weight", **pers_args)
+            ranked, ranked_definitions = self.tag_graph.rank(personalization)
         except ZeroDivisionError:
             return []
 
-        # distribute the rank from each source node, across all of its out edges
-        ranked_definitions = defaultdict(float)
-        for src in G.nodes:
-            src_rank = ranked[src]
-            total_weight = sum(data["weight"] for _src, _dst, data in G.out_edges(src, data=True))
-            # dump(src, src_rank, total_weight)
-            for _src, dst, data in G.out_edges(src, data=True):
-                data["rank"] = src_rank * data["weight"] / total_weight
-                ident = data["ident"]
-                ranked_definitions[(dst, ident)] += data["rank"]
-
         ranked_tags = []
-        ranked_definitions = sorted(ranked_definitions.items(), reverse=True, key=lambda x: x[1])
 
         # dump(ranked_definitions)
 
@@ -302,7 +428,7 @@ class RepoMap:
             # print(f"{rank:.03f} {fname} {ident}")
             if fname in chat_rel_fnames:
                 continue
-            ranked_tags += list(definitions.get((fname, ident), []))
+            ranked_tags += self.tag_graph.get_definitions(fname, ident)
 
         rel_other_fnames_without_tags = set(self.get_rel_fname(fname) for fname in other_fnames)
 
@@ -324,77 +450,584 @@ class RepoMap:
         if not other_fnames:
             other_fnames = list()
 
+        chat_rel_fnames = set(self.get_rel_fname(fname) for fname in chat_fnames)
+
         ranked_tags = self.get_ranked_tags(chat_fnames, other_fnames)
+        ranked_tags = [tag for tag in ranked_tags if tag[0] not in chat_rel_fnames]
         num_tags = len(ranked_tags)
 
         lower_bound = 0
         upper_bound = num_tags
         best_tree = None
 
-        chat_rel_fnames = [self.get_rel_fname(fname) for fname in chat_fnames]
+        # Each probe only renders and counts the file sections it hasn't seen
+        # before, and sums the cached counts for the rest.
+        sections = dict()
 
         while lower_bound <= upper_bound:
             middle = (lower_bound + upper_bound) // 2
-            tree = self.to_tree(ranked_tags[:middle], chat_rel_fnames)
-            num_tokens = self.token_count(tree)
+            tree_sections = self.get_tree_sections(ranked_tags[:middle], sections)
+            num_tokens = sum(tokens for _text, tokens in tree_sections)
 
             if num_tokens < self.max_map_tokens:
-                best_tree = tree
+                best_tree = "".join(text for text, _tokens in tree_sections)
                 lower_bound = middle + 1
             else:
                 upper_bound = middle - 1
 
+        # keep the sections used this time around, the next map will likely reuse them
+        self.tree_sections = sections
+
         return best_tree
 
-    def to_tree(self, tags, chat_rel_fnames):
-        if not tags:
-            return ""
-
-        tags = [tag for tag in tags if tag[0] not in chat_rel_fnames]
-        tags = sorted(tags)
-
-        cur_fname = None
-        context = None
-        output = ""
-
-        # add a bogus tag at the end so we trip the this_fname != cur_fname...
-        dummy_tag = (None,)
-        for tag in tags + [dummy_tag]:
-            this_rel_fname = tag[0]
-
-            # ... here ... to output the final real entry in the list
-            if this_rel_fname != cur_fname:
-                if context:
-                    context.add_context()
-                    output += "\n"
-                    output += cur_fname + ":\n"
-                    output += context.format()
-                    context = None
-                elif cur_fname:
-                    output += "\n" + cur_fname + "\n"
-
-                if type(tag) is Tag:
-                    code = self.io.read_text(tag.fname) or ""
-
-                    context = TreeContext(
-                        tag.rel_fname,
-                        code,
-                        color=False,
-                        line_number=False,
-                        child_context=False,
-                        last_line=False,
-                        margin=0,
-                        mark_lois=False,
-                        loi_pad=0,
-                        # header_max=30,
-                        show_top_of_file_parent_scope=False,
-                    )
-                cur_fname = this_rel_fname
-
-            if context:
-                context.add_lines_of_interest([tag.line])
-
-        return output
+    def get_tree_sections(self, tags, sections):
+        keys = []
+        rendered = dict()
+        for rel_fname, fname, lois in group_tags(tags):
+            if lois is None:
+                key = (rel_fname,)
+            else:
+                key = (rel_fname, self.tag_graph.get_mtime(rel_fname), frozenset(lois))
+            keys.append(key)
+
+            if key in sections or key in rendered:
+                continue
+            if key in self.tree_sections:
+                sections[key] = self.tree_sections[key]
+            else:
+                rendered[key] = self.render_section(rel_fname, fname, lois)
+
+        # tokenize the new sections in one batch
+        counts = count_tokens_batch(self.tokenizer, rendered.values())
+        for (key, text), num_tokens in zip(rendered.items(), counts):
+            sections[key] = (text, num_tokens)
+
+        return [sections[key] for key in keys]
+
+    def render_section(self, rel_fname, fname, lois):
+        if lois is None:
+            return "\n" + rel_fname + "\n"
+
+        context = self.get_tree_context(rel_fname, fname)
+        context.add_lines_of_interest(lois)
+        context.add_context()
+
+        return "\n" + rel_fname + ":\n" + context.format()
+
+    def get_tree_context(self, rel_fname, fname):
+        """Get a parsed TreeContext for the file, from the LRU cache if it is unchanged.
+
+        The returned context has no lines of interest, ready to be used for a new section.
+        """
+
+        try:
+            stat = os.stat(fname)
+            version = (stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            version = None
+
+        cached = self.tree_cache.pop(fname, None)
+        if cached:
+            self.tree_cache_size -= cached[2]
+            if version is not None and cached[0] == version:
+                context = cached[1]
+                context.lines_of_interest = set()
+                context.show_lines = set()
+                self.cache_tree_context(fname, version, context, cached[2])
+                return context
+
+        from grep_ast import TreeContext
+
+        code = self.io.read_text(fname) or ""
+
+        context = TreeContext(
+            rel_fname,
+            code,
+            color=False,
+            line_number=False,
+            child_context=False,
+            last_line=False,
+            margin=0,
+            mark_lois=False,
+            loi_pad=0,
+            # header_max=30,
+            show_top_of_file_parent_scope=False,
+        )
+
+        if version is not None:
+            self.cache_tree_context(fname, version, context, len(code))
+
+        return context
+
+    def cache_tree_context(self, fname, version, context, size):
+        if size > self.tree_cache_bytes:
+            return
+
+        self.tree_cache[fname] = (version, context, size)
+        self.tree_cache_size += size
+
+        # evict the least recently used files
+        while self.tree_cache_size > self.tree_cache_bytes:
+            _, (_, _, old_size) = self.tree_cache.popitem(last=False)
+            self.tree_cache_size -= old_size
+
+
+def group_tags(tags):
+    """Group the tags by file, in the order they appear in the map.
+
+    Yields (rel_fname, fname, lines_of_interest) for each file. Files which
+    are only listed by name, without any tags, have no lines of interest.
+    """
+    files = dict()
+    for tag in tags:
+        rel_fname = tag[0]
+        if type(tag) is Tag:
+            if files.get(rel_fname) is None:
+                files[rel_fname] = (tag.fname, set())
+            files[rel_fname][1].add(tag.line)
+        elif rel_fname not in files:
+            files[rel_fname] = None
+
+    for rel_fname in sorted(files):
+        if files[rel_fname] is None:
+            yield rel_fname, None, None
+        else:
+            fname, lois = files[rel_fname]
+            yield rel_fname, fname, lois
+
+
+def get_scm_fname(lang):
+    import pkg_resources
+
+    scm_fname = pkg_resources.resource_filename(
+        __name__, os.path.join("queries", f"tree-sitter-{lang}-tags.scm")
+    )
+    return Path(scm_fname)
+
+
+# the compiled tags query for each language, None if there isn't one
+tags_queries = dict()
+tags_queries_lock = threading.Lock()
+
+# parsers can't be shared between threads, so each thread gets its own
+thread_parsers = threading.local()
+
+
+def get_tags_query(lang):
+    """Load and compile the tags query for the language, once per process."""
+    if lang in tags_queries:
+        return tags_queries[lang]
+
+    from tree_sitter_languages import get_language
+
+    with tags_queries_lock:
+        if lang not in tags_queries:
+            query_scm = get_scm_fname(lang)
+            if query_scm.exists():
+                query = get_language(lang).query(query_scm.read_text())
+            else:
+                query = None
+            tags_queries[lang] = query
+
+    return tags_queries[lang]
+
+
+def get_thread_parser(lang):
+    parsers = getattr(thread_parsers, "parsers", None)
+    if parsers is None:
+        parsers = thread_parsers.parsers = dict()
+
+    if lang not in parsers:
+        from tree_sitter_languages import get_parser
+
+        parsers[lang] = get_parser(lang)
+    return parsers[lang]
+
+
+def filename_to_lang(fname):
+    # grep_ast loads all of tree_sitter_languages, so wait until a file needs it
+    from grep_ast import filename_to_lang
+
+    return filename_to_lang(fname)
+
+
+def get_tags_from_code(fname, rel_fname, code):
+    lang = filename_to_lang(fname)
+    if not lang:
+        return
+
+    # Load the tags queries
+    query = get_tags_query(lang)
+    if not query:
+        return
+
+    parser = get_thread_parser(lang)
+    tree = parser.parse(bytes(code, "utf-8"))
+
+    # Run the tags queries
+    captures = query.captures(tree.root_node)
+
+    captures = list(captures)
+
+    saw = set()
+    for node, tag in captures:
+        if tag.startswith("name.definition."):
+            kind = "def"
+        elif tag.startswith("name.reference."):
+            kind = "ref"
+        else:
+            continue
+
+        saw.add(kind)
+
+        result = Tag(
+            rel_fname=rel_fname,
+            fname=fname,
+            name=node.text.decode("utf-8"),
+            kind=kind,
+            line=node.start_point[0],
+        )
+
+        yield result
+
+    if "ref" in saw:
+        return
+    if "def" not in saw:
+        return
+
+    # We saw defs, without any refs
+    # Some tags files only provide defs (cpp, for example)
+    # Use pygments to backfill refs
+
+    try:
+        lexer = guess_lexer_for_filename(fname, code)
+    except ClassNotFound:
+        return
+
+    tokens = list(lexer.get_tokens(code))
+    tokens = [token[1] for token in tokens if token[0] in Token.Name]
+
+    for token in tokens:
+        yield Tag(
+            rel_fname=rel_fname,
+            fname=fname,
+            name=token,
+            kind="ref",
+            line=-1,
+        )
+
+
+def get_tags_worker(job):
+    """Runs in a worker process, returns None if the file can't be read"""
+    fname, rel_fname, encoding = job
+
+    lang = filename_to_lang(fname)
+    if not lang or not get_tags_query(lang):
+        return []
+
+    try:
+        with open(fname, "r", encoding=encoding) as f:
+            code = f.read()
+    except (OSError, UnicodeError):
+        return
+
+    if not code:
+        return []
+
+    return list(get_tags_from_code(fname, rel_fname, code))
+
+
+class FileTags:
+    """The tags of one file, folded into compact arrays.
+
+    The definitions are parallel arrays of (ident id, line), sorted by ident
+    id. The references are only counted, per ident id.
+    """
+
+    __slots__ = ("mtime", "fname", "def_idents", "def_lines", "ref_counts")
+
+    def __init__(self, mtime, fname, defs, ref_counts):
+        self.mtime = mtime
+        self.fname = fname
+        self.def_idents = array("i", [ident for ident, _line in defs])
+        self.def_lines = array("i", [line for _ident, line in defs])
+        self.ref_counts = ref_counts
+
+
+class TagGraph:
+    """The graph of which files reference the identifiers defined in which files.
+
+    It persists across calls to RepoMap.get_ranked_tags(), and is updated
+    incrementally: only the edges for identifiers used by files which
+    changed get rebuilt. The previous PageRank is reused as the starting
+    point for the next one.
+
+    Each file's tags are folded into a FileTags as they stream in, using
+    interned ids for the identifiers and files, so memory grows with the
+    number of unique identifiers rather than the number of references.
+    Tag objects are only made for the definitions which end up in the map.
+
+    The "networkx" backend keeps a networkx MultiDiGraph with one edge per
+    (referencer, definer, ident). The "sparse" backend keeps numpy edge
+    arrays per ident instead, and ranks with a CSR matrix, which is much
+    faster and smaller on large repos.
+    """
+
+    backends = ("networkx", "sparse")
+
+    def __init__(self, backend="networkx"):
+        if backend not in self.backends:
+            raise ValueError(f"Unknown repo map rank backend {backend}")
+        self.backend = backend
+
+        self.files = dict()  # rel_fname -> FileTags
+
+        self.file_ids = dict()
+        self.file_names = []
+        self.ident_ids = dict()
+        self.ident_names = []
+
+        # ident id -> file ids which define it, and file id -> number of references
+        self.defines = defaultdict(set)
+        self.references = defaultdict(Counter)
+
+        import networkx as nx
+
+        self.G = nx.MultiDiGraph()
+        self.ident_edges = dict()
+        self.dirty_idents = set()
+        self.refs_from_defines = False
+
+        self.personalization = None
+        self.ranked = None
+        self.ranked_definitions = None
+
+    def get_mtime(self, rel_fname):
+        if rel_fname in self.files:
+            return self.files[rel_fname].mtime
+
+    def update_file(self, rel_fname, mtime, tags):
+        self.remove_file(rel_fname)
+        file_id = intern_id(rel_fname, self.file_ids, self.file_names)
+
+        fname = None
+        defs = set()
+        ref_counts = Counter()
+        for tag in tags:
+            if tag.kind == "def":
+                fname = tag.fname
+                defs.add((intern_id(tag.name, self.ident_ids, self.ident_names), tag.line))
+            elif tag.kind == "ref":
+                ref_counts[intern_id(tag.name, self.ident_ids, self.ident_names)] += 1
+
+        file_tags = FileTags(mtime, fname, sorted(defs), dict(ref_counts))
+
+        for ident in set(file_tags.def_idents):
+            self.defines[ident].add(file_id)
+            self.dirty_idents.add(ident)
+
+        for ident, num_refs in file_tags.ref_counts.items():
+            self.references[ident][file_id] = num_refs
+            self.dirty_idents.add(ident)
+
+        self.files[rel_fname] = file_tags
+
+    def remove_file(self, rel_fname):
+        if rel_fname not in self.files:
+            return
+
+        file_tags = self.files.pop(rel_fname)
+        file_id = self.file_ids[rel_fname]
+
+        for ident in set(file_tags.def_idents):
+            self.defines[ident].discard(file_id)
+            if not self.defines[ident]:
+                del self.defines[ident]
+            self.dirty_idents.add(ident)
+
+        for ident in file_tags.ref_counts:
+            self.references[ident].pop(file_id, None)
+            if not self.references[ident]:
+                del self.references[ident]
+            self.dirty_idents.add(ident)
+
+    def get_definitions(self, rel_fname, ident):
+        """Make the def Tags for the ident in the file."""
+        file_tags = self.files.get(rel_fname)
+        ident_id = self.ident_ids.get(ident)
+        if file_tags is None or ident_id is None:
+            return []
+
+        start = bisect_left(file_tags.def_idents, ident_id)
+        end = bisect_right(file_tags.def_idents, ident_id)
+
+        return [
+            Tag(rel_fname, file_tags.fname, line, ident, "def")
+            for line in file_tags.def_lines[start:end]
+        ]
+
+    def get_references(self, ident):
+        if not self.refs_from_defines:
+            return self.references.get(ident)
+
+        # no refs anywhere, so have each definition refer to itself
+        definers = self.defines.get(ident)
+        if definers:
+            return Counter(definers)
+
+    def update_graph(self):
+        refs_from_defines = not self.references
+        if refs_from_defines != self.refs_from_defines:
+            self.refs_from_defines = refs_from_defines
+            self.dirty_idents.update(self.defines)
+            self.dirty_idents.update(self.ident_edges)
+
+        if not self.dirty_idents:
+            return False
+
+        touched = set()
+        for ident in self.dirty_idents:
+            name = self.ident_names[ident]
+
+            edges = self.ident_edges.pop(ident, [])
+            if self.backend == "networkx":
+                for referencer, definer, _num_refs in edges:
+                    self.G.remove_edge(referencer, definer, key=name)
+                    touched.add(referencer)
+                    touched.add(definer)
+
+            definers = self.defines.get(ident)
+            references = self.get_references(ident)
+            if not definers or not references:
+                continue
+
+            edges = []
+            for referencer, num_refs in references.items():
+                for definer in definers:
+                    # if referencer == definer:
+                    #    continue
+                    edges.append((referencer, definer, num_refs))
+
+            if self.backend == "networkx":
+                edges = [
+                    (self.file_names[referencer], self.file_names[definer], num_refs)
+                    for referencer, definer, num_refs in edges
+                ]
+                for referencer, definer, num_refs in edges:
+                    self.G.add_edge(referencer, definer, key=name, weight=num_refs, ident=name)
+            else:
+                edges = self.get_edge_arrays(ident, edges)
+
+            self.ident_edges[ident] = edges
+
+        # files are only nodes while they have edges, just like a fresh graph
+        for node in touched:
+            if node in self.G and not self.G.degree(node):
+                self.G.remove_node(node)
+
+        self.dirty_idents = set()
+        return True
+
+    def get_edge_arrays(self, ident, edges):
+        src = np.array([src for src, _, _ in edges])
+        dst = np.array([dst for _, dst, _ in edges])
+        weight = np.array([num_refs for _, _, num_refs in edges], dtype=float)
+        ident = np.full(len(edges), ident)
+
+        return src, dst, weight, ident
+
+    def rank(self, personalization):
+        changed = self.update_graph()
+        if not changed and self.ranked is not None and personalization == self.personalization:
+            return self.ranked, self.ranked_definitions
+
+        if self.backend == "networkx":
+            ranked, ranked_definitions = self.rank_networkx(personalization)
+        else:
+            ranked, ranked_definitions = self.rank_sparse(personalization)
+
+        # break ties by name, so both backends agree on the order
+        ranked_definitions = sorted(ranked_definitions.items(), key=lambda x: (-x[1], x[0]))
+
+        self.personalization = dict(personalization)
+        self.ranked = ranked
+        self.ranked_definitions = ranked_definitions
+
+        return ranked, ranked_definitions
+
+    def rank_networkx(self, personalization):
+        if personalization:
+            pers_args = dict(personalization=personalization, dangling=personalization)
+        else:
+            pers_args = dict()
+
+        # warm start from the previous ranks
+        if self.ranked and len(self.G):
+            default = 1.0 / len(self.G)
+            pers_args["nstart"] = dict(
+                (node, self.ranked.get(node, default)) for node in self.G.nodes
+            )
+
+        import networkx as nx
+
+        ranked = nx.pagerank(self.G, weight="weight", **pers_args)
+
+        # distribute the rank from each source node, across all of its out edges
+        ranked_definitions = defaultdict(float)
+        for src in self.G.nodes:
+            src_rank = ranked[src]
+            total_weight = sum(
+                data["weight"] for _src, _dst, data in self.G.out_edges(src, data=True)
+            )
+            # dump(src, src_rank, total_weight)
+            for _src, dst, data in self.G.out_edges(src, data=True):
+                rank = src_rank * data["weight"] / total_weight
+                ident = data["ident"]
+                ranked_definitions[(dst, ident)] += rank
+
+        return ranked, ranked_definitions
+
+    def rank_sparse(self, personalization):
+        if not self.ident_edges:
+            return dict(), dict()
+
+        arrays = list(self.ident_edges.values())
+        src, dst, weight, ident = [np.concatenate(column) for column in zip(*arrays)]
+
+        # renumber the nodes which have edges as 0..N-1
+        num_edges = len(src)
+        nodes, inverse = np.unique(np.concatenate([src, dst]), return_inverse=True)
+        src = inverse[:num_edges]
+        dst = inverse[num_edges:]
+        names = [self.file_names[node] for node in nodes.tolist()]
+
+        pers = None
+        if personalization:
+            pers = [personalization.get(name, 0) for name in names]
+
+        # warm start from the previous ranks
+        nstart = None
+        if self.ranked:
+            default = 1.0 / len(names)
+            nstart = [self.ranked.get(name, default) for name in names]
+
+        ranks = pagerank(len(names), src, dst, weight, pers, pers, nstart)
+        ranked = dict(zip(names, ranks.tolist()))
+
+        def_dst, def_ident, def_rank = distribute_rank(ranks, src, dst, weight, ident)
+        ranked_definitions = dict(
+            ((names[dst], self.ident_names[ident]), rank)
+            for dst, ident, rank in zip(def_dst.tolist(), def_ident.tolist(), def_rank.tolist())
+        )
+
+        return ranked, ranked_definitions
+
+
+def intern_id(name, ids, names):
+    if name not in ids:
+        ids[name] = len(names)
+        names.append(name)
+    return ids[name]
 
 
 def find_src_files(directory):
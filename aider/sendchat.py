@@ -1,11 +1,16 @@
+import asyncio
 import hashlib
 import json
+import threading
+import weakref
+from collections import Counter
+from pathlib import Path
 
+import aiohttp
 import backoff
 import openai
 import requests
-
-# from diskcache import Cache
+from diskcache import Cache
 from openai.error import (
     APIConnectionError,
     APIError,
@@ -14,27 +19,110 @@ from openai.error import (
     Timeout,
 )
 
+from aider import httpclient, ratelimit
+
 CACHE_PATH = "~/.aider.send.cache.v1"
+CACHE_MAX_AGE = 7 * 24 * 60 * 60
+CACHE_SIZE_LIMIT = 128 * 1024 * 1024
+
+# a ResponseCache, when --cache-responses is on
 CACHE = None
-# CACHE = Cache(CACHE_PATH)
 
 
-@backoff.on_exception(
-    backoff.expo,
-    (
-        Timeout,
-        APIError,
-        ServiceUnavailableError,
-        RateLimitError,
-        APIConnectionError,
-        requests.exceptions.ConnectionError,
-    ),
-    max_tries=10,
-    on_backoff=lambda details: print(
-        f"{details.get('exception','Exception')}\nRetry in {details['wait']:.1f} seconds."
-    ),
+class ResponseCache:
+    """Non-streaming completions on disk, keyed by a hash of the whole request.
+
+    At temperature 0 the same request gets the same answer, so asking again for
+    the commit message of the same diff, or the summary of the same chat,
+    needn't go over the network. Entries expire after max_age seconds, the
+    least recently used ones are evicted past size_limit bytes, and each is
+    tagged with its model so one model's entries can be dropped.
+    """
+
+    def __init__(self, path=CACHE_PATH, max_age=CACHE_MAX_AGE, size_limit=CACHE_SIZE_LIMIT):
+        self.max_age = max_age
+        self.cache = Cache(
+            str(Path(path).expanduser()),
+            size_limit=size_limit,
+            eviction_policy="least-recently-used",
+        )
+
+        self.lock = threading.Lock()
+        self.hits = Counter()
+        self.misses = Counter()
+
+    def get_key(self, model_name, key):
+        return f"{model_name}:{hashlib.sha1(key).hexdigest()}"
+
+    def get(self, model_name, key):
+        res = self.cache.get(self.get_key(model_name, key))
+        with self.lock:
+            if res is None:
+                self.misses[model_name] += 1
+            else:
+                self.hits[model_name] += 1
+        return res
+
+    def set(self, model_name, key, res):
+        self.cache.set(self.get_key(model_name, key), res, expire=self.max_age, tag=model_name)
+
+    def clear(self, model_name=None):
+        if model_name is None:
+            self.cache.clear()
+        else:
+            self.cache.evict(model_name)
+
+    def get_stats(self):
+        """model name -> (hits, misses)"""
+        with self.lock:
+            models = set(self.hits) | set(self.misses)
+            return dict((model, (self.hits[model], self.misses[model])) for model in models)
+
+
+RETRY_EXCEPTIONS = (
+    Timeout,
+    APIError,
+    ServiceUnavailableError,
+    APIConnectionError,
+    requests.exceptions.ConnectionError,
 )
-def send_with_retries(model_name, messages, functions, stream):
+
+
+# how many times the current thread's latest request was retried
+retries = threading.local()
+
+
+def on_backoff(details):
+    retries.count = getattr(retries, "count", 0) + 1
+    print(f"{details.get('exception','Exception')}\nRetry in {details['wait']:.1f} seconds.")
+
+
+def take_retry_count():
+    """How many retries the current thread has made since the last call."""
+    count = getattr(retries, "count", 0)
+    retries.count = 0
+    return count
+
+
+def rate_limit_waits():
+    """Wait out the pause shared by every thread, rather than backing off on our own."""
+    yield
+    while True:
+        yield ratelimit.get_limiter().retry_delay()
+
+
+def retry_rate_limits(func):
+    return backoff.on_exception(
+        rate_limit_waits, RateLimitError, max_tries=10, jitter=None, on_backoff=on_backoff
+    )(func)
+
+
+def estimate_tokens(key):
+    # about 4 bytes per token, the reply's usage settles the difference
+    return len(key) // 4
+
+
+def get_send_kwargs(model_name, messages, functions, stream):
     kwargs = dict(
         model=model_name,
         messages=messages,
@@ -54,21 +142,54 @@ def send_with_retries(model_name, messages, functions, stream):
         kwargs["headers"] = {"HTTP-Referer": "http://aider.chat", "X-Title": "Aider"}
 
     key = json.dumps(kwargs, sort_keys=True).encode()
+    return kwargs, key
+
+
+@retry_rate_limits
+@backoff.on_exception(backoff.expo, RETRY_EXCEPTIONS, max_tries=10, on_backoff=on_backoff)
+def send_with_retries(model_name, messages, functions, stream, cache=False):
+    """Send a chat completion request, retrying failures.
+
+    With cache=True, a non-streaming reply is reused from the CACHE, when
+    --cache-responses turned it on.
+    """
+    kwargs, key = get_send_kwargs(model_name, messages, functions, stream)
 
     # Generate SHA1 hash of kwargs and append it to chat_completion_call_hashes
     hash_object = hashlib.sha1(key)
 
-    if not stream and CACHE is not None and key in CACHE:
-        return hash_object, CACHE[key]
+    response_cache = CACHE if cache and not stream else None
+    if response_cache is not None:
+        res = response_cache.get(model_name, key)
+        if res is not None:
+            return hash_object, res
+
+    limiter = ratelimit.get_limiter()
+    num_tokens = estimate_tokens(key)
+    limiter.acquire(num_tokens)
+
+    httpclient.use_for_openai()
+    try:
+        res = openai.ChatCompletion.create(**kwargs)
+    except RateLimitError as err:
+        limiter.rate_limited(err.headers)
+        raise
 
-    res = openai.ChatCompletion.create(**kwargs)
+    limiter.record_usage(num_tokens, None if stream else get_usage(res))
 
-    if not stream and CACHE is not None:
-        CACHE[key] = res
+    if response_cache is not None and res is not None:
+        response_cache.set(model_name, key, res)
 
     return hash_object, res
 
 
+def get_usage(res):
+    try:
+        return res.get("usage")
+    except AttributeError:
+        return
+
+
 def simple_send_with_retries(model_name, messages):
     try:
         _hash, response = send_with_retries(
@@ -76,6 +197,95 @@ def simple_send_with_retries(model_name, messages):
             messages=messages,
             functions=None,
             stream=False,
+            cache=True,
+        )
+        return response.choices[0].message.content
+    except (AttributeError, openai.error.InvalidRequestError):
+        return
+
+
+# the most requests that each event loop has in flight at once
+MAX_CONCURRENT_REQUESTS = 4
+
+request_limiters = weakref.WeakKeyDictionary()
+
+
+def get_request_limiter():
+    loop = asyncio.get_running_loop()
+    limiter = request_limiters.get(loop)
+    if limiter is None:
+        limiter = request_limiters[loop] = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+    return limiter
+
+
+@retry_rate_limits
+@backoff.on_exception(
+    backoff.expo,
+    RETRY_EXCEPTIONS + (aiohttp.ClientError,),
+    max_tries=10,
+    on_backoff=on_backoff,
+)
+async def acreate_with_retries(kwargs, key):
+    limiter = ratelimit.get_limiter()
+    num_tokens = estimate_tokens(key)
+    await limiter.acquire_async(num_tokens)
+
+    httpclient.use_for_openai_async()
+    try:
+        res = await openai.ChatCompletion.acreate(**kwargs)
+    except RateLimitError as err:
+        limiter.rate_limited(err.headers)
+        raise
+
+    limiter.record_usage(num_tokens, None if kwargs["stream"] else get_usage(res))
+    return res
+
+
+async def send_with_retries_async(model_name, messages, functions, cache=False):
+    """Like send_with_retries() with stream=False, for asyncio.
+
+    At most MAX_CONCURRENT_REQUESTS of these are sent at once from each
+    event loop, the rest wait their turn.
+    """
+    kwargs, key = get_send_kwargs(model_name, messages, functions, False)
+    hash_object = hashlib.sha1(key)
+
+    response_cache = CACHE if cache else None
+    if response_cache is not None:
+        res = response_cache.get(model_name, key)
+        if res is not None:
+            return hash_object, res
+
+    async with get_request_limiter():
+        res = await acreate_with_retries(kwargs, key)
+
+    if response_cache is not None and res is not None:
+        response_cache.set(model_name, key, res)
+
+    return hash_object, res
+
+
+async def stream_with_retries_async(model_name, messages, functions):
+    """Yield the chunks of a streamed reply, for asyncio.
+
+    Only starting the request is retried. It counts towards the concurrency
+    limit until the whole reply has arrived.
+    """
+    kwargs, key = get_send_kwargs(model_name, messages, functions, True)
+
+    async with get_request_limiter():
+        res = await acreate_with_retries(kwargs, key)
+        async for chunk in res:
+            yield chunk
+
+
+async def simple_send_with_retries_async(model_name, messages):
+    try:
+        _hash, response = await send_with_retries_async(
+            model_name=model_name,
+            messages=messages,
+            functions=None,
+            cache=True,
         )
         return response.choices[0].message.content
     except (AttributeError, openai.error.InvalidRequestError):
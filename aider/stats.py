@@ -0,0 +1,103 @@
+import statistics
+import time
+
+from aider.dump import dump  # noqa: F401
+
+
+class RequestStats:
+    """Where the wall clock time of one chat completion request went.
+
+    latency runs from sending the request, retries included, to the last
+    chunk of the reply. For a reply that isn't streamed, the first token
+    arrives with all the others.
+    """
+
+    def __init__(self, model, stream):
+        self.model = model
+        self.stream = stream
+
+        self.start = time.perf_counter()
+        self.response_time = None
+        self.first_token_time = None
+        self.end = None
+
+        self.retries = 0
+        self.bytes_received = 0
+        self.completion_tokens = None
+        self.interrupted = False
+
+    def response(self, retries=0):
+        """The api accepted the request, and the reply is about to start."""
+        self.response_time = time.perf_counter()
+        self.retries = retries
+
+    def received(self, text):
+        if not text:
+            return
+
+        if self.first_token_time is None:
+            self.first_token_time = time.perf_counter()
+        self.bytes_received += len(text.encode("utf-8"))
+
+    def finish(self, completion_tokens=None, interrupted=False):
+        self.end = time.perf_counter()
+        if self.first_token_time is None and not self.stream:
+            self.first_token_time = self.end
+        self.completion_tokens = completion_tokens
+        self.interrupted = interrupted
+
+    def to_dict(self):
+        def elapsed(when):
+            if when is None:
+                return
+            return round(when - self.start, 4)
+
+        latency = elapsed(self.end)
+
+        tokens_per_sec = None
+        if self.completion_tokens and self.end is not None:
+            # a streamed reply's rate is from its first token on
+            if self.stream and self.first_token_time is not None:
+                duration = self.end - self.first_token_time
+            else:
+                duration = self.end - self.start
+            if duration > 0:
+                tokens_per_sec = round(self.completion_tokens / duration, 1)
+
+        return dict(
+            model=self.model,
+            stream=self.stream,
+            response_time=elapsed(self.response_time),
+            time_to_first_token=elapsed(self.first_token_time),
+            latency=latency,
+            completion_tokens=self.completion_tokens,
+            tokens_per_sec=tokens_per_sec,
+            bytes_received=self.bytes_received,
+            retries=self.retries,
+            interrupted=self.interrupted,
+        )
+
+
+def summarize(request_stats):
+    """Totals and medians over a list of RequestStats.to_dict() results."""
+    if not request_stats:
+        return
+
+    def values(key):
+        return [stats[key] for stats in request_stats if stats.get(key) is not None]
+
+    def median(key):
+        vals = values(key)
+        if vals:
+            return statistics.median(vals)
+
+    return dict(
+        num_requests=len(request_stats),
+        total_latency=round(sum(values("latency")), 4),
+        median_latency=median("latency"),
+        median_time_to_first_token=median("time_to_first_token"),
+        median_tokens_per_sec=median("tokens_per_sec"),
+        completion_tokens=sum(values("completion_tokens")),
+        bytes_received=sum(values("bytes_received")),
+        retries=sum(values("retries")),
+    )
@@ -0,0 +1,137 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from aider.dump import dump  # noqa: F401
+
+# shared by every model instance, keyed by model or encoding name
+tokenizers = dict()
+tokenizers_lock = threading.Lock()
+
+encode_pool = None
+encode_pool_lock = threading.Lock()
+
+# below this many chars, threads cost more than they save
+min_batch_chars = 64 * 1024
+
+
+def get_tokenizer(model_name=None, encoding_name=None):
+    """The tiktoken encoding for model_name, or the one called encoding_name."""
+    key = (model_name, encoding_name)
+    tokenizer = tokenizers.get(key)
+    if tokenizer is not None:
+        return tokenizer
+
+    # loading tiktoken and its encodings is slow, so wait until a tokenizer is needed
+    import tiktoken
+
+    with tokenizers_lock:
+        if key not in tokenizers:
+            if model_name:
+                tokenizers[key] = tiktoken.encoding_for_model(model_name)
+            else:
+                tokenizers[key] = tiktoken.get_encoding(encoding_name)
+        return tokenizers[key]
+
+
+def get_encode_pool():
+    global encode_pool
+
+    num_threads = min(os.cpu_count() or 1, 8)
+    if num_threads < 2:
+        return
+
+    with encode_pool_lock:
+        if encode_pool is None:
+            encode_pool = ThreadPoolExecutor(num_threads, thread_name_prefix="aider-tokens")
+        return encode_pool
+
+
+def encode_batch(tokenizer, texts):
+    """Encode each of the texts, spreading big batches over a shared thread pool.
+
+    tiktoken releases the GIL while it encodes, so the threads run in parallel.
+    Unlike tiktoken's own encode_batch(), the pool isn't started afresh for
+    every call.
+    """
+    texts = list(texts)
+
+    pool = None
+    if len(texts) > 1 and sum(len(text) for text in texts) >= min_batch_chars:
+        pool = get_encode_pool()
+
+    if pool is None:
+        return [tokenizer.encode(text) for text in texts]
+    return list(pool.map(tokenizer.encode, texts))
+
+
+def count_tokens_batch(tokenizer, texts):
+    return [len(tokens) for tokens in encode_batch(tokenizer, texts)]
+
+
+class TokenLedger:
+    """Counts tokens like Model.token_count(), but only tokenizes each block of text once.
+
+    Counts are remembered by the sha1 of the text, so the file contents, repo
+    map and chat history that go into every prompt are only tokenized again
+    when they change. A list of messages is counted one message at a time,
+    which can differ by a few tokens from tokenizing the whole list as one
+    json string.
+    """
+
+    max_entries = 4096
+
+    def __init__(self, model, max_entries=None):
+        self.model = model
+        self.counts = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+        if max_entries is not None:
+            self.max_entries = max_entries
+
+    def token_count(self, messages):
+        if not self.model.tokenizer:
+            return
+
+        if type(messages) is str:
+            return self.count_text(messages)
+
+        return sum(self.count_texts(self.message_text(msg) for msg in messages))
+
+    def message_text(self, msg):
+        if type(msg) is str:
+            return msg
+        return json.dumps(msg)
+
+    def count_text(self, text):
+        return self.count_texts([text])[0]
+
+    def count_texts(self, texts):
+        """The token counts of the texts, tokenizing all the ones not seen before in one batch."""
+        keys = []
+        missing = dict()
+        for text in texts:
+            key = hashlib.sha1(text.encode("utf-8", "surrogatepass")).digest()
+            keys.append(key)
+            if key in self.counts:
+                self.hits += 1
+                self.counts.move_to_end(key)
+            elif key not in missing:
+                self.misses += 1
+                missing[key] = text
+
+        counts = dict((key, self.counts[key]) for key in keys if key in self.counts)
+        if missing:
+            new_counts = count_tokens_batch(self.model.tokenizer, missing.values())
+            for key, num_tokens in zip(missing, new_counts):
+                counts[key] = num_tokens
+                self.counts[key] = num_tokens
+
+            while len(self.counts) > self.max_entries:
+                self.counts.popitem(last=False)
+
+        return [counts[key] for key in keys]
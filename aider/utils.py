@@ -1,30 +1,7 @@
+import hashlib
 from pathlib import Path
 from .dump import dump  # noqa: F401
 
-from bs4 import BeautifulSoup
-from selenium.common.exceptions import WebDriverException
-from selenium.webdriver.chrome.options import Options as ChromeOptions
-from selenium.webdriver.chrome.service import Service as ChromeDriverService
-from selenium.webdriver.chrome.webdriver import WebDriver as ChromeDriver
-from selenium.webdriver.common.by import By
-from selenium.webdriver.common.options import ArgOptions as BrowserOptions
-from selenium.webdriver.edge.options import Options as EdgeOptions
-from selenium.webdriver.edge.service import Service as EdgeDriverService
-from selenium.webdriver.edge.webdriver import WebDriver as EdgeDriver
-from selenium.webdriver.firefox.options import Options as FirefoxOptions
-from selenium.webdriver.firefox.service import Service as GeckoDriverService
-from selenium.webdriver.firefox.webdriver import WebDriver as FirefoxDriver
-from selenium.webdriver.remote.webdriver import WebDriver
-from selenium.webdriver.safari.options import Options as SafariOptions
-from selenium.webdriver.safari.webdriver import WebDriver as SafariDriver
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.support.wait import WebDriverWait
-from webdriver_manager.chrome import ChromeDriverManager
-from webdriver_manager.firefox import GeckoDriverManager
-from webdriver_manager.microsoft import EdgeChromiumDriverManager as EdgeDriverManager
-
-from typing import Type
-
 
 def safe_abs_path(res):
     "Gives an abs path, which safely returns a full (not 8.3) windows path"
@@ -32,6 +9,12 @@ def safe_abs_path(res):
     return str(res)
 
 
+def git_blob_sha(data):
+    "The sha git would assign to a blob with these contents"
+    header = f"blob {len(data)}\0".encode()
+    return hashlib.sha1(header + data).hexdigest()
+
+
 def show_messages(messages, title=None, functions=None):
     if title:
         print(title.upper(), "*" * 50)
@@ -50,7 +33,7 @@ def show_messages(messages, title=None, functions=None):
         dump(functions)
         
 # Taken from AutoGPT, MIT License
-def open_page_in_browser(url: str, selenium_web_browser='chrome', selenium_headless=True, platform='linux', user_agent='user') -> WebDriver:
+def open_page_in_browser(url: str, selenium_web_browser='chrome', selenium_headless=True, platform='linux', user_agent='user'):
     """Open a browser window and load a web page using Selenium
 
     Params:
@@ -60,14 +43,33 @@ def open_page_in_browser(url: str, selenium_web_browser='chrome', selenium_headl
     Returns:
         driver (WebDriver): A driver object representing the browser window to scrape
     """
-    options_available: dict[str, Type[BrowserOptions]] = {
+    # selenium is slow to import, and only needed for /web
+    from selenium.webdriver.chrome.options import Options as ChromeOptions
+    from selenium.webdriver.chrome.service import Service as ChromeDriverService
+    from selenium.webdriver.chrome.webdriver import WebDriver as ChromeDriver
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.edge.options import Options as EdgeOptions
+    from selenium.webdriver.edge.service import Service as EdgeDriverService
+    from selenium.webdriver.edge.webdriver import WebDriver as EdgeDriver
+    from selenium.webdriver.firefox.options import Options as FirefoxOptions
+    from selenium.webdriver.firefox.service import Service as GeckoDriverService
+    from selenium.webdriver.firefox.webdriver import WebDriver as FirefoxDriver
+    from selenium.webdriver.safari.options import Options as SafariOptions
+    from selenium.webdriver.safari.webdriver import WebDriver as SafariDriver
+    from selenium.webdriver.support import expected_conditions as EC
+    from selenium.webdriver.support.wait import WebDriverWait
+    from webdriver_manager.chrome import ChromeDriverManager
+    from webdriver_manager.firefox import GeckoDriverManager
+    from webdriver_manager.microsoft import EdgeChromiumDriverManager as EdgeDriverManager
+
+    options_available = {
         "chrome": ChromeOptions,
         "edge": EdgeOptions,
         "firefox": FirefoxOptions,
         "safari": SafariOptions,
     }
 
-    options: BrowserOptions = options_available[selenium_web_browser]()
+    options = options_available[selenium_web_browser]()
     options.add_argument(f"user-agent={user_agent}")
 
     if selenium_web_browser == "firefox":
@@ -114,7 +116,7 @@ def open_page_in_browser(url: str, selenium_web_browser='chrome', selenium_headl
 
 
 # Taken from AutoGPT, MIT License
-def scrape_text_with_selenium(driver: WebDriver) -> str:
+def scrape_text_with_selenium(driver) -> str:
     """Scrape text from a browser window using selenium
 
     Args:
@@ -124,6 +126,8 @@ def scrape_text_with_selenium(driver: WebDriver) -> str:
         str: the text scraped from the website
     """
 
+    from bs4 import BeautifulSoup
+
     # Get the HTML content directly from the browser's DOM
     page_source = driver.execute_script("return document.body.outerHTML;")
     soup = BeautifulSoup(page_source, "html.parser")
@@ -4,8 +4,40 @@ The server is implemented as part of aider-vscode extension.
 This client is meant to be used by "add" command and its auto-completion.
 """
 
+import threading
+
 import requests
 
+# the extension server is local, so a couple of pooled connections is plenty
+POOL_SIZE = 2
+
+session = None
+session_lock = threading.Lock()
+
+
+def get_session():
+    """The pooled session for the calls to the extension server.
+
+    It is kept apart from the shared LLM session, whose proxies and
+    connection retries are wrong for a localhost endpoint.
+    """
+    global session
+
+    if session is not None:
+        return session
+
+    with session_lock:
+        if session is None:
+            new_session = requests.Session()
+            # ignore HTTP_PROXY and friends, the server is on localhost
+            new_session.trust_env = False
+            adapter = requests.adapters.HTTPAdapter(
+                pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE, max_retries=0
+            )
+            new_session.mount("http://", adapter)
+            session = new_session
+        return session
+
 
 def get_ack(port):
     """verify that the server is online
@@ -14,7 +46,7 @@ def get_ack(port):
     """
 
     URL = "http://localhost:" + str(port) + "/add" + "/ack"
-    r = requests.get(url=URL, timeout=1)
+    r = get_session().get(url=URL, timeout=1)
     if r.status_code != 200:
         raise Exception("Error getting ack from extension server, status code: " + str(r.status_code))
     return True
@@ -27,7 +59,7 @@ def get_prefixes(port):
     """
 
     URL = "http://localhost:" + str(port) + "/add" + "/prefixes"
-    r = requests.get(url=URL, timeout=0.2)
+    r = get_session().get(url=URL, timeout=0.2)
     if r.status_code != 200:
         raise Exception("Error getting prefixes, status code: " + str(r.status_code))
     return r.text.strip().split("\n")
@@ -40,7 +72,7 @@ def get_titles(port):
     """
 
     URL = "http://localhost:" + str(port) + "/add" + "/titles"
-    r = requests.get(url=URL, timeout=0.2)
+    r = get_session().get(url=URL, timeout=0.2)
     if r.status_code != 200:
         raise Exception("Error getting titles, status code: " + str(r.status_code))
     return r.text.strip().split("\n")
@@ -53,7 +85,7 @@ def get_content(port, title):
     """
 
     URL = "http://localhost:" + str(port) + "/add" + "/content" + "/" + title
-    r = requests.get(url=URL, timeout=5)
+    r = get_session().get(url=URL, timeout=5)
     if r.status_code != 200:
         raise Exception("Error getting content, status code: " + str(r.status_code))
     return r.text
@@ -0,0 +1,217 @@
+import os
+import stat
+import threading
+
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+except ImportError:
+    FileSystemEventHandler = object
+    Observer = None
+
+from aider import utils
+
+from .dump import dump  # noqa: F401
+
+
+class FileWatcher:
+    """Keeps track of the mtimes of the files under root, so they needn't be stat-ed every turn.
+
+    If watchdog is installed, an inotify observer (or the platform's
+    equivalent) reports which paths changed, and only those get stat-ed again.
+    Otherwise, or if the observer can't be started, it falls back to polling
+    and stats a file every time it is asked about it.
+
+    Events arrive a moment after the write, so a file changed just before it
+    is asked about can still show its old mtime. Callers that change files
+    themselves should invalidate() them.
+
+    .git and the ignored_dirs (relative to root) aren't watched at all, and
+    the files in them are always stat-ed.
+    """
+
+    def __init__(self, root, watch=True, ignored_dirs=None):
+        self.root = utils.safe_abs_path(root)
+        self.mtimes = dict()
+
+        self.ignored_dirs = set([".git"])
+        for dname in ignored_dirs or []:
+            self.ignored_dirs.add(os.path.normpath(dname))
+
+        # dirs watched without their subdirs, because something below them is ignored
+        self.shallow_dirs = set()
+
+        self.lock = threading.Lock()
+        self.changed = set()
+        self.reset = False
+
+        self.observer = None
+        if watch:
+            self.start()
+
+    def start(self):
+        if Observer is None:
+            return
+
+        observer = Observer()
+        try:
+            self.schedule(observer, self.root)
+            observer.start()
+        except OSError:
+            # eg: ran out of inotify watches, so poll instead
+            observer.unschedule_all()
+            self.shallow_dirs = set()
+            return
+
+        self.observer = observer
+
+    def schedule(self, observer, dname):
+        """Watch dname, and every subdir of it which isn't ignored."""
+        rel_dname = os.path.relpath(dname, self.root)
+        if not self.has_ignored_below(rel_dname):
+            observer.schedule(ChangeHandler(self), dname, recursive=True)
+            return
+
+        observer.schedule(ChangeHandler(self), dname, recursive=False)
+        self.shallow_dirs.add(dname)
+
+        for entry in os.scandir(dname):
+            if not entry.is_dir(follow_symlinks=False):
+                continue
+            if self.is_ignored_dir(os.path.normpath(os.path.join(rel_dname, entry.name))):
+                continue
+            self.schedule(observer, entry.path)
+
+    def has_ignored_below(self, rel_dname):
+        if rel_dname == os.curdir:
+            return True
+
+        prefix = rel_dname + os.sep
+        return any(dname.startswith(prefix) for dname in self.ignored_dirs)
+
+    def is_ignored_dir(self, rel_dname):
+        parts = rel_dname.split(os.sep)
+        if ".git" in parts:
+            return True
+
+        for i in range(1, len(parts) + 1):
+            if os.sep.join(parts[:i]) in self.ignored_dirs:
+                return True
+
+    def on_new_dir(self, dname):
+        """Watch a dir created in one that is watched without its subdirs."""
+        observer = self.observer
+        if observer is None or os.path.dirname(dname) not in self.shallow_dirs:
+            return
+
+        rel_dname = os.path.relpath(dname, self.root)
+        if self.is_ignored_dir(rel_dname):
+            return
+
+        try:
+            self.schedule(observer, dname)
+        except OSError:
+            # poll the files in it instead
+            self.ignored_dirs.add(rel_dname)
+
+    def stop(self):
+        if self.observer is None:
+            return
+
+        self.observer.stop()
+        self.observer.join()
+        self.observer = None
+        with self.lock:
+            self.mtimes = dict()
+
+    def is_watching(self):
+        return self.observer is not None
+
+    def is_watched(self, fname):
+        if self.observer is None or not fname.startswith(self.root + os.sep):
+            return False
+
+        rel_dname = os.path.dirname(os.path.relpath(fname, self.root))
+        return not rel_dname or not self.is_ignored_dir(rel_dname)
+
+    def on_change(self, path):
+        with self.lock:
+            self.changed.add(path)
+
+    def on_reset(self):
+        with self.lock:
+            self.reset = True
+
+    def invalidate(self, fname=None):
+        """Forget what is known about the file, or about every file if fname is None."""
+        if fname is None:
+            self.on_reset()
+        else:
+            self.on_change(str(fname))
+
+    def sync(self):
+        with self.lock:
+            self.sync_locked()
+
+    def sync_locked(self):
+        if self.reset:
+            self.mtimes = dict()
+        else:
+            for path in self.changed:
+                self.mtimes.pop(path, None)
+
+        self.changed = set()
+        self.reset = False
+
+    def get_mtime(self, fname):
+        """The mtime of the file, or None if it isn't a normal file."""
+        fname = str(fname)
+
+        # files outside root, in .git or in ignored dirs won't get any events
+        if not self.is_watched(fname):
+            return stat_mtime(fname)
+
+        # the repo map precompute thread asks too
+        with self.lock:
+            self.sync_locked()
+            if fname not in self.mtimes:
+                self.mtimes[fname] = stat_mtime(fname)
+            return self.mtimes[fname]
+
+    def is_file(self, fname):
+        return self.get_mtime(fname) is not None
+
+
+class ChangeHandler(FileSystemEventHandler):
+    def __init__(self, watcher):
+        self.watcher = watcher
+
+    def on_any_event(self, event):
+        if event.event_type not in ("created", "deleted", "modified", "moved"):
+            return
+
+        if event.is_directory:
+            # a dir changing just means a file in it was added or removed
+            if event.event_type != "modified":
+                self.watcher.on_reset()
+            if event.event_type in ("created", "moved"):
+                new_dname = getattr(event, "dest_path", "") or event.src_path
+                self.watcher.on_new_dir(os.fsdecode(new_dname))
+            return
+
+        for path in (event.src_path, getattr(event, "dest_path", "")):
+            # nested repos' .git dirs are still watched
+            if path and f"{os.sep}.git{os.sep}" not in path:
+                self.watcher.on_change(os.fsdecode(path))
+
+
+def stat_mtime(fname):
+    try:
+        st = os.stat(fname)
+    except OSError:
+        return
+
+    if not stat.S_ISREG(st.st_mode):
+        return
+
+    return st.st_mtime
@@ -25,7 +25,7 @@ import typer
 from imgcat import imgcat
 from rich.console import Console
 
-from aider import models
+from aider import models, ratelimit, stats
 from aider.coders import Coder
 from aider.dump import dump  # noqa: F401
 from aider.io import InputOutput
@@ -331,6 +331,12 @@ def main(
     tries: int = typer.Option(2, "--tries", "-r", help="Number of tries for running tests"),
     threads: int = typer.Option(1, "--threads", "-t", help="Number of threads to run in parallel"),
     num_tests: int = typer.Option(-1, "--num-tests", "-n", help="Number of tests to run"),
+    requests_per_minute: int = typer.Option(
+        None, "--requests-per-minute", help="Api request budget shared by all threads"
+    ),
+    tokens_per_minute: int = typer.Option(
+        None, "--tokens-per-minute", help="Api token budget shared by all threads"
+    ),
 ):
     repo = git.Repo(search_parent_directories=True)
     commit_hash = repo.head.object.hexsha[:7]
@@ -391,6 +397,8 @@ def main(
         keywords = keywords.split(",")
         test_dnames = [dn for dn in test_dnames for keyword in keywords if keyword in dn]
 
+    ratelimit.configure(requests_per_minute, tokens_per_minute)
+
     random.shuffle(test_dnames)
     if num_tests > 0:
         test_dnames = test_dnames[:num_tests]
@@ -431,6 +439,12 @@ def main(
     print()
     summarize_results(dirname)
 
+    limits = ratelimit.get_limiter().get_stats()
+    print(
+        f"rate limit: {limits['num_rate_limited']} errors,"
+        f" {limits['num_waits']} waits, {limits['wait_time']:.1f} sec waiting"
+    )
+
     return 0
 
 
@@ -490,6 +504,7 @@ def summarize_results(dirname):
     res.dir_name = str(dirname)
 
     passed_tests = [0] * tries
+    request_stats = []
 
     res.completed_tests = 0
     res.duration = 0
@@ -518,6 +533,7 @@ def summarize_results(dirname):
         res.error_outputs += results.get("num_error_outputs", 0)
         res.user_asks += results.get("num_user_asks", 0)
         res.exhausted_context_windows += results.get("num_exhausted_context_windows", 0)
+        request_stats += results.get("request_stats", [])
 
         for key in "model edit_format commit_hash".split():
             val = results.get(key)
@@ -558,6 +574,19 @@ def summarize_results(dirname):
 
     console.print(f"duration: {res.avg_duration:.1f} sec/test-case")
 
+    request_summary = stats.summarize(request_stats)
+    if request_summary:
+        res.llm_latency = request_summary["total_latency"]
+        res.median_time_to_first_token = request_summary["median_time_to_first_token"]
+        res.median_tokens_per_sec = request_summary["median_tokens_per_sec"]
+        res.retries = request_summary["retries"]
+        console.print(
+            f"llm requests: {request_summary['num_requests']},"
+            f" {res.llm_latency / res.completed_tests:.1f} sec/test-case,"
+            f" median time to first token {res.median_time_to_first_token}s,"
+            f" median {res.median_tokens_per_sec} tokens/sec, {res.retries} retries"
+        )
+
     res.avg_cost = res.cost / res.completed_tests
 
     projected_cost = res.avg_cost * res.total_tests
@@ -692,6 +721,7 @@ def run_test(
         num_error_outputs=io.num_error_outputs,
         num_user_asks=io.num_user_asks,
         num_exhausted_context_windows=coder.num_exhausted_context_windows,
+        request_stats=coder.request_stats,
         chat_hashes=list(
             zip(
                 coder.chat_completion_call_hashes,
@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+
+"""Measure per-request latency against a local stub chat completion server,
+with and without the shared connection pool from aider.httpclient.
+
+"fresh" opens a new connection for every request, like a bare requests.get()
+or an openai call from a new thread (the summarizer and commit message
+threads) used to. "pooled" sends every request over aider's shared session.
+With --tls the stub serves https with a throwaway self-signed cert, so the
+fresh connections pay for a TLS handshake too, like they do against the real
+apis. Loopback has no network round trips, so real savings are bigger.
+
+With --concurrency N it also sends batches of N chat completions at once
+through the openai client, from N threads with send_with_retries() versus one
+event loop with send_with_retries_async(), like the summarizer and commit
+message generation now do. --delay makes the stub take that long to reply,
+like a real model does.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import ssl
+import statistics
+import subprocess
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import openai
+import requests
+
+from aider import httpclient, sendchat
+from aider.dump import dump  # noqa: F401
+
+COMPLETION = json.dumps(
+    dict(
+        id="chatcmpl-1",
+        object="chat.completion",
+        choices=[dict(index=0, message=dict(role="assistant", content="hi"), finish_reason="stop")],
+    )
+).encode()
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    # headers and body are separate writes, which nagle would hold up on a reused connection
+    disable_nagle_algorithm = True
+
+    delay = 0
+
+    def do_POST(self):
+        if self.delay:
+            time.sleep(self.delay)
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(COMPLETION)))
+        self.end_headers()
+        self.wfile.write(COMPLETION)
+
+    def log_message(self, *args):
+        pass
+
+
+def make_cert(dname):
+    certfile = os.path.join(dname, "cert.pem")
+    keyfile = os.path.join(dname, "key.pem")
+    cmd = [
+        "openssl",
+        "req",
+        "-x509",
+        "-newkey",
+        "rsa:2048",
+        "-nodes",
+        "-days",
+        "1",
+        "-subj",
+        "/CN=127.0.0.1",
+        "-addext",
+        "subjectAltName=IP:127.0.0.1",
+        "-keyout",
+        keyfile,
+        "-out",
+        certfile,
+    ]
+    subprocess.run(cmd, check=True, capture_output=True)
+    return certfile, keyfile
+
+
+def start_server(certfile=None, keyfile=None):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    scheme = "http"
+    if certfile:
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(certfile, keyfile)
+        server.socket = context.wrap_socket(server.socket, server_side=True)
+        scheme = "https"
+
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"{scheme}://127.0.0.1:{server.server_port}/v1/chat/completions"
+
+
+def time_requests(num_requests, send):
+    latencies = []
+    for _ in range(num_requests):
+        start = time.perf_counter()
+        send()
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def time_concurrent(num_batches, concurrency):
+    messages = [dict(role="user", content="hello")]
+
+    def send():
+        sendchat.send_with_retries("gpt-3.5-turbo", messages, None, False)
+
+    def threads():
+        batch = [threading.Thread(target=send) for _ in range(concurrency)]
+        for thread in batch:
+            thread.start()
+        for thread in batch:
+            thread.join()
+
+    async def gather():
+        await asyncio.gather(
+            *(
+                sendchat.send_with_retries_async("gpt-3.5-turbo", messages, None)
+                for _ in range(concurrency)
+            )
+        )
+
+    def background():
+        httpclient.submit(gather()).result()
+
+    # warm up
+    threads()
+    background()
+
+    return dict(
+        threads=time_requests(num_batches, threads),
+        asyncio=time_requests(num_batches, background),
+    )
+
+
+def print_stats(name, latencies):
+    latencies = sorted(latencies)
+    mean = statistics.mean(latencies) * 1000
+    median = statistics.median(latencies) * 1000
+    p95 = latencies[int(len(latencies) * 0.95)] * 1000
+    print(f"{name:>7} {mean:7.2f}ms {median:7.2f}ms {p95:7.2f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--tls", action="store_true", help="serve https with a self-signed cert")
+    parser.add_argument("--concurrency", type=int, help="also time batches of parallel requests")
+    parser.add_argument("--delay", type=float, default=0, help="seconds the stub takes to reply")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        certfile = keyfile = None
+        if args.tls:
+            certfile, keyfile = make_cert(temp_dir)
+
+        StubHandler.delay = args.delay
+        server, url = start_server(certfile, keyfile)
+        body = dict(model="gpt-3.5-turbo", messages=[dict(role="user", content="hello")])
+        verify = certfile or True
+
+        def fresh():
+            with requests.Session() as session:
+                session.post(url, json=body, verify=verify).raise_for_status()
+
+        pooled_session = httpclient.get_session()
+
+        def pooled():
+            pooled_session.post(url, json=body, verify=verify).raise_for_status()
+
+        # warm up
+        fresh()
+        pooled()
+
+        print(f"{args.requests} requests to {url}")
+        print(f"{'':>7} {'mean':>9} {'median':>9} {'p95':>9}")
+        for name, send in [("fresh", fresh), ("pooled", pooled)]:
+            print_stats(name, time_requests(args.requests, send))
+
+        if args.concurrency:
+            if certfile:
+                # requests and aiohttp each find their CA bundle differently
+                os.environ["REQUESTS_CA_BUNDLE"] = certfile
+                os.environ["SSL_CERT_FILE"] = certfile
+            openai.api_base = url.rsplit("/", 2)[0]
+            openai.api_key = "unused"
+            httpclient.configure(max(args.concurrency, httpclient.pool_size))
+            sendchat.MAX_CONCURRENT_REQUESTS = args.concurrency
+
+            num_batches = max(args.requests // args.concurrency, 1)
+            print()
+            print(f"{num_batches} batches of {args.concurrency} chat completions")
+            print(f"{'':>7} {'mean':>9} {'median':>9} {'p95':>9}")
+            for name, latencies in time_concurrent(num_batches, args.concurrency).items():
+                print_stats(name, latencies)
+
+        pooled_session.shutdown()
+        server.shutdown()
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+
+"""Time how long it takes to import aider, per module, with python -X importtime.
+
+Each run imports the module in a fresh interpreter. The cumulative and self
+times of every module are averaged over the runs, and the slowest ones are
+shown, so it is easy to see which dependency a startup regression came from.
+"""
+
+import argparse
+import subprocess
+import sys
+from collections import defaultdict
+
+from aider.dump import dump  # noqa: F401
+
+
+def import_times(module):
+    """The (self, cumulative) import time of every module, in microseconds."""
+    cmd = [sys.executable, "-X", "importtime", "-c", f"import {module}"]
+    res = subprocess.run(cmd, capture_output=True, text=True, check=True)
+
+    times = dict()
+    for line in res.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        self_us, cumulative_us, name = line[len("import time:") :].split("|")
+        if not self_us.strip().isdigit():
+            # the header line
+            continue
+        times[name.strip()] = (int(self_us), int(cumulative_us))
+
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("module", nargs="?", default="aider.main")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=25)
+    parser.add_argument("--only-aider", action="store_true", help="only show aider modules")
+    args = parser.parse_args()
+
+    # the first run warms the file system cache and the .pyc files
+    import_times(args.module)
+
+    totals = defaultdict(lambda: [0, 0])
+    for _ in range(args.runs):
+        for name, (self_us, cumulative_us) in import_times(args.module).items():
+            totals[name][0] += self_us
+            totals[name][1] += cumulative_us
+
+    rows = [
+        (name, self_us / args.runs, cum_us / args.runs)
+        for name, (self_us, cum_us) in totals.items()
+    ]
+    rows.sort(key=lambda row: row[2], reverse=True)
+    if args.only_aider:
+        rows = [row for row in rows if row[0] == "aider" or row[0].startswith("aider.")]
+
+    total_ms = sum(self_us for _, self_us, _ in rows if self_us) / 1000
+    print(f"import {args.module}: {len(totals)} modules, averaged over {args.runs} runs")
+    print(f"{'self':>9} {'cumulative':>11}  module")
+    for name, self_us, cumulative_us in rows[: args.top]:
+        print(f"{self_us / 1000:7.1f}ms {cumulative_us / 1000:9.1f}ms  {name}")
+
+    if not args.only_aider:
+        print(f"{total_ms:7.1f}ms total")
+
+
+if __name__ == "__main__":
+    main()
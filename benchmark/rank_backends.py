@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+
+"""Compare the networkx and sparse repo map rank backends on synthetic repos."""
+
+import argparse
+import random
+import time
+
+from aider.dump import dump  # noqa: F401
+from aider.repomap import Tag, TagGraph
+
+
+def make_repo(num_files, num_idents, defs_per_file, refs_per_file, seed=0):
+    rand = random.Random(seed)
+
+    # a few very popular idents, and a long tail, like real code
+    idents = [f"ident{i}" for i in range(num_idents)]
+    ident_weights = [1.0 / (i + 1) for i in range(num_idents)]
+
+    files = dict()
+    for i in range(num_files):
+        rel_fname = f"pkg{i % 50}/module{i}.py"
+        tags = []
+        for name in rand.sample(idents, defs_per_file):
+            line = rand.randrange(1000)
+            tags.append(Tag(rel_fname, rel_fname, line, name, "def"))
+        for name in rand.choices(idents, weights=ident_weights, k=refs_per_file):
+            tags.append(Tag(rel_fname, rel_fname, -1, name, "ref"))
+        files[rel_fname] = tags
+
+    return files
+
+
+def build_graph(backend, files):
+    graph = TagGraph(backend)
+    for rel_fname, tags in files.items():
+        graph.update_file(rel_fname, 0, tags)
+    return graph
+
+
+def time_backend(backend, files, personalization):
+    start = time.time()
+    graph = build_graph(backend, files)
+    graph.update_graph()
+    build_time = time.time() - start
+
+    start = time.time()
+    ranked, ranked_definitions = graph.rank(personalization)
+    rank_time = time.time() - start
+
+    return build_time, rank_time, graph, ranked_definitions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--files", type=int, nargs="+", default=[100, 1000, 5000])
+    parser.add_argument("--idents-per-file", type=int, default=10)
+    parser.add_argument("--defs-per-file", type=int, default=10)
+    parser.add_argument("--refs-per-file", type=int, default=50)
+    args = parser.parse_args()
+
+    print(f"{'files':>7} {'edges':>10} {'backend':>9} {'build':>8} {'rank':>8}  same order")
+
+    for num_files in args.files:
+        files = make_repo(
+            num_files,
+            num_files * args.idents_per_file // 2,
+            args.defs_per_file,
+            args.refs_per_file,
+        )
+        personalization = dict((rel_fname, 1.0) for rel_fname in list(files)[:3])
+
+        results = dict()
+        for backend in TagGraph.backends:
+            results[backend] = time_backend(backend, files, personalization)
+
+        num_edges = results["networkx"][2].G.number_of_edges()
+        order = [[key for key, _rank in res[3]] for res in results.values()]
+        same = order[0] == order[1]
+
+        for backend, (build_time, rank_time, _, _) in results.items():
+            print(
+                f"{num_files:7d} {num_edges:10d} {backend:>9} {build_time:7.2f}s"
+                f" {rank_time:7.2f}s  {same}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+
+"""Time the per-file cost of extracting repo map tags, on a mixed-language tree.
+
+The "uncached" run loads and compiles the tags query and builds a parser for
+every file, like get_tags_from_code() used to do. The "cached" run uses the
+per-process query registry and per-thread parsers.
+"""
+
+import argparse
+import time
+from unittest.mock import patch
+
+from tree_sitter_languages import get_language, get_parser
+
+from aider import repomap
+from aider.dump import dump  # noqa: F401
+from aider.repomap import get_scm_fname
+
+SAMPLES = {
+    "py": """\
+class Widget{i}:
+    def __init__(self, size):
+        self.size = size
+
+    def grow(self, amount):
+        return Widget{i}(self.size + amount)
+
+
+def make_widget{i}():
+    return Widget{i}(3).grow(4)
+""",
+    "js": """\
+class Widget{i} {{
+  constructor(size) {{
+    this.size = size;
+  }}
+  grow(amount) {{
+    return new Widget{i}(this.size + amount);
+  }}
+}}
+
+function makeWidget{i}() {{
+  return new Widget{i}(3).grow(4);
+}}
+""",
+    "go": """\
+package widgets
+
+type Widget{i} struct {{
+    Size int
+}}
+
+func (w Widget{i}) Grow(amount int) Widget{i} {{
+    return Widget{i}{{Size: w.Size + amount}}
+}}
+
+func MakeWidget{i}() Widget{i} {{
+    return Widget{i}{{Size: 3}}.Grow(4)
+}}
+""",
+    "java": """\
+public class Widget{i} {{
+    private int size;
+
+    public Widget{i}(int size) {{
+        this.size = size;
+    }}
+
+    public Widget{i} grow(int amount) {{
+        return new Widget{i}(size + amount);
+    }}
+}}
+""",
+    "rb": """\
+class Widget{i}
+  def initialize(size)
+    @size = size
+  end
+
+  def grow(amount)
+    Widget{i}.new(@size + amount)
+  end
+end
+""",
+    "c": """\
+struct widget{i} {{
+    int size;
+}};
+
+struct widget{i} grow{i}(struct widget{i} w, int amount) {{
+    w.size += amount;
+    return w;
+}}
+""",
+}
+
+
+def get_tags_query_uncached(lang):
+    query_scm = get_scm_fname(lang)
+    if not query_scm.exists():
+        return
+    return get_language(lang).query(query_scm.read_text())
+
+
+def extract(files):
+    for fname, code in files:
+        list(repomap.get_tags_from_code(fname, fname, code))
+
+
+def make_files(num_files):
+    exts = list(SAMPLES)
+    files = []
+    for i in range(num_files):
+        ext = exts[i % len(exts)]
+        fname = f"src/widget{i}.{ext}"
+        files.append((fname, SAMPLES[ext].format(i=i)))
+    return files
+
+
+def time_extract(files, repeat):
+    best = None
+    for _ in range(repeat):
+        repomap.tags_queries.clear()
+        start = time.perf_counter()
+        extract(files)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--files", type=int, default=120)
+    parser.add_argument("--repeat", type=int, default=1)
+    args = parser.parse_args()
+
+    files = make_files(args.files)
+    print(f"{len(files)} files, in {', '.join(SAMPLES)}")
+
+    print(f"{'':>9} {'total':>8} {'per file':>10}")
+    for name in ["uncached", "cached"]:
+        if name == "uncached":
+            with patch.multiple(
+                repomap,
+                get_tags_query=get_tags_query_uncached,
+                get_thread_parser=get_parser,
+            ):
+                elapsed = time_extract(files, args.repeat)
+        else:
+            elapsed = time_extract(files, args.repeat)
+        per_file = elapsed / len(files) * 1e6
+        print(f"{name:>9} {elapsed:7.3f}s {per_file:8.1f}us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+
+"""Measure token counting throughput, in tokens per second, on the files of a source tree.
+
+"serial" encodes one file after another, "tiktoken" uses tiktoken's own
+encode_batch(), which starts a new thread pool for every call, "batch" uses
+aider.tokens.encode_batch() and "ledger" counts through a warm TokenLedger,
+like format_messages does on every turn after the first.
+"""
+
+import argparse
+import os
+import time
+
+from aider import tokens
+from aider.dump import dump  # noqa: F401
+from aider.tokens import TokenLedger, encode_batch, get_tokenizer
+
+
+class Model:
+    def __init__(self, tokenizer):
+        self.tokenizer = tokenizer
+
+
+def read_texts(root, exts):
+    texts = []
+    for dname, _dirs, fnames in os.walk(root):
+        for fname in fnames:
+            if not fname.endswith(exts):
+                continue
+            with open(os.path.join(dname, fname), encoding="utf-8", errors="replace") as f:
+                texts.append(f.read())
+    return texts
+
+
+def best_time(func, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("root", nargs="?", default="aider")
+    parser.add_argument("--exts", nargs="+", default=[".py", ".md", ".scm"])
+    parser.add_argument("--model", default="gpt-4")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    tokenizer = get_tokenizer(model_name=args.model)
+    texts = read_texts(args.root, tuple(args.exts))
+    num_tokens = sum(len(tokenizer.encode(text)) for text in texts)
+
+    ledger = TokenLedger(Model(tokenizer))
+    ledger.count_texts(texts)
+
+    runs = dict(
+        serial=lambda: [tokenizer.encode(text) for text in texts],
+        tiktoken=lambda: tokenizer.encode_batch(texts),
+        batch=lambda: encode_batch(tokenizer, texts),
+        ledger=lambda: ledger.count_texts(texts),
+    )
+
+    pool = tokens.get_encode_pool()
+    num_threads = pool._max_workers if pool else 1
+    print(f"{len(texts)} files, {num_tokens} tokens, {num_threads} encode threads")
+
+    print(f"{'':>9} {'time':>8} {'tokens/s':>12}")
+    for name, func in runs.items():
+        elapsed = best_time(func, args.repeat)
+        print(f"{name:>9} {elapsed:7.3f}s {num_tokens / elapsed:12,.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,4 @@
+import json
 import tempfile
 import unittest
 from pathlib import Path
@@ -99,6 +100,37 @@ class TestCoder(unittest.TestCase):
             self.assertTrue(coder.allowed_to_edit("added.txt"))
             self.assertTrue(coder.need_commit_before_edits)
 
+    def test_prepare_to_edit_batches_dirty_check(self):
+        with GitTemporaryDirectory():
+            repo = git.Repo()
+
+            fnames = ["one.txt", "two.txt", "three.txt"]
+            for fname in fnames:
+                Path(fname).write_text(f"{fname}\n")
+            repo.git.add(*fnames)
+            repo.git.commit("-m", "init")
+
+            Path("two.txt").write_text("dirty!")
+
+            io = InputOutput(yes=True)
+            coder = Coder.create(models.GPT4, None, io, fnames=fnames)
+
+            edits = [(fname, "content") for fname in fnames + ["one.txt"]]
+
+            need_commit = []
+
+            def mock_dirty_commit():
+                need_commit.extend(coder.need_commit_before_edits)
+
+            with patch.object(coder.repo, "is_dirty") as mock_is_dirty:
+                coder.dirty_commit = mock_dirty_commit
+                res = coder.prepare_to_edit(edits)
+                mock_is_dirty.assert_not_called()
+
+            self.assertEqual(res, edits)
+            self.assertEqual(need_commit, ["two.txt"])
+            self.assertIsNone(coder.dirty_files)
+
     def test_get_last_modified(self):
         # Mock the IO object
         mock_io = MagicMock()
@@ -294,6 +326,105 @@ class TestCoder(unittest.TestCase):
 
         self.assertNotEqual(coder.fence[0], "```")
 
+    def test_summarizer_failure_keeps_history(self):
+        with ChdirTemporaryDirectory():
+            io = InputOutput()
+            coder = Coder.create(models.GPT4, None, io)
+
+            done_messages = [
+                dict(role="user", content="hi"),
+                dict(role="assistant", content="hello"),
+            ]
+            coder.done_messages = list(done_messages)
+
+            with patch.object(coder.summarizer, "too_big", return_value=True), patch.object(
+                coder.summarizer,
+                "summarize_async",
+                side_effect=openai.error.APIError("the api is down"),
+            ), patch.object(io, "tool_error") as mock_tool_error:
+                coder.summarize_start()
+                coder.summarize_end()
+
+            self.assertEqual(coder.done_messages, done_messages)
+            mock_tool_error.assert_called_once()
+            self.assertIn("the api is down", mock_tool_error.call_args.args[0])
+
+    @patch("aider.repo.simple_send_with_retries_async")
+    def test_last_commit_hash_follows_amended_commit(self, mock_send):
+        mock_send.return_value = "the real message"
+
+        with GitTemporaryDirectory():
+            repo = git.Repo()
+            fname = Path("file.txt")
+            fname.write_text("one\n")
+            repo.git.add(str(fname))
+            repo.git.commit("-m", "initial")
+
+            io = InputOutput(yes=True)
+            coder = Coder.create(
+                models.GPT4, None, io, fnames=[str(fname)], async_commit_messages=True
+            )
+
+            fname.write_text("two\n")
+            reply = coder.auto_commit({str(fname)})
+            old_hash = coder.last_aider_commit_hash
+
+            # the reply doesn't mention the provisional hash or message
+            self.assertEqual(reply, coder.gpt_prompts.files_content_gpt_edits_pending)
+            self.assertNotIn(old_hash, reply)
+
+            # the next commit, like a dirty commit, amends the pending one first
+            fname.write_text("three\n")
+            coder.repo.commit(fnames=[str(fname)], message="dirty")
+            coder.finish_commit_message()
+
+            amended_hash = repo.head.commit.parents[0].hexsha[:7]
+            self.assertNotEqual(amended_hash, old_hash)
+            self.assertEqual(coder.last_aider_commit_hash, amended_hash)
+
+    def test_cache_prompt_layout(self):
+        with GitTemporaryDirectory():
+            fname = Path("file.txt")
+            fname.write_text("file contents\n")
+
+            coder = Coder.create(
+                models.GPT4, None, io=InputOutput(), fnames=[str(fname)], prompt_layout="cache"
+            )
+            coder.get_repo_map = MagicMock(return_value="the repo map\n")
+            coder.additional_context["notes"] = "some notes\n"
+
+            sent = []
+
+            def mock_send(messages, **kwargs):
+                sent.append(messages)
+                coder.partial_response_content = "ok"
+                coder.partial_response_function_call = dict()
+
+            coder.send = MagicMock(side_effect=mock_send)
+
+            coder.run(with_message="hi")
+            coder.run(with_message="there")
+
+            # system, repo map, read only context, editable files, history, current turn
+            messages = sent[1]
+            self.assertEqual(messages[0]["role"], "system")
+            self.assertEqual(messages[1]["content"], "the repo map\n")
+            self.assertIn("some notes", messages[3]["content"])
+            self.assertIn("file contents", messages[5]["content"])
+            self.assertNotIn("the repo map", messages[5]["content"])
+            self.assertEqual(messages[7]["role"], "system")
+            self.assertEqual([msg["content"] for msg in messages[8:]], ["hi", "ok", "there"])
+
+            # the second request only adds to the end of the first one
+            (first_stable, first_len), (stable, prompt_len) = coder.prompt_prefix_stats
+            self.assertEqual(first_stable, 0)
+            self.assertEqual(stable, first_len)
+            self.assertEqual(stable, sum(len(json.dumps(msg)) for msg in messages[:9]))
+            self.assertLess(stable, prompt_len)
+
+        with self.assertRaises(ValueError):
+            Coder.create(models.GPT4, None, io=InputOutput(), prompt_layout="nonexistent")
+
     def test_run_with_file_utf_unicode_error(self):
         "make sure that we honor InputOutput(encoding) and don't just assume utf-8"
         # Create a few temporary files
@@ -349,6 +480,30 @@ class TestCoder(unittest.TestCase):
             with self.assertRaises(openai.error.InvalidRequestError):
                 coder.run(with_message="hi")
 
+    @patch("aider.coders.base_coder.send_with_retries")
+    def test_send_records_request_stats(self, mock_send):
+        chunks = [
+            dict(choices=[dict(delta=dict(role="assistant"))]),
+            dict(choices=[dict(delta=dict(content="hello"))]),
+            dict(choices=[dict(delta=dict(content=" there"))]),
+        ]
+        chunks = [openai.util.convert_to_openai_object(chunk) for chunk in chunks]
+        mock_send.return_value = (MagicMock(), iter(chunks))
+
+        with ChdirTemporaryDirectory():
+            coder = Coder.create(models.GPT4, None, InputOutput(), pretty=False)
+            coder.send([dict(role="user", content="hi")])
+
+        self.assertEqual(len(coder.request_stats), 1)
+        stats = coder.request_stats[0]
+        self.assertEqual(stats["model"], models.GPT4.name)
+        self.assertTrue(stats["stream"])
+        self.assertEqual(stats["bytes_received"], len("hello there"))
+        self.assertEqual(stats["completion_tokens"], 2)
+        self.assertLessEqual(stats["time_to_first_token"], stats["latency"])
+        self.assertEqual(stats["retries"], 0)
+        self.assertFalse(stats["interrupted"])
+
     def test_new_file_edit_one_commit(self):
         """A new file shouldn't get pre-committed before the GPT edit commit"""
         with GitTemporaryDirectory():
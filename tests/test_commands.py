@@ -220,8 +220,12 @@ class TestCommands(TestCase):
             commands = Commands(io, coder)
 
             # Run the cmd_git method with the arguments "commit -a -m msg"
-            commands.cmd_git("add test.txt")
-            commands.cmd_git("commit -a -m msg")
+            with patch.object(coder, "finish_commit_message") as mock_finish:
+                commands.cmd_git("add test.txt")
+                commands.cmd_git("commit -a -m msg")
+
+            # a pending commit message is finished before git runs, eg: for a push
+            self.assertEqual(mock_finish.call_count, 2)
 
             # Check if the file has been committed to the repository
             repo = git.Repo(tempdir)
@@ -252,6 +256,38 @@ class TestCommands(TestCase):
         self.assertIn("foo.txt", console_output)
         self.assertIn("bar.txt", console_output)
 
+    def test_cmd_stats(self):
+        io = InputOutput(pretty=False, yes=True)
+        coder = Coder.create(models.GPT35, None, io)
+        commands = Commands(io, coder)
+
+        with patch.object(io, "tool_output") as mock_output:
+            commands.cmd_stats("")
+            output = "\n".join(str(c.args[0]) for c in mock_output.call_args_list if c.args)
+        self.assertIn("No requests sent yet.", output)
+
+        coder.request_stats = [
+            dict(
+                model="gpt-3.5-turbo",
+                stream=True,
+                response_time=0.2,
+                time_to_first_token=0.4,
+                latency=1.5,
+                completion_tokens=30,
+                tokens_per_sec=27.3,
+                bytes_received=120,
+                retries=1,
+                interrupted=False,
+            )
+        ]
+        with patch.object(io, "tool_output") as mock_output:
+            commands.cmd_stats("")
+            output = "\n".join(str(c.args[0]) for c in mock_output.call_args_list if c.args)
+        self.assertIn("27.3", output)
+        self.assertIn("1 requests, 1.5s in total", output)
+        self.assertIn("median time to first token 0.40s", output)
+        self.assertIn("Rate limits:", output)
+
     def test_cmd_add_from_subdir(self):
         repo = git.Repo.init()
         repo.config_writer().set_value("user", "name", "Test User").release()
@@ -327,6 +363,36 @@ class TestCommands(TestCase):
             commands.cmd_commit(commit_message)
             self.assertFalse(repo.is_dirty())
 
+    def test_cmd_undo(self):
+        with GitTemporaryDirectory():
+            fname = "test.txt"
+            with open(fname, "w") as f:
+                f.write("one")
+            repo = git.Repo()
+            repo.git.add(fname)
+            repo.git.commit("-m", "initial")
+            initial = repo.head.commit.hexsha
+
+            with open(fname, "w") as f:
+                f.write("two")
+            repo.git.commit("-am", "aider: changed it")
+
+            io = InputOutput(pretty=False, yes=True)
+            coder = Coder.create(models.GPT35, None, io)
+            commands = Commands(io, coder)
+
+            # pretend it was pushed
+            repo.git.update_ref("refs/remotes/origin/" + repo.active_branch.name, "HEAD")
+            coder.last_aider_commit_hash = repo.head.commit.hexsha[:7]
+            commands.cmd_undo("")
+            self.assertNotEqual(repo.head.commit.hexsha, initial)
+
+            repo.git.update_ref("-d", "refs/remotes/origin/" + repo.active_branch.name)
+            commands.cmd_undo("")
+            self.assertEqual(repo.head.commit.hexsha, initial)
+            with open(fname) as f:
+                self.assertEqual(f.read(), "one")
+
     def test_cmd_add_from_outside_root(self):
         with ChdirTemporaryDirectory() as tmp_dname:
             root = Path("root")
@@ -0,0 +1,106 @@
+import json
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import patch
+
+import openai
+
+from aider import httpclient
+from aider.dump import dump  # noqa: F401
+from aider.sendchat import simple_send_with_retries, simple_send_with_retries_async
+
+COMPLETION = dict(
+    id="chatcmpl-1",
+    object="chat.completion",
+    choices=[dict(index=0, message=dict(role="assistant", content="hi"), finish_reason="stop")],
+    usage=dict(prompt_tokens=1, completion_tokens=1, total_tokens=2),
+)
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.server.connections.add(self.client_address)
+
+        body = json.dumps(COMPLETION).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = do_POST
+
+    def log_message(self, *args):
+        pass
+
+
+class TestHttpClient(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+        self.server.connections = set()
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+
+        self.patchers = [
+            patch.object(httpclient, "session", None),
+            patch.object(openai, "requestssession", None),
+            patch.object(openai, "api_base", self.url),
+            patch.object(openai, "api_key", "key"),
+        ]
+        for patcher in self.patchers:
+            patcher.start()
+
+    def tearDown(self):
+        if httpclient.session is not None:
+            httpclient.session.shutdown()
+        for patcher in reversed(self.patchers):
+            patcher.stop()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_session_is_shared(self):
+        session = httpclient.get_session()
+        self.assertIs(httpclient.get_session(), session)
+
+        # closing it, like openai does every few minutes, keeps the pool
+        session.close()
+        for _ in range(3):
+            self.assertEqual(session.get(self.url).status_code, 200)
+        self.assertEqual(len(self.server.connections), 1)
+
+    def test_configure_pool_size(self):
+        session = httpclient.get_session()
+        with patch.object(httpclient, "pool_size", httpclient.pool_size):
+            httpclient.configure(3)
+            self.assertIsNot(httpclient.get_session(), session)
+            adapter = httpclient.get_session().get_adapter("https://api.openai.com")
+            self.assertEqual(adapter._pool_maxsize, 3)
+            self.assertIs(openai.requestssession, httpclient.get_session)
+
+    def test_openai_calls_reuse_connections_across_threads(self):
+        messages = [dict(role="user", content="hello")]
+        self.assertEqual(simple_send_with_retries("gpt-3.5-turbo", messages), "hi")
+        self.assertIs(openai.requestssession, httpclient.get_session)
+
+        # eg: the summarizer and commit message threads
+        for _ in range(3):
+            thread = threading.Thread(
+                target=simple_send_with_retries, args=("gpt-3.5-turbo", messages)
+            )
+            thread.start()
+            thread.join()
+
+        self.assertEqual(len(self.server.connections), 1)
+
+    def test_background_requests_reuse_connections(self):
+        messages = [dict(role="user", content="hello")]
+        for _ in range(3):
+            future = httpclient.submit(simple_send_with_retries_async("gpt-3.5-turbo", messages))
+            self.assertEqual(future.result(), "hi")
+
+        self.assertEqual(len(self.server.connections), 1)
@@ -0,0 +1,51 @@
+import subprocess
+import sys
+import unittest
+
+from aider.dump import dump  # noqa: F401
+
+# only needed once a feature that uses them runs, so they mustn't slow down startup
+LAZY_MODULES = [
+    "bs4",
+    "grep_ast",
+    "jsonschema",
+    "networkx",
+    "pkg_resources",
+    "rich.live",
+    "rich.markdown",
+    "scipy",
+    "selenium",
+    "tiktoken",
+    "tqdm",
+    "tree_sitter_languages",
+    "webdriver_manager",
+]
+
+
+def import_times(module):
+    """Import module in a fresh interpreter, and return the cumulative import time of each
+    module it loaded, in microseconds, from python -X importtime."""
+    cmd = [sys.executable, "-X", "importtime", "-c", f"import {module}"]
+    res = subprocess.run(cmd, capture_output=True, text=True, check=True)
+
+    times = dict()
+    for line in res.stderr.splitlines():
+        parts = line.split("|")
+        if len(parts) != 3 or not parts[1].strip().isdigit():
+            continue
+        times[parts[2].strip()] = int(parts[1])
+    return times
+
+
+class TestImports(unittest.TestCase):
+    def test_heavy_modules_load_lazily(self):
+        times = import_times("aider.main")
+        self.assertIn("aider.coders.base_coder", times)
+
+        loaded = [
+            name
+            for name in times
+            for lazy in LAZY_MODULES
+            if name == lazy or name.startswith(lazy + ".")
+        ]
+        self.assertEqual(loaded, [], "imported at startup, see benchmark/import_bench.py")
@@ -43,6 +43,28 @@ class TestInputOutput(unittest.TestCase):
             autocompleter = AutoCompleter(root, rel_fnames, addable_rel_fnames, commands, "utf-8")
             self.assertEqual(autocompleter.words, set(rel_fnames))
 
+    def test_autocompleter_words_cache(self):
+        with ChdirTemporaryDirectory():
+            fname = "file.py"
+            Path(fname).write_text("def hello(): pass\n")
+
+            words_cache = dict()
+            args = ("", [fname], [], None, "utf-8", None, words_cache)
+
+            autocompleter = AutoCompleter(*args)
+            self.assertEqual(autocompleter.words, set([fname, "hello"]))
+
+            # unchanged files aren't read again
+            with patch.object(AutoCompleter, "get_file_words") as mock_get_file_words:
+                autocompleter = AutoCompleter(*args)
+                mock_get_file_words.assert_not_called()
+            self.assertEqual(autocompleter.words, set([fname, "hello"]))
+
+            Path(fname).write_text("def goodbye(): pass\n")
+            os.utime(fname, (0, 0))
+            autocompleter = AutoCompleter(*args)
+            self.assertEqual(autocompleter.words, set([fname, "goodbye"]))
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -1,7 +1,9 @@
 import unittest
-from unittest.mock import patch
+from unittest.mock import MagicMock, patch
 
-from aider.models import Model, OpenRouterModel
+from aider.coders.base_coder import check_model_availability
+from aider.models import Model, OpenRouterModel, list_models, model
+from tests.utils import IgnorantTemporaryDirectory
 
 
 class TestModels(unittest.TestCase):
@@ -24,6 +26,106 @@ class TestModels(unittest.TestCase):
         model = Model.create("gpt-4-32k-2123")
         self.assertEqual(model.max_context_tokens, 32 * 1024)
 
+    def test_create_shares_instances(self):
+        gpt4 = Model.create("gpt-4")
+        self.assertIs(Model.create("gpt-4"), gpt4)
+        self.assertIs(Model.strong_model(), gpt4)
+        self.assertIsNot(Model.create("gpt-4-32k"), gpt4)
+
+        with self.assertRaises(ValueError):
+            Model.create("gpt-2")
+
+    @patch.object(model, "models_cache", None)
+    @patch.dict(model.model_details, clear=True)
+    @patch("openai.Model.list")
+    def test_list_models_cached_on_disk(self, mock_model_list):
+        data = [{"id": "gpt-4", "object": "model"}]
+        mock_model_list.return_value = type("", (), {"data": data})()
+
+        with IgnorantTemporaryDirectory() as temp_dir:
+            with patch.object(model, "MODELS_CACHE_PATH", temp_dir):
+                self.assertEqual(list_models(), data)
+                self.assertEqual(list_models(), data)
+                self.assertEqual(mock_model_list.call_count, 1)
+
+                # a new process finds them on disk
+                model.model_details.clear()
+                self.assertEqual(list_models(), data)
+                self.assertEqual(mock_model_list.call_count, 1)
+
+                # unless they have expired
+                with patch.object(model, "MODELS_CACHE_TTL", -1):
+                    model.models_cache.clear()
+                    model.model_details.clear()
+                    list_models()
+                    model.model_details.clear()
+                    list_models()
+                self.assertEqual(mock_model_list.call_count, 3)
+
+                model.models_cache.close()
+
+    @patch.object(model, "models_cache", None)
+    @patch.dict(model.model_details, clear=True)
+    @patch("openai.Model.list")
+    def test_list_models_refreshed_for_missing_model(self, mock_model_list):
+        old_data = [{"id": "gpt-3.5-turbo", "object": "model"}]
+        new_data = old_data + [{"id": "gpt-4", "object": "model"}]
+        mock_model_list.return_value = type("", (), {"data": new_data})()
+
+        with IgnorantTemporaryDirectory() as temp_dir:
+            with patch.object(model, "MODELS_CACHE_PATH", temp_dir):
+                # the list was cached before the api key could use gpt-4
+                mock_model_list.return_value = type("", (), {"data": old_data})()
+                list_models()
+                mock_model_list.return_value = type("", (), {"data": new_data})()
+
+                io = MagicMock()
+                self.assertTrue(check_model_availability(io, Model.create("gpt-4")))
+                io.tool_error.assert_not_called()
+                self.assertEqual(mock_model_list.call_count, 2)
+
+                # the refreshed list replaced the cached one, in memory and on disk
+                self.assertEqual(list_models(), new_data)
+                model.model_details.clear()
+                self.assertEqual(list_models(), new_data)
+                self.assertEqual(mock_model_list.call_count, 2)
+
+                # a model that really is missing is still reported
+                self.assertFalse(check_model_availability(io, Model.create("gpt-4-32k")))
+                io.tool_error.assert_called_once()
+
+                model.models_cache.close()
+
+    @patch.object(model, "MODELS_CACHE_PATH", None)
+    @patch.dict(model.model_details, clear=True)
+    @patch("openai.Model.list")
+    def test_openrouter_model_refreshes_the_model_list(self, mock_model_list):
+        import openai
+
+        old_data = [{"id": "openai/gpt-3.5-turbo", "object": "model"}]
+        new_data = old_data + [
+            {
+                "id": "openai/gpt-4",
+                "object": "model",
+                "context_length": "8192",
+                "pricing": {"prompt": "0.00006", "completion": "0.00012"},
+            }
+        ]
+
+        with patch.object(openai, "api_base", "https://openrouter.ai/api/v1"):
+            mock_model_list.return_value = type("", (), {"data": old_data})()
+            list_models()
+
+            # a model released after the list was cached
+            mock_model_list.return_value = type("", (), {"data": new_data})()
+            self.assertEqual(OpenRouterModel("gpt-4").max_context_tokens, 8192)
+            self.assertEqual(mock_model_list.call_count, 2)
+
+            with self.assertRaises(ValueError):
+                OpenRouterModel("openai/gpt-5")
+
+    @patch.object(model, "MODELS_CACHE_PATH", None)
+    @patch.dict(model.model_details, clear=True)
     @patch("openai.Model.list")
     def test_openrouter_model_properties(self, mock_model_list):
         import openai
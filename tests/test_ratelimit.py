@@ -0,0 +1,130 @@
+import threading
+import time
+import unittest
+from unittest.mock import patch
+
+import openai
+
+from aider import ratelimit
+from aider.ratelimit import RateLimiter, parse_reset
+from aider.sendchat import send_with_retries
+
+
+class TestRateLimiter(unittest.TestCase):
+    def test_parse_reset(self):
+        self.assertEqual(parse_reset("1s"), 1)
+        self.assertEqual(parse_reset("6m0s"), 360)
+        self.assertEqual(parse_reset("120ms"), 0.12)
+        self.assertEqual(parse_reset("2.5"), 2.5)
+        self.assertIsNone(parse_reset(None))
+        self.assertIsNone(parse_reset("soon"))
+
+    def test_requests_are_staggered(self):
+        limiter = RateLimiter(requests_per_minute=2)
+
+        self.assertEqual(limiter.reserve(0), 0)
+        self.assertEqual(limiter.reserve(0), 0)
+
+        # each request past the budget gets its own later slot
+        self.assertAlmostEqual(limiter.reserve(0), 30, delta=0.1)
+        self.assertAlmostEqual(limiter.reserve(0), 60, delta=0.1)
+
+        stats = limiter.get_stats()
+        self.assertEqual(stats["num_waits"], 2)
+        self.assertAlmostEqual(stats["wait_time"], 90, delta=0.2)
+
+    def test_token_usage_is_settled(self):
+        limiter = RateLimiter(tokens_per_minute=1000)
+
+        self.assertEqual(limiter.reserve(600), 0)
+        self.assertGreater(limiter.reserve(600), 0)
+
+        # both used far fewer tokens than estimated
+        limiter.record_usage(600, dict(total_tokens=100))
+        limiter.record_usage(600, dict(total_tokens=100))
+        self.assertEqual(limiter.reserve(600), 0)
+
+    def test_rate_limited_learns_from_headers(self):
+        limiter = RateLimiter()
+
+        limiter.rate_limited(
+            {
+                "x-ratelimit-limit-requests": "3500",
+                "x-ratelimit-remaining-requests": "0",
+                "x-ratelimit-reset-requests": "2s",
+                "x-ratelimit-limit-tokens": "90000",
+                "x-ratelimit-remaining-tokens": "1000",
+                "x-ratelimit-reset-tokens": "6m0s",
+            }
+        )
+
+        self.assertEqual(limiter.requests.capacity, 3500)
+        self.assertEqual(limiter.tokens.capacity, 90000)
+        self.assertLessEqual(limiter.requests.level, 0)
+        self.assertEqual(limiter.get_stats()["num_rate_limited"], 1)
+
+        # only the exhausted budget decides the pause
+        pause = limiter.paused_until - time.monotonic()
+        self.assertAlmostEqual(pause, 2, delta=0.1)
+
+    def test_pause_grows_until_a_success(self):
+        limiter = RateLimiter()
+
+        pauses = []
+        for _ in range(3):
+            limiter.rate_limited({"retry-after": None})
+            pauses.append(limiter.paused_until - time.monotonic())
+            limiter.paused_until = 0
+
+        self.assertAlmostEqual(pauses[0], 1, delta=0.1)
+        self.assertAlmostEqual(pauses[1], 2, delta=0.1)
+        self.assertAlmostEqual(pauses[2], 4, delta=0.1)
+
+        limiter.record_usage(0, None)
+        limiter.rate_limited({"Retry-After": "0.5"})
+        self.assertAlmostEqual(limiter.paused_until - time.monotonic(), 0.5, delta=0.1)
+
+    @patch.object(ratelimit, "MAX_JITTER", 0.1)
+    @patch.object(ratelimit, "BASE_PAUSE", 0.3)
+    @patch("builtins.print")
+    def test_threads_share_the_pause(self, mock_print):
+        lock = threading.Lock()
+        barrier = threading.Barrier(6)
+        tried = set()
+        failed = []
+        succeeded = []
+
+        def create(**kwargs):
+            thread_id = threading.get_ident()
+            if thread_id not in tried:
+                # every thread's first try is in flight when the api starts rate limiting
+                tried.add(thread_id)
+                barrier.wait()
+                with lock:
+                    failed.append(time.monotonic())
+                raise openai.error.RateLimitError("Rate limit exceeded")
+
+            with lock:
+                succeeded.append(time.monotonic())
+
+        def send():
+            send_with_retries("gpt-4", [dict(role="user", content="hello")], None, False)
+
+        with patch.object(ratelimit, "limiter", RateLimiter()):
+            with patch("aider.sendchat.openai.ChatCompletion.create", side_effect=create):
+                threads = [threading.Thread(target=send) for _ in range(6)]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+
+            stats = ratelimit.get_limiter().get_stats()
+
+        self.assertEqual(len(failed), 6)
+        self.assertEqual(len(succeeded), 6)
+        self.assertEqual(stats["num_rate_limited"], 6)
+
+        # they all retried after the one shared pause, which didn't grow with each error
+        for called_at in succeeded:
+            self.assertGreaterEqual(called_at - failed[0], 0.3)
+            self.assertLess(called_at - failed[0], 0.3 + 0.1 + 0.15)
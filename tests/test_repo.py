@@ -5,11 +5,12 @@ from pathlib import Path
 from unittest.mock import patch
 
 import git
+import openai
 
 from aider.dump import dump  # noqa: F401
 from aider.io import InputOutput
 from aider.repo import GitRepo
-from tests.utils import GitTemporaryDirectory
+from tests.utils import GitTemporaryDirectory, IgnorantTemporaryDirectory
 
 
 class TestRepo(unittest.TestCase):
@@ -243,6 +244,281 @@ class TestRepo(unittest.TestCase):
             fnames = git_repo.get_tracked_files()
             self.assertIn(str(fname), fnames)
 
+    def test_get_tracked_files_cached(self):
+        with GitTemporaryDirectory():
+            raw_repo = git.Repo()
+
+            fname = Path("subdir/new.txt")
+            fname.parent.mkdir()
+            fname.touch()
+            raw_repo.git.add(str(fname))
+            raw_repo.git.commit("-m", "new")
+
+            git_repo = GitRepo(InputOutput(), None, None)
+            fnames = git_repo.get_tracked_files()
+            self.assertEqual(set(fnames), set([str(fname)]))
+
+            # nothing changed, so no need to ask git again
+            with patch.object(git_repo, "run_git_z") as mock_run_git_z:
+                self.assertIs(git_repo.get_tracked_files(), fnames)
+                mock_run_git_z.assert_not_called()
+
+            # staged
+            fname2 = Path("new2.txt")
+            fname2.touch()
+            raw_repo.git.add(str(fname2))
+            self.assertEqual(set(git_repo.get_tracked_files()), set([str(fname), str(fname2)]))
+
+            # committed
+            raw_repo.git.commit("-m", "new2")
+            self.assertEqual(set(git_repo.get_tracked_files()), set([str(fname), str(fname2)]))
+
+            # still in HEAD, even once it is removed from the index
+            raw_repo.git.rm("--cached", str(fname2))
+            self.assertEqual(set(git_repo.get_tracked_files()), set([str(fname), str(fname2)]))
+
+            raw_repo.git.commit("-m", "removed")
+            self.assertEqual(set(git_repo.get_tracked_files()), set([str(fname)]))
+
+    def test_get_dirty_files(self):
+        with GitTemporaryDirectory():
+            raw_repo = git.Repo()
+
+            fnames = ["clean.txt", "modified.txt", "staged.txt", "renamed.txt", "sub/dir.txt"]
+            for fname in fnames:
+                Path(fname).parent.mkdir(exist_ok=True)
+                Path(fname).write_text(f"{fname}\n")
+            raw_repo.git.add(*fnames)
+            raw_repo.git.commit("-m", "initial")
+
+            Path("modified.txt").write_text("changed\n")
+            Path("sub/dir.txt").write_text("changed\n")
+            Path("staged.txt").write_text("changed\n")
+            raw_repo.git.add("staged.txt")
+            raw_repo.git.mv("renamed.txt", "moved.txt")
+            Path("untracked.txt").write_text("untracked\n")
+
+            git_repo = GitRepo(InputOutput(), None, None)
+            paths = fnames + ["moved.txt", "untracked.txt", "missing.txt"]
+            paths = [str(Path(path)) for path in paths]
+
+            index_key = git_repo.get_index_key()
+            dirty = git_repo.get_dirty_files(paths)
+
+            # the same answers as asking one at a time
+            expected = set(path for path in paths if git_repo.is_dirty(path))
+            self.assertEqual(dirty, expected)
+            self.assertNotIn("clean.txt", dirty)
+            self.assertIn("untracked.txt", dirty)
+            self.assertIn(str(Path("sub/dir.txt")), dirty)
+
+            # status didn't rewrite the index behind our back
+            self.assertEqual(git_repo.get_index_key(), index_key)
+
+    def test_commit_many_files(self):
+        with GitTemporaryDirectory():
+            raw_repo = git.Repo()
+
+            fnames = [f"file{i}.txt" for i in range(10)]
+            for fname in fnames:
+                Path(fname).write_text("one\n")
+            raw_repo.git.add(*fnames)
+            raw_repo.git.commit("-m", "initial")
+
+            for fname in fnames:
+                Path(fname).write_text("two\n")
+
+            git_repo = GitRepo(InputOutput(), None, None)
+            git_repo.get_tracked_files()
+            git_repo.reset_git_stats()
+
+            git_repo.commit(fnames=fnames, message="edit them all")
+
+            # one diff, one add and one commit, not one add per file
+            num_commands, elapsed = git_repo.get_git_stats()
+            self.assertEqual(num_commands, 3)
+            self.assertGreater(elapsed, 0)
+
+            self.assertFalse(raw_repo.is_dirty())
+            self.assertEqual(raw_repo.head.commit.message.strip(), "edit them all")
+            self.assertEqual(len(raw_repo.head.commit.stats.files), 10)
+
+    @patch("aider.repo.simple_send_with_retries_async")
+    def test_async_commit_messages(self, mock_send):
+        mock_send.return_value = "the real message"
+
+        with GitTemporaryDirectory():
+            raw_repo = git.Repo()
+
+            fname = Path("foo.txt")
+            fname.write_text("one\n")
+            raw_repo.git.add(str(fname))
+            raw_repo.git.commit("-m", "initial")
+
+            git_repo = GitRepo(InputOutput(), None, None, async_commit_messages=True)
+
+            fname.write_text("two\n")
+            commit_hash, commit_message = git_repo.commit(
+                fnames=[str(fname)], context="the chat", prefix="aider: "
+            )
+
+            # committed right away, with a placeholder message
+            self.assertEqual(commit_message, "aider: (commit message pending)")
+            self.assertEqual(raw_repo.head.commit.hexsha[:7], commit_hash)
+
+            # changes staged after the commit stay out of the amended one
+            other = Path("other.txt")
+            other.write_text("staged\n")
+            raw_repo.git.add(str(other))
+
+            new_hash, new_message = git_repo.finish_commit_message()
+            self.assertEqual(new_message, "aider: the real message")
+            self.assertNotEqual(new_hash, commit_hash)
+            self.assertEqual(git_repo.amended_commits, {commit_hash: new_hash})
+
+            head = raw_repo.head.commit
+            self.assertEqual(head.hexsha[:7], new_hash)
+            self.assertTrue(head.message.startswith("aider: the real message\n"))
+            self.assertIn("the chat", head.message)
+            self.assertEqual(list(head.stats.files), ["foo.txt"])
+            self.assertEqual(head.parents[0].message.strip(), "initial")
+            self.assertIn("other.txt", raw_repo.git.diff("--cached", "--name-only"))
+
+            # nothing left to finish
+            self.assertIsNone(git_repo.finish_commit_message())
+
+    @patch("aider.repo.simple_send_with_retries_async")
+    def test_async_commit_message_head_moved(self, mock_send):
+        mock_send.return_value = "the real message"
+
+        with GitTemporaryDirectory():
+            raw_repo = git.Repo()
+
+            fname = Path("foo.txt")
+            fname.write_text("one\n")
+            raw_repo.git.add(str(fname))
+            raw_repo.git.commit("-m", "initial")
+
+            git_repo = GitRepo(InputOutput(), None, None, async_commit_messages=True)
+
+            fname.write_text("two\n")
+            git_repo.commit(fnames=[str(fname)])
+            git_repo.pending_commit["future"].result()
+
+            # the user committed on top of it in the meantime
+            fname.write_text("three\n")
+            raw_repo.git.commit("-am", "by hand")
+
+            self.assertIsNone(git_repo.finish_commit_message())
+            self.assertEqual(raw_repo.head.commit.message.strip(), "by hand")
+            self.assertEqual(
+                raw_repo.head.commit.parents[0].message.strip(), "(commit message pending)"
+            )
+
+    @patch("aider.repo.simple_send_with_retries_async")
+    def test_async_commit_message_already_pushed(self, mock_send):
+        mock_send.return_value = "the real message"
+
+        with GitTemporaryDirectory(), IgnorantTemporaryDirectory() as remote_dir:
+            raw_repo = git.Repo()
+
+            fname = Path("foo.txt")
+            fname.write_text("one\n")
+            raw_repo.git.add(str(fname))
+            raw_repo.git.commit("-m", "initial")
+
+            git.Repo.init(remote_dir, bare=True)
+            raw_repo.create_remote("origin", remote_dir)
+
+            git_repo = GitRepo(InputOutput(), None, None, async_commit_messages=True)
+
+            fname.write_text("two\n")
+            commit_hash, _ = git_repo.commit(fnames=[str(fname)])
+            git_repo.pending_commit["future"].result()
+
+            # pushed before the message was ready
+            raw_repo.git.push("origin", "HEAD")
+
+            self.assertIsNone(git_repo.finish_commit_message())
+            self.assertEqual(raw_repo.head.commit.hexsha[:7], commit_hash)
+            self.assertEqual(raw_repo.head.commit.message.strip(), "(commit message pending)")
+
+    @patch("aider.repo.simple_send_with_retries_async")
+    def test_async_commit_message_failure(self, mock_send):
+        mock_send.side_effect = openai.error.APIError("the api is down")
+
+        with GitTemporaryDirectory():
+            raw_repo = git.Repo()
+
+            fname = Path("foo.txt")
+            fname.write_text("one\n")
+            raw_repo.git.add(str(fname))
+            raw_repo.git.commit("-m", "initial")
+
+            io = InputOutput()
+            git_repo = GitRepo(io, None, None, async_commit_messages=True)
+
+            fname.write_text("two\n")
+            git_repo.commit(fnames=[str(fname)])
+
+            with patch.object(io, "tool_error") as mock_tool_error:
+                self.assertIsNone(git_repo.finish_commit_message())
+            self.assertIn("the api is down", mock_tool_error.call_args.args[0])
+            self.assertIsNone(git_repo.pending_commit)
+            self.assertEqual(raw_repo.head.commit.message.strip(), "(commit message pending)")
+
+            # later commits aren't held up by it
+            mock_send.side_effect = None
+            mock_send.return_value = "the next message"
+            fname.write_text("three\n")
+            git_repo.commit(fnames=[str(fname)])
+            self.assertEqual(git_repo.finish_commit_message()[1], "the next message")
+
+    def test_rev_parse(self):
+        with GitTemporaryDirectory():
+            raw_repo = git.Repo()
+
+            fname = Path("sub/foo.txt")
+            fname.parent.mkdir()
+            fname.write_text("one\n")
+            raw_repo.git.add(str(fname))
+            raw_repo.git.commit("-m", "one")
+
+            git_repo = GitRepo(InputOutput(), None, None)
+            self.assertEqual(git_repo.rev_parse("HEAD"), raw_repo.head.commit.hexsha)
+            self.assertIsNone(git_repo.rev_parse("origin/nonexistent"))
+            self.assertIsNone(git_repo.rev_parse("HEAD\nHEAD"))
+
+            fname.write_text("two\n")
+            raw_repo.git.commit("-am", "two")
+
+            git_repo.reset_git_stats()
+
+            # the long lived process sees the new commit
+            self.assertEqual(git_repo.rev_parse("HEAD"), raw_repo.head.commit.hexsha)
+            self.assertEqual(git_repo.rev_parse("HEAD~1"), raw_repo.head.commit.parents[0].hexsha)
+
+            # without starting any new git processes
+            num_commands, _elapsed = git_repo.get_git_stats()
+            self.assertEqual(num_commands, 0)
+
+    def test_get_blob_sha(self):
+        with GitTemporaryDirectory():
+            repo = git.Repo()
+            fname = Path("foo.txt")
+            fname.write_text("one\n")
+            repo.git.add(str(fname))
+            repo.git.commit("-m", "initial")
+
+            git_repo = GitRepo(InputOutput(), None, ".")
+            self.assertEqual(git_repo.get_blob_sha(fname), repo.git.hash_object(str(fname)))
+
+            # modified in the working tree, but not in the index
+            fname.write_text("two, which is longer\n")
+            self.assertEqual(git_repo.get_blob_sha(fname), repo.git.hash_object(str(fname)))
+
+            self.assertIsNone(git_repo.get_blob_sha("missing.txt"))
+
     @patch("aider.repo.simple_send_with_retries")
     def test_noop_commit(self, mock_send):
         mock_send.return_value = '"a good commit message"'
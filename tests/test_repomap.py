@@ -1,9 +1,20 @@
 import os
+import threading
 import unittest
+from unittest.mock import patch
+
+from grep_ast import TreeContext
 
 from aider.dump import dump  # noqa: F401
 from aider.io import InputOutput
-from aider.repomap import RepoMap
+from aider.repomap import (
+    RepoMap,
+    Tag,
+    TagGraph,
+    get_tags_from_code,
+    get_tags_query,
+    get_thread_parser,
+)
 from tests.utils import IgnorantTemporaryDirectory
 
 
@@ -149,6 +160,380 @@ print(my_function(3, 4))
             # close the open cache files, so Windows won't error
             del repo_map
 
+    def test_get_repo_map_parallel_matches_serial(self):
+        test_files = dict()
+        for i in range(8):
+            test_files[f"module{i}.py"] = f"""\
+from module{(i + 1) % 8} import func{(i + 1) % 8}
+
+def func{i}(arg):
+    return func{(i + 1) % 8}(arg) + {i}
+
+class Class{i}:
+    def method{i}(self):
+        return func{i}(self)
+"""
+
+        results = []
+        for max_processes in (1, 2):
+            with IgnorantTemporaryDirectory() as temp_dir:
+                for fname, content in test_files.items():
+                    with open(os.path.join(temp_dir, fname), "w") as f:
+                        f.write(content)
+
+                repo_map = RepoMap(root=temp_dir, io=InputOutput(), max_processes=max_processes)
+                repo_map.min_parallel_files = 1
+
+                other_files = [os.path.join(temp_dir, fname) for fname in test_files]
+                results.append(repo_map.get_repo_map([], other_files))
+
+                # close the open cache files, so Windows won't error
+                del repo_map
+
+        self.assertIn("func3", results[0])
+        self.assertEqual(results[0], results[1])
+
+    def test_get_repo_map_shared_blob_cache(self):
+        test_files = dict(
+            [
+                ("defs.py", "def my_function(arg1, arg2):\n    return arg1 * arg2\n"),
+                ("uses.py", "from defs import my_function\n\nprint(my_function(3, 4))\n"),
+            ]
+        )
+
+        with IgnorantTemporaryDirectory() as cache_dir:
+            results = []
+            for clone in range(2):
+                with IgnorantTemporaryDirectory() as temp_dir:
+                    for fname, content in test_files.items():
+                        with open(os.path.join(temp_dir, fname), "w") as f:
+                            f.write(content)
+
+                    repo_map = RepoMap(root=temp_dir, io=InputOutput(), cache_dir=cache_dir)
+                    other_files = [os.path.join(temp_dir, fname) for fname in test_files]
+
+                    if clone:
+                        # the second clone must be served entirely from the shared cache
+                        with patch.object(repo_map, "get_tags_raw") as mock_get_tags_raw:
+                            results.append(repo_map.get_repo_map([], other_files))
+                            mock_get_tags_raw.assert_not_called()
+                    else:
+                        results.append(repo_map.get_repo_map([], other_files))
+
+                    # close the open cache files, so Windows won't error
+                    del repo_map
+
+            # another aider version sharing the cache dir doesn't read the same entries
+            with IgnorantTemporaryDirectory() as temp_dir:
+                for fname, content in test_files.items():
+                    with open(os.path.join(temp_dir, fname), "w") as f:
+                        f.write(content)
+
+                with patch.object(RepoMap, "CACHE_VERSION", RepoMap.CACHE_VERSION + 1):
+                    repo_map = RepoMap(root=temp_dir, io=InputOutput(), cache_dir=cache_dir)
+                    other_files = [os.path.join(temp_dir, fname) for fname in test_files]
+                    with patch.object(
+                        repo_map, "get_tags_raw", wraps=repo_map.get_tags_raw
+                    ) as mock_get_tags_raw:
+                        results.append(repo_map.get_repo_map([], other_files))
+                        self.assertEqual(mock_get_tags_raw.call_count, len(test_files))
+
+                del repo_map
+
+        self.assertIn("my_function", results[0])
+        self.assertEqual(results[0], results[1])
+        self.assertEqual(results[0], results[2])
+
+    def test_get_repo_map_incremental_updates(self):
+        file_content1 = """\
+class MyClass:
+    def my_method(self, arg1, arg2):
+        return arg1 + arg2
+"""
+        file_content2 = """\
+from test_file1 import MyClass
+
+print(MyClass().my_method(1, 2))
+"""
+        file_content3 = """\
+def my_function(arg1, arg2):
+    return arg1 * arg2
+"""
+
+        with IgnorantTemporaryDirectory() as temp_dir:
+            fname1 = os.path.join(temp_dir, "test_file1.py")
+            fname2 = os.path.join(temp_dir, "test_file2.py")
+            fname3 = os.path.join(temp_dir, "test_file3.py")
+            for fname, content in [(fname1, file_content1), (fname2, file_content2)]:
+                with open(fname, "w") as f:
+                    f.write(content)
+
+            repo_map = RepoMap(root=temp_dir, io=InputOutput())
+            other_files = [fname1, fname2]
+            result = repo_map.get_repo_map([], other_files)
+            self.assertIn("my_method", result)
+
+            # nothing changed, so nothing gets re-parsed
+            with patch.object(repo_map, "get_tags") as mock_get_tags:
+                self.assertEqual(repo_map.get_repo_map([], other_files), result)
+                mock_get_tags.assert_not_called()
+
+            # change one file and add another
+            with open(fname2, "w") as f:
+                f.write(file_content2 + "print(my_function(3, 4))\n")
+            os.utime(fname2, (0, os.path.getmtime(fname1) + 10))
+            with open(fname3, "w") as f:
+                f.write(file_content3)
+            other_files = [fname1, fname2, fname3]
+
+            result = repo_map.get_repo_map([], other_files)
+            self.assertIn("my_function", result)
+            self.assertEqual(
+                set(repo_map.tag_graph.files),
+                set(["test_file1.py", "test_file2.py", "test_file3.py"]),
+            )
+
+            # the incremental graph matches one built from scratch
+            fresh_repo_map = RepoMap(root=temp_dir, io=InputOutput())
+            self.assertEqual(fresh_repo_map.get_repo_map([], other_files), result)
+
+            # dropped files are removed from the graph
+            repo_map.get_repo_map([], [fname1, fname2])
+            self.assertNotIn("test_file3.py", repo_map.tag_graph.files)
+            my_function_id = repo_map.tag_graph.ident_ids.get("my_function")
+            self.assertIsNotNone(my_function_id)
+            self.assertNotIn(my_function_id, repo_map.tag_graph.defines)
+
+            # close the open cache files, so Windows won't error
+            del repo_map
+            del fresh_repo_map
+
+    def test_get_ranked_tags_map_reuses_sections(self):
+        test_files = dict()
+        for i in range(6):
+            test_files[f"module{i}.py"] = f"""\
+from module{(i + 1) % 6} import func{(i + 1) % 6}
+
+def func{i}(arg):
+    return func{(i + 1) % 6}(arg) + {i}
+"""
+
+        with IgnorantTemporaryDirectory() as temp_dir:
+            for fname, content in test_files.items():
+                with open(os.path.join(temp_dir, fname), "w") as f:
+                    f.write(content)
+
+            repo_map = RepoMap(root=temp_dir, io=InputOutput())
+            other_files = [os.path.join(temp_dir, fname) for fname in test_files]
+
+            result = repo_map.get_ranked_tags_map([], other_files)
+
+            # the map is just the cached sections, stitched together
+            ranked_tags = repo_map.get_ranked_tags([], other_files)
+            tree_sections = repo_map.get_tree_sections(ranked_tags, dict())
+            self.assertEqual(result, "".join(text for text, _tokens in tree_sections))
+
+            # nothing changed, so no sections get rendered again
+            with patch.object(repo_map, "render_section") as mock_render_section:
+                self.assertEqual(repo_map.get_ranked_tags_map([], other_files), result)
+                mock_render_section.assert_not_called()
+
+            # close the open cache files, so Windows won't error
+            del repo_map
+
+    def test_tree_context_cache(self):
+        with IgnorantTemporaryDirectory() as temp_dir:
+            fnames = []
+            for i in range(3):
+                fname = os.path.join(temp_dir, f"module{i}.py")
+                with open(fname, "w") as f:
+                    f.write(f"def func{i}():\n    return {i}\n\n\ndef other{i}():\n    pass\n")
+                fnames.append(fname)
+
+            repo_map = RepoMap(root=temp_dir, io=InputOutput())
+            fname = fnames[0]
+
+            with patch("grep_ast.TreeContext", wraps=TreeContext) as mock_tree_context:
+                first = repo_map.render_section("module0.py", fname, [0])
+                second = repo_map.render_section("module0.py", fname, [4])
+                self.assertEqual(mock_tree_context.call_count, 1)
+
+                # a reused context doesn't leak the previous lines of interest
+                self.assertIn("func0", first)
+                self.assertNotIn("other0", first)
+                self.assertIn("other0", second)
+                self.assertNotIn("func0", second)
+
+                # editing the file means parsing it again
+                with open(fname, "w") as f:
+                    f.write("def renamed():\n    pass\n")
+                self.assertIn("renamed", repo_map.render_section("module0.py", fname, [0]))
+                self.assertEqual(mock_tree_context.call_count, 2)
+                self.assertEqual(len(repo_map.tree_cache), 1)
+
+                # even within the same mtime tick, if the size changed
+                mtime_ns = os.stat(fname).st_mtime_ns
+                with open(fname, "w") as f:
+                    f.write("def renamed_again():\n    pass\n")
+                os.utime(fname, ns=(mtime_ns, mtime_ns))
+                self.assertIn("renamed_again", repo_map.render_section("module0.py", fname, [0]))
+                self.assertEqual(mock_tree_context.call_count, 3)
+
+            # only keep as many files as fit in the cap
+            repo_map.tree_cache_bytes = os.path.getsize(fnames[1]) * 2
+            for fname in fnames[1:]:
+                repo_map.render_section(os.path.basename(fname), fname, [0])
+            self.assertEqual(list(repo_map.tree_cache), fnames[1:])
+            self.assertLessEqual(repo_map.tree_cache_size, repo_map.tree_cache_bytes)
+
+            # close the open cache files, so Windows won't error
+            del repo_map
+
+    def test_tags_query_cache(self):
+        query = get_tags_query("python")
+        self.assertIsNotNone(query)
+        self.assertIs(get_tags_query("python"), query)
+        self.assertIsNone(get_tags_query("no-such-language"))
+
+        with patch("aider.repomap.get_scm_fname") as mock_get_scm_fname:
+            code = "def func():\n    pass\n\nfunc()\n"
+            tags = list(get_tags_from_code("test.py", "test.py", code))
+            self.assertIn("func", [tag.name for tag in tags])
+            mock_get_scm_fname.assert_not_called()
+
+        # parsers are reused within a thread, but not shared across threads
+        parser = get_thread_parser("python")
+        self.assertIs(get_thread_parser("python"), parser)
+
+        other = []
+        thread = threading.Thread(target=lambda: other.append(get_thread_parser("python")))
+        thread.start()
+        thread.join()
+        self.assertIsNot(other[0], parser)
+
+    def test_tag_graph_compact_tags(self):
+        graph = TagGraph()
+
+        tags = [
+            Tag("a.py", "/abs/a.py", 3, "func", "def"),
+            Tag("a.py", "/abs/a.py", 9, "func", "def"),
+            Tag("a.py", "/abs/a.py", 9, "func", "def"),
+            Tag("a.py", "/abs/a.py", 1, "Klass", "def"),
+        ]
+        tags += [Tag("a.py", "/abs/a.py", -1, "Klass", "ref")] * 1000
+
+        # the tags are folded in as they stream past, not kept around
+        graph.update_file("a.py", 1, iter(tags))
+        graph.update_file("b.py", 1, iter([Tag("b.py", "/abs/b.py", -1, "func", "ref")] * 5))
+
+        file_tags = graph.files["a.py"]
+        self.assertEqual(len(file_tags.def_lines), 3)
+        self.assertEqual(file_tags.ref_counts, {graph.ident_ids["Klass"]: 1000})
+
+        self.assertEqual(
+            graph.get_definitions("a.py", "func"),
+            [
+                Tag("a.py", "/abs/a.py", 3, "func", "def"),
+                Tag("a.py", "/abs/a.py", 9, "func", "def"),
+            ],
+        )
+        self.assertEqual(
+            graph.get_definitions("a.py", "Klass"), [Tag("a.py", "/abs/a.py", 1, "Klass", "def")]
+        )
+        self.assertEqual(graph.get_definitions("a.py", "missing"), [])
+        self.assertEqual(graph.get_definitions("b.py", "func"), [])
+
+        func = graph.ident_ids["func"]
+        self.assertEqual(graph.references[func], {graph.file_ids["b.py"]: 5})
+
+        graph.remove_file("b.py")
+        self.assertNotIn(func, graph.references)
+        self.assertEqual(graph.defines[func], {graph.file_ids["a.py"]})
+
+    def test_precompute_repo_map(self):
+        with IgnorantTemporaryDirectory() as temp_dir:
+            fnames = []
+            for i in range(3):
+                fname = os.path.join(temp_dir, f"module{i}.py")
+                with open(fname, "w") as f:
+                    f.write(f"def func{i}():\n    return {i}\n")
+                fnames.append(fname)
+
+            io = InputOutput()
+            repo_map = RepoMap(root=temp_dir, io=io)
+
+            # a file which vanished, so there's an error to report
+            missing = os.path.join(temp_dir, "missing.py")
+            other_files = fnames[1:] + [missing]
+
+            with patch.object(io, "tool_error") as mock_tool_error:
+                repo_map.precompute(fnames[:1], other_files)
+                repo_map.precompute_thread.join()
+
+                # nothing is printed over the input prompt
+                mock_tool_error.assert_not_called()
+
+                with patch.object(repo_map, "compute_repo_map") as mock_compute:
+                    result = repo_map.get_repo_map(fnames[:1], other_files)
+                    mock_compute.assert_not_called()
+
+                self.assertIn("func1", result)
+                self.assertIn("missing.py", mock_tool_error.call_args[0][0])
+
+            # a different set of chat files needs a new map
+            with patch.object(repo_map, "compute_repo_map") as mock_compute:
+                repo_map.get_repo_map(fnames[1:2], other_files)
+                mock_compute.assert_called_once()
+
+            # as does editing a file
+            with open(fnames[1], "w") as f:
+                f.write("def renamed():\n    pass\n")
+            result = repo_map.get_repo_map(fnames[:1], other_files)
+            self.assertIn("renamed", result)
+            self.assertNotIn("func1", result)
+
+            # close the open cache files, so Windows won't error
+            del repo_map
+
+    def test_rank_backends_agree(self):
+        files = dict()
+        for i in range(20):
+            rel_fname = f"file{i}.py"
+            tags = [Tag(rel_fname, rel_fname, 1, f"ident{i}", "def")]
+            for j in range(1, 1 + i % 4):
+                name = f"ident{(i + j * 3) % 20}"
+                tags += [Tag(rel_fname, rel_fname, -1, name, "ref")] * j
+            files[rel_fname] = tags
+
+        results = []
+        for backend in TagGraph.backends:
+            graph = TagGraph(backend)
+            for rel_fname, tags in files.items():
+                graph.update_file(rel_fname, 0, tags)
+
+            ranked, ranked_definitions = graph.rank(dict([("file3.py", 1.0)]))
+
+            # rank again after a change, to exercise the incremental update
+            graph.remove_file("file7.py")
+            ranked, ranked_definitions = graph.rank(dict([("file3.py", 1.0)]))
+            results.append((ranked, ranked_definitions))
+
+        (nx_ranked, nx_definitions), (sparse_ranked, sparse_definitions) = results
+
+        self.assertEqual(set(nx_ranked), set(sparse_ranked))
+        for node, rank in nx_ranked.items():
+            self.assertAlmostEqual(rank, sparse_ranked[node])
+
+        self.assertEqual(
+            [key for key, _rank in nx_definitions],
+            [key for key, _rank in sparse_definitions],
+        )
+        self.assertNotIn("ident7", [ident for (_fname, ident), _rank in nx_definitions])
+
+    def test_unknown_rank_backend(self):
+        with self.assertRaises(ValueError):
+            TagGraph("bogus")
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -1,10 +1,19 @@
+import asyncio
 import unittest
 from unittest.mock import patch
 
 import openai
 import requests
 
-from aider.sendchat import send_with_retries
+from aider import sendchat
+from aider.sendchat import (
+    ResponseCache,
+    send_with_retries,
+    simple_send_with_retries,
+    simple_send_with_retries_async,
+    stream_with_retries_async,
+)
+from tests.utils import IgnorantTemporaryDirectory
 
 
 class TestSendChat(unittest.TestCase):
@@ -39,3 +48,109 @@ class TestSendChat(unittest.TestCase):
 
         # Assert that print was called once
         mock_print.assert_called_once()
+
+    @patch("aider.sendchat.openai.ChatCompletion.create")
+    def test_response_cache(self, mock_chat_completion_create):
+        mock_chat_completion_create.return_value = dict(
+            choices=[dict(message=dict(role="assistant", content="the reply"))]
+        )
+        messages = [dict(role="user", content="hello")]
+
+        with IgnorantTemporaryDirectory() as temp_dir:
+            cache = ResponseCache(temp_dir)
+            with patch.object(sendchat, "CACHE", cache):
+                for _ in range(3):
+                    _hash, res = send_with_retries("gpt-4", messages, None, False, cache=True)
+                    self.assertEqual(res, mock_chat_completion_create.return_value)
+                self.assertEqual(mock_chat_completion_create.call_count, 1)
+
+                # each model has its own entries
+                send_with_retries("gpt-3.5-turbo", messages, None, False, cache=True)
+                self.assertEqual(mock_chat_completion_create.call_count, 2)
+                self.assertEqual(cache.get_stats(), {"gpt-4": (2, 1), "gpt-3.5-turbo": (0, 1)})
+
+                # streaming replies aren't cached
+                send_with_retries("gpt-4", messages, None, True, cache=True)
+                send_with_retries("gpt-4", messages, None, True, cache=True)
+                self.assertEqual(mock_chat_completion_create.call_count, 4)
+
+                # nor are the requests that don't ask for it, like the main chat
+                send_with_retries("gpt-4", messages, None, False)
+                send_with_retries("gpt-4", messages, None, False)
+                self.assertEqual(mock_chat_completion_create.call_count, 6)
+                self.assertEqual(cache.get_stats()["gpt-4"], (2, 1))
+
+                cache.clear("gpt-4")
+                send_with_retries("gpt-4", messages, None, False, cache=True)
+                send_with_retries("gpt-3.5-turbo", messages, None, False, cache=True)
+                self.assertEqual(mock_chat_completion_create.call_count, 7)
+
+            cache.cache.close()
+
+    @patch("aider.sendchat.openai.ChatCompletion.create")
+    def test_response_cache_max_age(self, mock_chat_completion_create):
+        mock_chat_completion_create.return_value = openai.util.convert_to_openai_object(
+            dict(choices=[dict(message=dict(role="assistant", content="the reply"))])
+        )
+        messages = [dict(role="user", content="hello")]
+
+        with IgnorantTemporaryDirectory() as temp_dir:
+            cache = ResponseCache(temp_dir, max_age=-1)
+            with patch.object(sendchat, "CACHE", cache):
+                self.assertEqual(simple_send_with_retries("gpt-4", messages), "the reply")
+                self.assertEqual(simple_send_with_retries("gpt-4", messages), "the reply")
+                self.assertEqual(mock_chat_completion_create.call_count, 2)
+
+            cache.cache.close()
+
+    def test_async_requests_are_limited(self):
+        in_flight = 0
+        most_in_flight = 0
+
+        async def acreate(**kwargs):
+            nonlocal in_flight, most_in_flight
+            in_flight += 1
+            most_in_flight = max(most_in_flight, in_flight)
+            await asyncio.sleep(0.01)
+            in_flight -= 1
+
+            content = kwargs["messages"][0]["content"]
+            return openai.util.convert_to_openai_object(
+                dict(choices=[dict(message=dict(role="assistant", content=content))])
+            )
+
+        async def send_all():
+            return await asyncio.gather(
+                *(
+                    simple_send_with_retries_async("gpt-4", [dict(role="user", content=str(i))])
+                    for i in range(10)
+                )
+            )
+
+        with patch("aider.sendchat.openai.ChatCompletion.acreate", acreate):
+            replies = asyncio.run(send_all())
+
+        self.assertEqual(replies, [str(i) for i in range(10)])
+        self.assertEqual(most_in_flight, sendchat.MAX_CONCURRENT_REQUESTS)
+
+    @patch("aider.sendchat.openai.ChatCompletion.acreate")
+    @patch("builtins.print")
+    def test_stream_with_retries_async(self, mock_print, mock_acreate):
+        async def chunks():
+            for word in ["hello", " there"]:
+                yield dict(choices=[dict(delta=dict(content=word))])
+
+        mock_acreate.side_effect = [
+            openai.error.RateLimitError("Rate limit exceeded"),
+            chunks(),
+        ]
+
+        async def receive():
+            content = ""
+            async for chunk in stream_with_retries_async("gpt-4", ["message"], None):
+                content += chunk["choices"][0]["delta"]["content"]
+            return content
+
+        self.assertEqual(asyncio.run(receive()), "hello there")
+        mock_print.assert_called_once()
+        self.assertTrue(mock_acreate.call_args.kwargs["stream"])
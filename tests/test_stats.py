@@ -0,0 +1,79 @@
+import time
+import unittest
+from unittest.mock import patch
+
+from aider.stats import RequestStats, summarize
+
+
+class TestRequestStats(unittest.TestCase):
+    @patch("aider.stats.time.perf_counter")
+    def test_streamed_request(self, mock_clock):
+        mock_clock.side_effect = [10.0, 10.5, 11.0, 13.0]
+
+        stats = RequestStats("gpt-4", stream=True)
+        stats.response(retries=1)
+        stats.received("")
+        stats.received("héllo")
+        stats.received(" there")
+        stats.finish(completion_tokens=40)
+
+        self.assertEqual(
+            stats.to_dict(),
+            dict(
+                model="gpt-4",
+                stream=True,
+                response_time=0.5,
+                time_to_first_token=1.0,
+                latency=3.0,
+                completion_tokens=40,
+                tokens_per_sec=20.0,
+                bytes_received=12,
+                retries=1,
+                interrupted=False,
+            ),
+        )
+
+    def test_whole_request(self):
+        stats = RequestStats("gpt-4", stream=False)
+        stats.response()
+        time.sleep(0.01)
+        stats.finish(completion_tokens=10)
+
+        res = stats.to_dict()
+        self.assertEqual(res["time_to_first_token"], res["latency"])
+        self.assertGreater(res["tokens_per_sec"], 0)
+
+    def test_interrupted_request(self):
+        stats = RequestStats("gpt-4", stream=True)
+        stats.finish(interrupted=True)
+
+        res = stats.to_dict()
+        self.assertTrue(res["interrupted"])
+        self.assertIsNone(res["response_time"])
+        self.assertIsNone(res["time_to_first_token"])
+        self.assertIsNone(res["tokens_per_sec"])
+
+    def test_summarize(self):
+        self.assertIsNone(summarize([]))
+
+        request_stats = [
+            dict(latency=1.0, time_to_first_token=0.5, tokens_per_sec=10.0, retries=0),
+            dict(latency=3.0, time_to_first_token=None, tokens_per_sec=None, retries=2),
+            dict(latency=2.0, time_to_first_token=0.7, tokens_per_sec=30.0, retries=0),
+        ]
+        for stats in request_stats:
+            stats.update(completion_tokens=5, bytes_received=100)
+
+        self.assertEqual(
+            summarize(request_stats),
+            dict(
+                num_requests=3,
+                total_latency=6.0,
+                median_latency=2.0,
+                median_time_to_first_token=0.6,
+                median_tokens_per_sec=20.0,
+                completion_tokens=15,
+                bytes_received=300,
+                retries=2,
+            ),
+        )
@@ -0,0 +1,86 @@
+import unittest
+from unittest.mock import MagicMock, patch
+
+from aider import models, tokens
+from aider.dump import dump  # noqa: F401
+from aider.tokens import TokenLedger, count_tokens_batch, encode_batch, get_tokenizer
+
+
+class TestTokens(unittest.TestCase):
+    def test_get_tokenizer(self):
+        tokenizer = get_tokenizer(model_name="gpt-4")
+        self.assertIs(get_tokenizer(model_name="gpt-4"), tokenizer)
+        self.assertIs(models.Model.create("gpt-4").tokenizer, tokenizer)
+        self.assertEqual(get_tokenizer(encoding_name="cl100k_base").name, "cl100k_base")
+
+    def test_encode_batch(self):
+        tokenizer = get_tokenizer(model_name="gpt-4")
+        texts = [f"line {i}\n" * i for i in range(50)]
+        expected = [tokenizer.encode(text) for text in texts]
+
+        # small batches stay on this thread
+        self.assertEqual(encode_batch(tokenizer, texts), expected)
+
+        @patch.object(tokens, "min_batch_chars", 0)
+        @patch.object(tokens, "encode_pool", None)
+        @patch.object(tokens.os, "cpu_count", return_value=4)
+        def encode_in_pool(_mock_cpu_count):
+            res = encode_batch(tokenizer, texts)
+            self.assertIsNotNone(tokens.encode_pool)
+            tokens.encode_pool.shutdown()
+            return res
+
+        self.assertEqual(encode_in_pool(), expected)
+
+        counts = count_tokens_batch(tokenizer, texts)
+        self.assertEqual(counts, [len(res) for res in expected])
+
+
+class TestTokenLedger(unittest.TestCase):
+    def test_token_count(self):
+        model = models.Model.create("gpt-3.5-turbo")
+        ledger = TokenLedger(model)
+
+        self.assertEqual(ledger.token_count("hello world"), model.token_count("hello world"))
+
+        msg = dict(role="user", content="hello world")
+        self.assertEqual(ledger.token_count([msg]), model.token_count(msg))
+
+        messages = [msg, dict(role="assistant", content="Ok.")]
+        self.assertEqual(ledger.token_count(messages), sum(model.token_count(m) for m in messages))
+
+    def test_only_new_blocks_are_tokenized(self):
+        # not the shared instance from Model.create(), since the tokenizer gets replaced
+        model = models.OpenAIModel("gpt-3.5-turbo")
+        model.tokenizer = MagicMock(wraps=model.tokenizer)
+        ledger = TokenLedger(model)
+
+        files = dict(role="user", content="a big file\n" * 1000)
+        messages = [dict(role="system", content="be helpful"), files]
+        total = ledger.token_count(messages)
+        self.assertEqual(model.tokenizer.encode.call_count, 2)
+
+        messages.append(dict(role="user", content="next turn"))
+        self.assertGreater(ledger.token_count(messages), total)
+        self.assertEqual(model.tokenizer.encode.call_count, 3)
+        self.assertEqual((ledger.hits, ledger.misses), (2, 3))
+
+        # an edited file is a new block
+        files["content"] += "one more line\n"
+        ledger.token_count(messages)
+        self.assertEqual(model.tokenizer.encode.call_count, 4)
+
+    def test_max_entries(self):
+        model = models.Model.create("gpt-3.5-turbo")
+        ledger = TokenLedger(model, max_entries=2)
+
+        for text in ["one", "two", "three", "two"]:
+            ledger.token_count(text)
+
+        self.assertEqual(len(ledger.counts), 2)
+        self.assertEqual(ledger.misses, 3)
+
+    def test_no_tokenizer(self):
+        model = models.OpenAIModel("gpt-3.5-turbo")
+        model.tokenizer = None
+        self.assertIsNone(TokenLedger(model).token_count("hello"))
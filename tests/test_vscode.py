@@ -7,7 +7,7 @@ import requests
 class TestClient(unittest.TestCase):
     from unittest.mock import Mock
 
-    @patch('requests.get')
+    @patch('requests.Session.get')
     def test_get_prefixes(self, mock_get):
         # Arrange
         mock_get.return_value.status_code = 200
@@ -19,7 +19,7 @@ class TestClient(unittest.TestCase):
         # Assert
         self.assertEqual(titles, ['issue-', 'pr-'])
 
-    @patch('requests.get')
+    @patch('requests.Session.get')
     def test_get_titles(self, mock_get):
         # Arrange
         mock_get.return_value.status_code = 200
@@ -31,7 +31,7 @@ class TestClient(unittest.TestCase):
         # Assert
         self.assertEqual(titles, ['title1', 'title2', 'title3'])
 
-    @patch('requests.get')
+    @patch('requests.Session.get')
     def test_get_content(self, mock_get):
         # Arrange
         mock_get.return_value.status_code = 200
@@ -43,7 +43,7 @@ class TestClient(unittest.TestCase):
         # Assert
         self.assertEqual(content, 'content for title1')
 
-    @patch('requests.get')
+    @patch('requests.Session.get')
     def test_get_prefixes_timeout(self, mock_get):
         # Arrange
         mock_get.side_effect = requests.exceptions.Timeout
@@ -52,7 +52,7 @@ class TestClient(unittest.TestCase):
         with self.assertRaises(requests.exceptions.Timeout):
             vscode.get_prefixes(8080)
 
-    @patch('requests.get')
+    @patch('requests.Session.get')
     def test_get_content_timeout(self, mock_get):
         # Arrange
         mock_get.side_effect = requests.exceptions.Timeout
@@ -61,7 +61,7 @@ class TestClient(unittest.TestCase):
         with self.assertRaises(requests.exceptions.Timeout):
             vscode.get_content(8080, 'title1')
 
-    @patch('requests.get')
+    @patch('requests.Session.get')
     def test_get_titles_timeout(self, mock_get):
         # Arrange
         mock_get.side_effect = requests.exceptions.Timeout
@@ -70,7 +70,7 @@ class TestClient(unittest.TestCase):
         with self.assertRaises(requests.exceptions.Timeout):
             vscode.get_titles(8080)
 
-    @patch('requests.get')
+    @patch('requests.Session.get')
     def test_get_titles_404(self, mock_get):
         # Arrange
         mock_get.return_value.status_code = 404
@@ -79,7 +79,7 @@ class TestClient(unittest.TestCase):
         with self.assertRaises(Exception):
             vscode.get_titles(8080)
 
-    @patch('requests.get')
+    @patch('requests.Session.get')
     def test_get_content_404(self, mock_get):
         # Arrange
         mock_get.return_value.status_code = 404
@@ -87,4 +87,15 @@ class TestClient(unittest.TestCase):
         # Act
         with self.assertRaises(Exception):
             vscode.get_content(8080, 'title1')
-            
+
+    @patch('openai.proxy', 'http://proxy.example.com:8080')
+    @patch.object(vscode, 'session', None)
+    def test_session_skips_llm_proxies_and_retries(self):
+        # Act
+        session = vscode.get_session()
+
+        # Assert
+        self.assertIs(vscode.get_session(), session)
+        self.assertEqual(session.proxies, {})
+        self.assertFalse(session.trust_env)
+        self.assertEqual(session.get_adapter('http://localhost:8080').max_retries.total, 0)
@@ -0,0 +1,136 @@
+import os
+import time
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+from aider import watch
+from aider.dump import dump  # noqa: F401
+from aider.watch import FileWatcher
+from tests.utils import IgnorantTemporaryDirectory
+
+
+class TestFileWatcher(unittest.TestCase):
+    def wait_for(self, func, timeout=5):
+        start = time.time()
+        while time.time() - start < timeout:
+            if func():
+                return True
+            time.sleep(0.05)
+        return func()
+
+    def test_polling(self):
+        with IgnorantTemporaryDirectory() as temp_dir:
+            watcher = FileWatcher(temp_dir, watch=False)
+            self.assertFalse(watcher.is_watching())
+
+            fname = Path(temp_dir) / "file.txt"
+            self.assertIsNone(watcher.get_mtime(fname))
+            self.assertFalse(watcher.is_file(temp_dir))
+
+            fname.write_text("hello")
+            self.assertEqual(watcher.get_mtime(fname), os.path.getmtime(fname))
+            self.assertTrue(watcher.is_file(fname))
+
+    def test_falls_back_to_polling_without_watchdog(self):
+        with IgnorantTemporaryDirectory() as temp_dir:
+            with patch.object(watch, "Observer", None):
+                watcher = FileWatcher(temp_dir)
+            self.assertFalse(watcher.is_watching())
+
+            fname = Path(temp_dir) / "file.txt"
+            fname.write_text("hello")
+            self.assertTrue(watcher.is_file(fname))
+
+    @unittest.skipIf(watch.Observer is None, "watchdog is not installed")
+    def test_watching(self):
+        with IgnorantTemporaryDirectory() as temp_dir:
+            watcher = FileWatcher(temp_dir)
+            self.assertTrue(watcher.is_watching())
+
+            try:
+                fname = os.path.join(watcher.root, "file.txt")
+                self.assertIsNone(watcher.get_mtime(fname))
+
+                # unchanged files are not stat-ed again
+                with patch.object(watch, "stat_mtime") as mock_stat_mtime:
+                    self.assertIsNone(watcher.get_mtime(fname))
+                    mock_stat_mtime.assert_not_called()
+
+                Path(fname).write_text("hello")
+                self.assertTrue(self.wait_for(lambda: watcher.is_file(fname)))
+                self.assertEqual(watcher.get_mtime(fname), os.path.getmtime(fname))
+
+                os.remove(fname)
+                self.assertTrue(self.wait_for(lambda: not watcher.is_file(fname)))
+
+                # removing a dir forgets everything
+                subdir = os.path.join(watcher.root, "subdir")
+                os.mkdir(subdir)
+                sub_fname = os.path.join(subdir, "file.txt")
+                Path(sub_fname).write_text("hello")
+                self.assertTrue(self.wait_for(lambda: watcher.is_file(sub_fname)))
+
+                os.rename(subdir, subdir + ".moved")
+                self.assertTrue(self.wait_for(lambda: not watcher.is_file(sub_fname)))
+            finally:
+                watcher.stop()
+
+    @unittest.skipIf(watch.Observer is None, "watchdog is not installed")
+    def test_invalidate(self):
+        with IgnorantTemporaryDirectory() as temp_dir:
+            watcher = FileWatcher(temp_dir)
+            try:
+                fname = os.path.join(watcher.root, "file.txt")
+                self.assertIsNone(watcher.get_mtime(fname))
+
+                # pretend the event hasn't arrived yet
+                with patch.object(watcher, "on_change"):
+                    Path(fname).write_text("hello")
+                    time.sleep(0.1)
+
+                watcher.invalidate(fname)
+                self.assertTrue(watcher.is_file(fname))
+            finally:
+                watcher.stop()
+
+    @unittest.skipIf(watch.Observer is None, "watchdog is not installed")
+    def test_ignored_dirs_are_not_watched(self):
+        with IgnorantTemporaryDirectory() as temp_dir:
+            for dname in (".git", "build", "src", os.path.join("src", "node_modules")):
+                os.mkdir(os.path.join(temp_dir, dname))
+
+            ignored = [os.path.join("src", "node_modules"), "build"]
+            watcher = FileWatcher(temp_dir, ignored_dirs=ignored)
+            try:
+                watched = set(
+                    (emitter.watch.path, emitter.watch.is_recursive)
+                    for emitter in watcher.observer.emitters
+                )
+                root = watcher.root
+                self.assertEqual(watched, {(root, False), (os.path.join(root, "src"), False)})
+
+                # the files in them are always stat-ed
+                build_fname = os.path.join(root, "build", "out.txt")
+                self.assertIsNone(watcher.get_mtime(build_fname))
+                Path(build_fname).write_text("hello")
+                self.assertTrue(watcher.is_file(build_fname))
+                self.assertFalse(watcher.is_watched(os.path.join(root, ".git", "index")))
+
+                # new dirs get watched with their subdirs
+                new_fname = os.path.join(root, "lib", "sub", "file.txt")
+                os.makedirs(os.path.dirname(new_fname))
+                self.assertTrue(
+                    self.wait_for(
+                        lambda: (os.path.join(root, "lib"), True)
+                        in set(
+                            (emitter.watch.path, emitter.watch.is_recursive)
+                            for emitter in watcher.observer.emitters
+                        )
+                    )
+                )
+                self.assertIsNone(watcher.get_mtime(new_fname))
+                Path(new_fname).write_text("hello")
+                self.assertTrue(self.wait_for(lambda: watcher.is_file(new_fname)))
+            finally:
+                watcher.stop()